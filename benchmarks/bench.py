@@ -0,0 +1,263 @@
+"""Benchmarks for doctag.
+
+Run from the repository root, save the results, and compare them with an earlier run:
+
+    python benchmarks/bench.py --out new.json --compare old.json
+
+Every run is seeded, so two runs build exactly the same indexes. Each timing is the
+best of ``--repeat`` runs, in seconds per call. ``--compare`` exits with status 1 if any benchmark got
+slower than the old run by more than ``--threshold``.
+"""
+
+import argparse
+import gc
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import ujson
+
+# Benchmark the checkout this file is in, not whichever doctag is installed.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import doctag  # noqa: E402
+
+Pair = Tuple[str, str]
+
+DISTRIBUTIONS = ("even", "tag_heavy", "doc_heavy")
+QUERIES = {
+    "single": "{0}",
+    "and": "{0} and {1}",
+    "or": "{0} or {1} or {2}",
+    "not": "not {0}",
+    "mixed": "({0} or {1}) and not {2}",
+    "prefix": "tag_1*",
+}
+
+
+def make_pairs(distribution: str, scale: int, seed: int = 0) -> List[Pair]:
+    """The (doc, tag) calls of the old performance notebook, at any scale.
+
+    ``even`` spreads ``scale`` calls over about as many docs and tags, ``tag_heavy``
+    puts them all on 50 docs and ``doc_heavy`` uses only 50 tags.
+    """
+    rng = random.Random(seed)
+    docs = [f"doc_{rng.randrange(2 * scale)}" for _ in range(scale)]
+    tags = [f"tag_{rng.randrange(4 * scale)}" for _ in range(scale)]
+    if distribution == "even":
+        return list(zip(docs, tags))
+    elif distribution == "tag_heavy":
+        return [(docs[i % 50], tags[i]) for i in range(scale)]
+    elif distribution == "doc_heavy":
+        return [(docs[i], tags[i % 50]) for i in range(scale)]
+    raise ValueError(f"Unknown distribution '{distribution}'.")
+
+
+def measure(
+    run: Callable[[], object],
+    setup: Optional[Callable[[], None]] = None,
+    repeat: int = 5,
+    number: int = 1,
+) -> dict:
+    # Seconds per call to run(), which is called `number` times per timing.
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                run()
+            timings.append((time.perf_counter() - start) / number)
+        finally:
+            gc.enable()
+    return {"seconds": min(timings), "median": statistics.median(timings)}
+
+
+def build(engine, pairs: List[Pair]):
+    ti = engine()
+    for doc, tag in pairs:
+        ti.tag(docs=doc, tags=tag)
+    return ti
+
+
+def bench_index(
+    engine, distribution: str, scale: int, repeat: int, seed: int, tmp: str
+) -> Dict[str, dict]:
+    results = {}
+    pairs = make_pairs(distribution, scale, seed=seed)
+    state: dict = {}
+
+    results["tag"] = measure(
+        lambda: state.update(ti=build(engine, pairs)), repeat=repeat
+    )
+    results["tag"]["ops"] = len(pairs)
+    ti = state["ti"]
+    results["tag"].update(docs=len(ti.docs), tags=len(ti.tags))
+
+    def untag():
+        index = state["ti"]
+        for doc, tag in pairs:
+            index.untag(docs=doc, tags=tag)
+
+    results["untag"] = measure(
+        untag, setup=lambda: state.update(ti=build(engine, pairs)), repeat=repeat
+    )
+    results["untag"]["ops"] = len(pairs)
+
+    rng = random.Random(seed)
+    terms = rng.sample(sorted(ti.tags), 3)
+    for name, template in QUERIES.items():
+        query = template.format(*terms)
+        ti.query(query)
+        result = measure(lambda: ti.query(query), repeat=repeat, number=100)
+        result.update(query=query, matches=ti.query_count(query))
+        results[f"query/{name}"] = result
+
+    at = os.path.join(tmp, f"{engine.__name__}-{distribution}-{scale}.json")
+
+    def round_trip():
+        ti.to_json(at=at)
+        engine.from_json(at)
+
+    results["json"] = measure(round_trip, repeat=repeat)
+    results["json"]["bytes"] = os.path.getsize(at)
+    return results
+
+
+def bench_files(
+    distribution: str, scale: int, repeat: int, seed: int, tmp: str
+) -> Dict[str, dict]:
+    results = {}
+    pairs = make_pairs(distribution, scale, seed=seed)
+    files = sorted({doc for doc, _ in pairs})
+    root = os.path.join(tmp, f"files-{distribution}-{scale}")
+
+    paths = {
+        doc: os.path.join(root, f"dir_{i % 16}", f"{doc}.md")
+        for i, doc in enumerate(files)
+    }
+
+    def make_tree():
+        for path in paths.values():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as doc_:
+                doc_.write("Some text.\n" * 50)
+
+    def tag():
+        fti = doctag.FileTagIndex(root_dir=root)
+        for doc, tag_ in pairs:
+            fti.tag(docs=paths[doc], tags=tag_)
+
+    results["tag"] = measure(tag, setup=make_tree, repeat=repeat)
+    results["tag"]["ops"] = len(pairs)
+
+    def scan():
+        doctag.FileTagIndex(root_dir=root).scan()
+
+    results["scan"] = measure(scan, repeat=repeat)
+    results["scan"]["files"] = len(files)
+    return results
+
+
+def run(args) -> dict:
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            for distribution in args.distributions:
+                for name in args.engines:
+                    engine = getattr(doctag, name)
+                    timings = bench_index(
+                        engine, distribution, scale, args.repeat, args.seed, tmp
+                    )
+                    for bench, result in timings.items():
+                        results[f"{name}/{distribution}/{scale}/{bench}"] = result
+                    print(f"{name} {distribution} {scale}", file=sys.stderr)
+        for scale in args.file_scales:
+            for distribution in args.distributions:
+                timings = bench_files(distribution, scale, args.repeat, args.seed, tmp)
+                for bench, result in timings.items():
+                    results[f"FileTagIndex/{distribution}/{scale}/{bench}"] = result
+                print(f"FileTagIndex {distribution} {scale}", file=sys.stderr)
+    return {"meta": metadata(args), "results": results}
+
+
+def metadata(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed": args.seed,
+        "repeat": args.repeat,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    """Print new against old timings; return the benchmarks which regressed."""
+    regressed = []
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before, after = old["results"][name]["seconds"], result["seconds"]
+        ratio = after / before if before else 1.0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  SLOWER"
+            regressed.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = "  faster"
+        print(f"{name:<45} {before:>10.3g} {after:>10.3g} {ratio:>6.2f}x{flag}")
+    return regressed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="*", default=[2500, 25000])
+    parser.add_argument("--file-scales", type=int, nargs="*", default=[500])
+    parser.add_argument(
+        "--distributions", nargs="*", default=list(DISTRIBUTIONS), choices=DISTRIBUTIONS
+    )
+    parser.add_argument("--engines", nargs="*", default=["TagIndex", "BitmapTagIndex"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results here as JSON")
+    parser.add_argument("--compare", help="an earlier --out file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.out:
+        with open(args.out, "w") as to_file:
+            ujson.dump(report, to_file, indent=2, escape_forward_slashes=False)
+    else:
+        print(ujson.dumps(report, indent=2, escape_forward_slashes=False))
+    if args.compare:
+        with open(args.compare, "r") as from_file:
+            old = ujson.load(from_file)
+        regressed = compare(old, report, args.threshold)
+        if regressed:
+            print(f"{len(regressed)} benchmarks got slower.", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
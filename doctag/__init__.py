@@ -1,2 +1,9 @@
+from .bitmaptagindex import BitmapTagIndex
+from .concurrenttagindex import ConcurrentTagIndex
 from .filetagindex import FileTagIndex
+from .mappedtagindex import MappedTagIndex
+from .pairs import read_pairs, write_pairs
+from .profiling import Profiler
+from .shardedtagindex import ShardedTagIndex
+from .snapshot import Snapshot, binary_to_json, json_to_binary
 from .tagindex import TagIndex
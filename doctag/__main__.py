@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+
+
+def serve(args):
+    from .server import TagServer
+    from .tagindex import TagIndex
+
+    cls = TagIndex
+    if args.files:
+        from .filetagindex import FileTagIndex
+
+        cls = FileTagIndex
+    if os.path.exists(args.index):
+        index = cls.from_json(args.index, wal=args.wal)
+    elif args.files:
+        raise SystemExit(f"'{args.index}' not found; build it with FileTagIndex.scan.")
+    else:
+        index = cls(at=args.index, wal=args.wal)
+    server = TagServer(
+        index,
+        path=args.socket,
+        host=args.host,
+        port=args.port,
+        checkpoint_interval=args.checkpoint,
+    )
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.checkpoint()
+
+
+def query(args):
+    from .client import Client
+
+    with Client(path=args.socket, host=args.host, port=args.port) as client:
+        if args.count:
+            print(client.count(args.query))
+        else:
+            for doc in client.query(args.query):
+                print(doc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="doctag")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_ in [("serve", "serve an index"), ("query", "query a server")]:
+        command = commands.add_parser(name, help=help_)
+        connection = command.add_mutually_exclusive_group(required=True)
+        connection.add_argument("--socket", help="unix socket path")
+        connection.add_argument("--port", type=int, help="TCP port on --host")
+        command.add_argument("--host", default="127.0.0.1")
+        command.set_defaults(func=globals()[name])
+    commands.choices["serve"].add_argument("index", help="index JSON file")
+    commands.choices["serve"].add_argument(
+        "--files", action="store_true", help="load a FileTagIndex"
+    )
+    commands.choices["serve"].add_argument("--wal", action="store_true")
+    commands.choices["serve"].add_argument(
+        "--checkpoint", type=float, default=60.0, help="seconds between saves"
+    )
+    commands.choices["query"].add_argument("query")
+    commands.choices["query"].add_argument("--count", action="store_true")
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
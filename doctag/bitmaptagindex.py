@@ -0,0 +1,272 @@
+from array import array
+from bisect import bisect_left, insort
+from itertools import chain, filterfalse
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set
+
+from .snapshot import Snapshot
+from .tagindex import PlanNode, TagIndex, _verify_checksum
+
+# Up to this many ids are added to or removed from postings one by one; past it the
+# postings are rebuilt in one pass instead of shifted once per id.
+_SMALL_UPDATE = 16
+
+
+def _insert(postings: array, ids: List[int]) -> int:
+    """Add ``ids`` to the sorted ``postings`` in place; returns how many were new."""
+    before = len(postings)
+    if len(ids) <= _SMALL_UPDATE:
+        for id_ in ids:
+            i = bisect_left(postings, id_)
+            if i == len(postings) or postings[i] != id_:
+                postings.insert(i, id_)
+    else:
+        # Sorting runs of sorted ids merges them, and dict.fromkeys drops repeats.
+        postings[:] = array("I", dict.fromkeys(sorted(chain(postings, ids))))
+    return len(postings) - before
+
+
+def _remove(postings: array, ids: List[int]) -> int:
+    """Drop ``ids`` from the sorted ``postings`` in place; returns how many were there."""
+    before = len(postings)
+    if len(ids) <= _SMALL_UPDATE:
+        for id_ in ids:
+            i = bisect_left(postings, id_)
+            if i < len(postings) and postings[i] == id_:
+                del postings[i]
+    else:
+        postings[:] = array("I", filterfalse(set(ids).__contains__, postings))
+    return before - len(postings)
+
+
+def _intersect(postings: array, other: array) -> array:
+    if len(postings) > len(other):
+        postings, other = other, postings
+    if len(postings) * _SMALL_UPDATE < len(other):
+        # Much smaller: look each id up in the other postings rather than hash them.
+        found = []
+        for id_ in postings:
+            i = bisect_left(other, id_)
+            if i < len(other) and other[i] == id_:
+                found.append(id_)
+        return array("I", found)
+    return array("I", filter(set(other).__contains__, postings))
+
+
+class _BitmapView(Mapping):
+    """Read-only ``Dict[str, Set[str]]`` view over one direction of the index."""
+
+    def __init__(
+        self, ids: Dict[str, int], postings: Dict[int, array], names: List[str]
+    ):
+        self._ids = ids
+        self._postings = postings
+        self._names = names
+
+    def __getitem__(self, key: str) -> Set[str]:
+        id_ = self._ids.get(key)
+        if id_ is None:
+            return set()
+        return {self._names[i] for i in self._postings[id_]}
+
+    def __contains__(self, key) -> bool:
+        return key in self._ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._ids else default
+
+
+class BitmapTagIndex(TagIndex):
+    """A TagIndex which interns docs and tags to dense integer ids.
+
+    Each tag's postings (and each doc's tags) are stored as a sorted ``array('I')`` of
+    ids, four bytes per pair however sparse the index is, and a tag's size is just the
+    length of its postings. Boolean queries combine postings of ids rather than
+    hash sets of strings. ``tag_to_docs`` and ``doc_to_tags`` are read-only views
+    which decode back to sets of names.
+    """
+
+    def _init_storage(self):
+        self._doc_ids: Dict[str, int] = {}
+        self._doc_names: List[str] = []
+        self._free_doc_ids: List[int] = []
+        self._tag_ids: Dict[str, int] = {}
+        self._tag_names: List[str] = []
+        self._free_tag_ids: List[int] = []
+        self._tag_postings: Dict[int, array] = {}
+        self._doc_postings: Dict[int, array] = {}
+        self._pairs: Optional[int] = None
+        self.tag_to_docs = _BitmapView(  # type: ignore
+            self._tag_ids, self._tag_postings, self._doc_names
+        )
+        self.doc_to_tags = _BitmapView(  # type: ignore
+            self._doc_ids, self._doc_postings, self._tag_names
+        )
+
+    @property
+    def tags(self):
+        return self._tag_ids.keys()
+
+    @property
+    def docs(self):
+        return self._doc_ids.keys()
+
+    def get_docs(self, tag: str):
+        return self.tag_to_docs[tag]
+
+    @staticmethod
+    def _intern(name: str, ids: Dict[str, int], names: List[str], free: List[int]):
+        id_ = ids.get(name)
+        if id_ is None:
+            if free:
+                id_ = free.pop()
+                names[id_] = name
+            else:
+                id_ = len(names)
+                names.append(name)
+            ids[name] = id_
+        return id_
+
+    @staticmethod
+    def _release(name: str, ids: Dict[str, int], names: List[str], free: List[int]):
+        id_ = ids.pop(name)
+        names[id_] = ""
+        free.append(id_)
+
+    def _tag(self, docs: Iterable[str], tags: Iterable[str]):
+        docs, tags = list(docs), list(tags)
+        if not docs or not tags:
+            # As in TagIndex, no pair is made, so neither side gets a name.
+            return
+        if self._sorted_tags is not None:
+            for tag in tags:
+                if tag not in self._tag_ids:
+                    insort(self._sorted_tags, tag)
+        tag_ids = [
+            self._intern(tag, self._tag_ids, self._tag_names, self._free_tag_ids)
+            for tag in tags
+        ]
+        doc_ids = [
+            self._intern(doc, self._doc_ids, self._doc_names, self._free_doc_ids)
+            for doc in docs
+        ]
+        for doc_id in doc_ids:
+            postings = self._doc_postings.get(doc_id)
+            if postings is None:
+                postings = self._doc_postings[doc_id] = array("I")
+            added = _insert(postings, tag_ids)
+            if self._pairs is not None:
+                self._pairs += added
+        for tag_id in tag_ids:
+            postings = self._tag_postings.get(tag_id)
+            if postings is None:
+                postings = self._tag_postings[tag_id] = array("I")
+            _insert(postings, doc_ids)
+
+    def _untag(self, docs: Iterable[str], tags: Iterable[str]):
+        tag_ids = [self._tag_ids[tag] for tag in tags if tag in self._tag_ids]
+        doc_ids = [self._doc_ids[doc] for doc in docs if doc in self._doc_ids]
+        if not tag_ids or not doc_ids:
+            return
+        for tag_id in tag_ids:
+            postings = self._tag_postings[tag_id]
+            _remove(postings, doc_ids)
+            if not postings:
+                del self._tag_postings[tag_id]
+                self._unindex_tag(self._tag_names[tag_id])
+                self._release(
+                    self._tag_names[tag_id],
+                    self._tag_ids,
+                    self._tag_names,
+                    self._free_tag_ids,
+                )
+        for doc_id in doc_ids:
+            postings = self._doc_postings[doc_id]
+            removed = _remove(postings, tag_ids)
+            if self._pairs is not None:
+                self._pairs -= removed
+            if not postings:
+                del self._doc_postings[doc_id]
+                self._release(
+                    self._doc_names[doc_id],
+                    self._doc_ids,
+                    self._doc_names,
+                    self._free_doc_ids,
+                )
+
+    def _load_serial(self, serial: dict):
+        if "doc_to_tags" in serial.keys():
+            _verify_checksum(serial, serial["doc_to_tags"])
+            for doc, tags in serial["doc_to_tags"].items():
+                self._tag(docs=[str(doc)], tags=[str(tag) for tag in tags])
+        elif "tag_to_docs" in serial.keys():
+            _verify_checksum(serial, serial["tag_to_docs"])
+            for tag, docs in serial["tag_to_docs"].items():
+                self._tag(docs=[str(doc) for doc in docs], tags=[str(tag)])
+        else:
+            raise ValueError(
+                "File does not contain 'tag_to_docs' or 'doc_to_tags' index."
+            )
+
+    def _load_snapshot(self, snapshot: Snapshot):
+        # Snapshot ids are dense and sorted by name, so they are adopted as-is.
+        self._doc_names.extend(snapshot.doc_names())
+        self._tag_names.extend(snapshot.tag_names())
+        self._doc_ids.update((doc, i) for i, doc in enumerate(self._doc_names))
+        self._tag_ids.update((tag, i) for i, tag in enumerate(self._tag_names))
+        for tag_id in range(snapshot.tag_count):
+            self._tag_postings[tag_id] = array("I", snapshot.tag_postings(tag_id))
+        for doc_id in range(snapshot.doc_count):
+            self._doc_postings[doc_id] = array("I", snapshot.doc_postings(doc_id))
+        self._pairs = snapshot.pair_count
+
+    def _lazy(self, node: PlanNode) -> array:
+        # Postings are combined a whole array at a time, in C, which beats checking
+        # them doc by doc in Python, so streamed queries are evaluated as usual.
+        return self._run(node)
+
+    def _postings(self, tag: str) -> array:
+        tag_id = self._tag_ids.get(tag)
+        return array("I") if tag_id is None else self._tag_postings[tag_id]
+
+    def _postings_empty(self) -> array:
+        return array("I")
+
+    def _union(self, postings: list) -> array:
+        return array("I", dict.fromkeys(sorted(chain.from_iterable(postings))))
+
+    def _intersect(self, postings: array, other: array) -> array:
+        return _intersect(postings, other)
+
+    def _complement(self, postings: array) -> array:
+        return self._difference(array("I", sorted(self._doc_postings)), postings)
+
+    def _difference(self, postings: array, other: array) -> array:
+        return array("I", filterfalse(set(other).__contains__, postings))
+
+    def _count_pairs(self) -> int:
+        return sum(map(len, self._doc_postings.values()))
+
+    def _tag_size(self, tag: str) -> int:
+        tag_id = self._tag_ids.get(tag)
+        return 0 if tag_id is None else len(self._tag_postings[tag_id])
+
+    def _universe_size(self) -> int:
+        return len(self._doc_ids)
+
+    def _decode(self, postings: array) -> set:
+        return {self._doc_names[i] for i in postings}
+
+    def _size(self, postings: array) -> int:
+        return len(postings)
+
+    def _iter_postings(self, postings: array) -> Iterator[str]:
+        return (self._doc_names[i] for i in postings)
+
+    def _iter_complement(self, postings: array) -> Iterator[str]:
+        return self._iter_postings(self._complement(postings))
@@ -0,0 +1,88 @@
+import builtins
+import socket
+from typing import Any, Iterable, List, Optional, Tuple, Union
+
+import ujson
+
+
+class Client:
+    """A blocking client for a TagServer, cheap enough for one-shot queries.
+
+    Connect with the server's unix socket ``path`` or its TCP ``port``. ``pipeline``
+    sends a batch of ``(op, params)`` requests in one write and then reads every
+    reply, so a batch costs one round trip.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        if (path is None) == (port is None):
+            raise ValueError("Connect to either a unix socket 'path' or a TCP 'port'.")
+        if path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address: Union[str, Tuple[str, int]] = path
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (host, port)  # type: ignore
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._file = self._socket.makefile("rb")
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.close()
+
+    def request(self, op: str, **params) -> Any:
+        return self.pipeline([(op, params)])[0]
+
+    def pipeline(self, requests: Iterable[Tuple[str, dict]]) -> List[Any]:
+        lines = [ujson.dumps({"op": op, **params}) + "\n" for op, params in requests]
+        self._socket.sendall("".join(lines).encode("utf-8"))
+        results = []
+        error = None
+        for _ in lines:
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("Server closed the connection.")
+            response = ujson.loads(line)
+            if "error" in response and error is None:
+                error = self._error(response["error"], response["message"])
+            results.append(response.get("result"))
+        if error is not None:
+            raise error
+        return results
+
+    @staticmethod
+    def _error(name: str, message: str) -> Exception:
+        error = getattr(builtins, name, None)
+        if isinstance(error, type) and issubclass(error, Exception):
+            return error(message)
+        return RuntimeError(f"{name}: {message}")
+
+    def query(self, query: str, **params) -> List[str]:
+        return self.request("query", query=query, **params)
+
+    def count(self, query: str) -> int:
+        return self.request("count", query=query)
+
+    def get_docs(self, tag: str) -> List[str]:
+        return self.request("get_docs", tag=tag)
+
+    def tag(self, docs: Union[str, List[str]], tags: Union[str, List[str]]):
+        self.request("tag", docs=docs, tags=tags)
+
+    def untag(self, docs: Union[str, List[str]], tags: Union[str, List[str]]):
+        self.request("untag", docs=docs, tags=tags)
+
+    def checkpoint(self):
+        self.request("checkpoint")
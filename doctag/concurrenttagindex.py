@@ -0,0 +1,436 @@
+import threading
+from bisect import bisect_left
+from collections.abc import ItemsView, Mapping, ValuesView
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .snapshot import Snapshot
+from .tagindex import IndexStats, TagIndex, _prefix_end
+
+
+class _Items(ItemsView):
+    def __iter__(self):
+        for bucket in self._mapping._buckets:
+            yield from bucket.items()
+
+
+class _Values(ValuesView):
+    def __iter__(self):
+        for bucket in self._mapping._buckets:
+            yield from bucket.values()
+
+
+class _Shared(Mapping):
+    """A dict split into buckets by key hash, so that a copy can share every bucket
+    it doesn't change.
+
+    ``copy()`` copies only the list of buckets, and the copy copies each bucket on
+    its first change. The number of buckets is kept near the square root of the
+    size, so a write which touches k keys copies O(k * sqrt(n)) entries, not O(n).
+    """
+
+    min_buckets = 8
+
+    def __init__(self, items: Optional[Mapping] = None):
+        size = len(items) if items is not None else 0
+        count = self.min_buckets
+        while count * count < size:
+            count *= 2
+        self._buckets: List[dict] = [{} for _ in range(count)]
+        self._size = 0
+        self._owned: Set[int] = set(range(count))
+        if items is not None:
+            for key, value in items.items():
+                self[key] = value
+
+    def copy(self) -> "_Shared":
+        copy = _Shared.__new__(_Shared)
+        copy._buckets = list(self._buckets)
+        copy._size = self._size
+        copy._owned = set()
+        return copy
+
+    def freeze(self):
+        # Called when published; any later write goes through a copy.
+        self._owned = set()
+
+    def __getitem__(self, key):
+        return self._buckets[hash(key) & (len(self._buckets) - 1)][key]
+
+    def get(self, key, default=None):
+        return self._buckets[hash(key) & (len(self._buckets) - 1)].get(key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self._buckets[hash(key) & (len(self._buckets) - 1)]
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+    def __len__(self) -> int:
+        return self._size
+
+    def items(self):
+        return _Items(self)
+
+    def values(self):
+        return _Values(self)
+
+    def _writable(self, key) -> dict:
+        i = hash(key) & (len(self._buckets) - 1)
+        if i not in self._owned:
+            self._buckets[i] = dict(self._buckets[i])
+            self._owned.add(i)
+        return self._buckets[i]
+
+    def __setitem__(self, key, value):
+        bucket = self._writable(key)
+        if key not in bucket:
+            self._size += 1
+        bucket[key] = value
+        if self._size > len(self._buckets) ** 2:
+            self._rehash(2 * len(self._buckets))
+
+    def __delitem__(self, key):
+        del self._writable(key)[key]
+        self._size -= 1
+
+    def _rehash(self, count: int):
+        # Only ever on a working copy, which then owns every (new) bucket.
+        buckets: List[dict] = [{} for _ in range(count)]
+        for bucket in self._buckets:
+            for key, value in bucket.items():
+                buckets[hash(key) & (count - 1)][key] = value
+        self._buckets = buckets
+        self._owned = set(range(count))
+
+
+class _Version:
+    """One published state of a ConcurrentTagIndex; never changed once published."""
+
+    def __init__(self, tag_to_docs: _Shared, doc_to_tags: _Shared):
+        self.tag_to_docs = tag_to_docs
+        self.doc_to_tags = doc_to_tags
+        self.sorted_tags: Optional[List[str]] = None
+        # Total doc/tag pairs, if counted; kept up to date by each write.
+        self.pairs: Optional[int] = None
+        # Keys whose sets were copied for the write in progress and may be changed
+        # in place; only used while this is the writer's working version.
+        self.owned_tags: Set[str] = set()
+        self.owned_docs: Set[str] = set()
+
+
+def _owned(index: _Shared, owned: Set[str], key: str) -> Set[str]:
+    value = index.get(key) if key in owned else None
+    if value is None:
+        value = index[key] = set(index.get(key, ()))
+        owned.add(key)
+    return value
+
+
+class _Current(Mapping):
+    # The doc_to_tags of the version the reading thread sees, for the co-occurrence
+    # counts, which outlive every version.
+    def __init__(self, index: "ConcurrentTagIndex"):
+        self._index = index
+
+    def __getitem__(self, doc: str) -> Set[str]:
+        return self._index._view().doc_to_tags[doc]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index._view().doc_to_tags)
+
+    def __len__(self) -> int:
+        return len(self._index._view().doc_to_tags)
+
+
+def _reading(method):
+    # Run a method which reads the index more than once against one version.
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._pinned():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _co_occurring(method):
+    # The counts are brought up to date from one version, pinned under the lock so
+    # that any write published since has either been seen or is touched after.
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._cooccurrence_lock, self._pinned():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class ConcurrentTagIndex(TagIndex):
+    """A TagIndex which may be queried from many threads while another one writes.
+
+    The index state is an immutable version. Readers pin the current version for a
+    whole query without taking a lock, so a query never sees half of a write.
+    Writers are serialized by a lock. Each write works on a copy of the latest
+    version, which shares all of it but the buckets of keys (see _Shared) and the
+    postings that the write changes; those are copied on first change. The copy is
+    published when the write finishes, by swapping one reference. A ``batch()``
+    counts as a single write, so it pays for one copy and is published all at once.
+    """
+
+    def _init_storage(self):
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._version = _Version(_Shared(), _Shared())
+        self._working: Optional[_Version] = None
+        self._writer: Optional[int] = None
+        self._cache_lock = threading.Lock()
+        self._cooccurrence_lock = threading.RLock()
+
+    def _view(self) -> _Version:
+        if self._working is not None and self._writer == threading.get_ident():
+            return self._working
+        return getattr(self._local, "version", None) or self._version
+
+    @property  # type: ignore
+    def tag_to_docs(self) -> _Shared:  # type: ignore
+        return self._view().tag_to_docs
+
+    @property  # type: ignore
+    def doc_to_tags(self) -> _Shared:  # type: ignore
+        return self._view().doc_to_tags
+
+    @property
+    def tags(self):
+        with self._pinned():
+            return super().tags
+
+    @property
+    def docs(self):
+        with self._pinned():
+            return super().docs
+
+    @property
+    def conflicts(self) -> Set[str]:
+        with self._pinned():
+            return super().conflicts
+
+    get_docs = _reading(TagIndex.get_docs)
+    doc_tag_count = _reading(TagIndex.doc_tag_count)
+    top_tags = _reading(TagIndex.top_tags)
+    match_tags = _reading(TagIndex.match_tags)
+    to_binary = _reading(TagIndex.to_binary)
+    _serialize = _reading(TagIndex._serialize)
+
+    def stats(self) -> IndexStats:
+        version = self._view()
+        if version.pairs is None:
+            # Counting a version always gives the same answer, so it can be kept
+            # even on a published one.
+            version.pairs = sum(len(tags) for tags in version.doc_to_tags.values())
+        return IndexStats(
+            docs=len(version.doc_to_tags),
+            tags=len(version.tag_to_docs),
+            pairs=version.pairs,
+        )
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            if self._working is not None:
+                yield
+                return
+            current = self._version
+            self._working = _Version(
+                current.tag_to_docs.copy(), current.doc_to_tags.copy()
+            )
+            # Never changed in place, only dropped when the set of tags changes.
+            self._working.sorted_tags = current.sorted_tags
+            self._working.pairs = current.pairs
+            self._writer = threading.get_ident()
+            try:
+                yield
+            finally:
+                working, self._working = self._working, None
+                self._writer = None
+                changed = working.owned_docs
+                working.owned_tags, working.owned_docs = set(), set()
+                working.tag_to_docs.freeze()
+                working.doc_to_tags.freeze()
+                self._version = working
+                if changed:
+                    # Touched again once published, in case a reader reread them,
+                    # or built the counts, from the previous version meanwhile.
+                    with self._cooccurrence_lock:
+                        if self._cooccurrence is not None:
+                            self._cooccurrence.touch(changed)
+
+    @contextmanager
+    def _pinned(self):
+        if getattr(self._local, "version", None) is not None:
+            yield
+            return
+        self._local.version = self._view()
+        try:
+            yield
+        finally:
+            self._local.version = None
+
+    def tag(self, docs, tags):
+        with self._write():
+            super().tag(docs=docs, tags=tags)
+
+    def untag(self, docs, tags):
+        with self._write():
+            super().untag(docs=docs, tags=tags)
+
+    def remove_tag(self, tag: str):
+        with self._write():
+            super().remove_tag(tag)
+
+    def remove_doc(self, doc_name: str):
+        with self._write():
+            super().remove_doc(doc_name)
+
+    def _set_doc_tags(self, doc: str, tags: Iterable[str]):
+        with self._write():
+            super()._set_doc_tags(doc=doc, tags=tags)
+
+    def _bulk_tag(self, by_doc: Dict[str, List[str]]):
+        # Each chunk of a bulk_load is published as one write.
+        with self._write():
+            super()._bulk_tag(by_doc)
+
+    def register_view(self, name: str, query: str):
+        with self._write():
+            return super().register_view(name, query)
+
+    def unregister_view(self, name: str):
+        with self._write():
+            super().unregister_view(name)
+
+    def _co_occurrence(self):
+        from .cooccurrence import CoOccurrence
+
+        with self._cooccurrence_lock:
+            if self._cooccurrence is None:
+                self._cooccurrence = CoOccurrence(_Current(self))
+            return self._cooccurrence
+
+    related_tags = _co_occurring(TagIndex.related_tags)
+    co_occurrence = _co_occurring(TagIndex.co_occurrence)
+    similarity = _co_occurring(TagIndex.similarity)
+
+    def _freeze(self, view):
+        # Writers change the view in place, so copy it between writes, not during one.
+        # Only the lock is needed; a write would also copy the index.
+        with self._lock:
+            return super()._freeze(view)
+
+    @contextmanager
+    def batch(self):
+        with self._write(), super().batch():
+            yield self
+
+    def _replay_log(self):
+        with self._write():
+            super()._replay_log()
+
+    def _tag(self, docs: Iterable[str], tags: Iterable[str]):
+        version = self._working
+        if version is None:
+            raise RuntimeError("ConcurrentTagIndex._tag called outside a write.")
+        docs_, tags_ = list(docs), list(tags)
+        if not docs_ or not tags_:
+            return
+        for tag in tags_:
+            if tag not in version.tag_to_docs:
+                version.sorted_tags = None
+            _owned(version.tag_to_docs, version.owned_tags, tag).update(docs_)
+        for doc in docs_:
+            doc_tags = _owned(version.doc_to_tags, version.owned_docs, doc)
+            before = len(doc_tags)
+            doc_tags.update(tags_)
+            if version.pairs is not None:
+                version.pairs += len(doc_tags) - before
+
+    def _untag(self, docs: Iterable[str], tags: Iterable[str]):
+        version = self._working
+        if version is None:
+            raise RuntimeError("ConcurrentTagIndex._untag called outside a write.")
+        docs_, tags_ = list(docs), list(tags)
+        for tag in tags_:
+            if tag in version.tag_to_docs:
+                tag_docs = _owned(version.tag_to_docs, version.owned_tags, tag)
+                tag_docs.difference_update(docs_)
+                if not tag_docs:
+                    del version.tag_to_docs[tag]
+                    version.sorted_tags = None
+        for doc in docs_:
+            if doc in version.doc_to_tags:
+                doc_tags = _owned(version.doc_to_tags, version.owned_docs, doc)
+                before = len(doc_tags)
+                doc_tags.difference_update(tags_)
+                if version.pairs is not None:
+                    version.pairs -= before - len(doc_tags)
+                if not doc_tags:
+                    del version.doc_to_tags[doc]
+
+    def _load_serial(self, serial: dict):
+        loaded = TagIndex()
+        loaded._load_serial(serial)
+        self._version = _Version(
+            _Shared(loaded.tag_to_docs), _Shared(loaded.doc_to_tags)
+        )
+
+    def _load_snapshot(self, snapshot: Snapshot):
+        loaded = TagIndex()
+        loaded._load_snapshot(snapshot)
+        self._version = _Version(
+            _Shared(loaded.tag_to_docs), _Shared(loaded.doc_to_tags)
+        )
+        self._version.pairs = snapshot.pair_count
+
+    def _rebase(
+        self, serial: dict, records: Iterable[Tuple[str, List[str], List[str]]] = ()
+    ):
+        # Published as one write, so readers see the merged index all at once.
+        with self._write():
+            super()._rebase(serial, records)
+
+    def _reload(self, serial: dict):
+        loaded = TagIndex()
+        loaded._load_serial(serial)
+        self._working = _Version(
+            _Shared(loaded.tag_to_docs), _Shared(loaded.doc_to_tags)
+        )
+
+    def compile(self, query: str):
+        # The LRU cache is shared by every reader thread.
+        with self._cache_lock:
+            return super().compile(query)
+
+    def _tag_range(self, prefix: str) -> List[str]:
+        version = self._view()
+        tags = version.sorted_tags
+        if tags is None:
+            tags = version.sorted_tags = sorted(version.tag_to_docs)
+        if not prefix:
+            return tags[:]
+        return tags[bisect_left(tags, prefix) : bisect_left(tags, _prefix_end(prefix))]
+
+    def _execute(self, expression) -> set:
+        with self._pinned():
+            return super()._execute(expression)
+
+    def _execute_iter(self, expression) -> Iterator[str]:
+        with self._pinned():
+            return super()._execute_iter(expression)
+
+    def _execute_count(self, expression) -> int:
+        with self._pinned():
+            return super()._execute_count(expression)
+
+    def _plan_root(self, expression):
+        with self._pinned():
+            return super()._plan_root(expression)
@@ -0,0 +1,219 @@
+import threading
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+    sparse = None  # type: ignore
+
+MEASURES = ("count", "jaccard", "pmi")
+
+
+class CoOccurrence:
+    """Tag co-occurrence counts from a sparse doc x tag incidence matrix ``A``.
+
+    ``C = A.T @ A`` is built in bulk from the index, so ``C[a, b]`` is the number of
+    docs tagged both ``a`` and ``b`` and its diagonal holds the tag frequencies. Docs
+    passed to ``touch`` are reread at the next lookup. Their change goes into a small
+    delta matrix, which is folded into ``C`` once it grows past ``merge_ratio`` of it.
+    Lookups update those, so they're serialized with each other and with ``touch``.
+    """
+
+    merge_ratio = 0.1
+
+    def __init__(self, doc_to_tags: Mapping[str, Iterable[str]]):
+        if np is None:
+            raise ImportError("Related tags need numpy and scipy: doctag[related].")
+        self._doc_to_tags = doc_to_tags
+        self._tag_ids: Dict[str, int] = {}
+        self._tag_names: List[str] = []
+        self._doc_ids: Dict[str, int] = {}
+        # Rows of A rewritten since it was last built, by doc id.
+        self._rows: Dict[int, "np.ndarray"] = {}
+        self._dirty: Set[str] = set()
+        self._lock = threading.RLock()
+        self._build()
+
+    def _build(self):
+        tag_ids, tag_names, doc_ids = self._tag_ids, self._tag_names, self._doc_ids
+        indptr = [0]
+        indices: List[int] = []
+        for doc, tags in self._doc_to_tags.items():
+            doc_ids[doc] = len(doc_ids)
+            for tag in tags:
+                tag_id = tag_ids.get(tag)
+                if tag_id is None:
+                    tag_id = tag_ids[tag] = len(tag_names)
+                    tag_names.append(tag)
+                indices.append(tag_id)
+            indptr.append(len(indices))
+        self._A = sparse.csr_matrix(
+            (
+                np.ones(len(indices), dtype=np.int64),
+                np.array(indices, dtype=np.int64),
+                np.array(indptr, dtype=np.int64),
+            ),
+            shape=(len(doc_ids), len(tag_names)),
+        )
+        self._C = (self._A.T @ self._A).tocsr()
+        self._delta = sparse.csr_matrix(self._C.shape, dtype=np.int64)
+
+    def touch(self, docs: Iterable[str]):
+        with self._lock:
+            self._dirty.update(docs)
+
+    def _intern(self, tags: Iterable[str]) -> "np.ndarray":
+        tag_ids = []
+        for tag in tags:
+            tag_id = self._tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = self._tag_ids[tag] = len(self._tag_names)
+                self._tag_names.append(tag)
+            tag_ids.append(tag_id)
+        return np.array(tag_ids, dtype=np.int64)
+
+    def _row(self, doc_id: int) -> "np.ndarray":
+        if doc_id in self._rows:
+            return self._rows[doc_id]
+        elif doc_id < self._A.shape[0]:
+            return self._A.indices[self._A.indptr[doc_id] : self._A.indptr[doc_id + 1]]
+        return np.empty(0, dtype=np.int64)
+
+    def _sync(self):
+        if not self._dirty:
+            return
+        rows, cols, data = [], [], []
+        for doc in self._dirty:
+            doc_id = self._doc_ids.get(doc)
+            old = np.empty(0, dtype=np.int64) if doc_id is None else self._row(doc_id)
+            new = self._intern(self._doc_to_tags.get(doc, ()))
+            if doc_id is None:
+                if not len(new):
+                    continue
+                doc_id = self._doc_ids[doc] = len(self._doc_ids)
+            self._rows[doc_id] = new
+            # A doc with tag ids t adds the outer product of t with itself to C.
+            for ids, sign in ((old, -1), (new, 1)):
+                rows.append(np.repeat(ids, len(ids)))
+                cols.append(np.tile(ids, len(ids)))
+                data.append(np.full(len(ids) ** 2, sign, dtype=np.int64))
+        self._dirty.clear()
+        size = len(self._tag_names)
+        if self._C.shape[0] < size:
+            self._C.resize((size, size))
+            self._delta.resize((size, size))
+        if rows:
+            self._delta = self._delta + sparse.csr_matrix(
+                (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                shape=(size, size),
+            )
+        if self._delta.nnz > self.merge_ratio * max(self._C.nnz, 1) or len(
+            self._rows
+        ) > self.merge_ratio * max(self._A.shape[0], 1):
+            self._merge()
+
+    def _merge(self):
+        self._C = self._C + self._delta
+        self._C.eliminate_zeros()
+        self._delta = sparse.csr_matrix(self._C.shape, dtype=np.int64)
+        shape = (len(self._doc_ids), len(self._tag_names))
+        keep = np.ones(shape[0], dtype=np.int64)
+        keep[list(self._rows)] = 0
+        self._A.resize(shape)
+        doc_ids = np.array(list(self._rows), dtype=np.int64)
+        new_rows = list(self._rows.values())
+        lengths = np.array([len(row) for row in new_rows], dtype=np.int64)
+        rewritten = sparse.csr_matrix(
+            (
+                np.ones(lengths.sum(), dtype=np.int64),
+                (
+                    np.repeat(doc_ids, lengths),
+                    np.concatenate(new_rows + [np.empty(0, dtype=np.int64)]),
+                ),
+            ),
+            shape=shape,
+        )
+        self._A = (sparse.diags(keep, dtype=np.int64) @ self._A + rewritten).tocsr()
+        self._A.eliminate_zeros()
+        self._rows = {}
+
+    def _frequencies(self) -> "np.ndarray":
+        return self._C.diagonal() + self._delta.diagonal()
+
+    def count(self, tag_a: str, tag_b: str) -> int:
+        with self._lock:
+            self._sync()
+            a, b = self._tag_ids.get(tag_a), self._tag_ids.get(tag_b)
+            if a is None or b is None:
+                return 0
+            return int(self._C[a, b] + self._delta[a, b])
+
+    def _scores(
+        self, counts: "np.ndarray", frequency: int, frequencies: "np.ndarray", measure
+    ) -> "np.ndarray":
+        if measure == "count":
+            return counts
+        elif measure == "jaccard":
+            union = frequency + frequencies - counts
+            return np.divide(counts, union, out=np.zeros(len(counts)), where=union > 0)
+        elif measure == "pmi":
+            expected = frequency * frequencies.astype(float)
+            return np.log(
+                np.divide(
+                    counts * float(len(self._doc_to_tags)),
+                    expected,
+                    out=np.zeros(len(counts)),
+                    where=(counts > 0) & (expected > 0),
+                ),
+                out=np.full(len(counts), -np.inf),
+                where=counts > 0,
+            )
+        raise ValueError(f"Unknown measure '{measure}', expected one of {MEASURES}.")
+
+    def similarity(self, tag_a: str, tag_b: str, measure: str = "jaccard") -> float:
+        with self._lock:
+            self._sync()
+            a, b = self._tag_ids.get(tag_a), self._tag_ids.get(tag_b)
+            if a is None or b is None:
+                return float(self._scores(np.zeros(1), 0, np.zeros(1), measure)[0])
+            frequencies = self._frequencies()
+            count = np.array([self._C[a, b] + self._delta[a, b]])
+            return float(
+                self._scores(count, frequencies[a], frequencies[b : b + 1], measure)[0]
+            )
+
+    def related(
+        self, tag: str, k: int = 10, measure: str = "count"
+    ) -> List[Tuple[str, float]]:
+        with self._lock:
+            self._sync()
+            tag_id = self._tag_ids.get(tag)
+            if measure not in MEASURES:
+                raise ValueError(
+                    f"Unknown measure '{measure}', expected one of {MEASURES}."
+                )
+            elif tag_id is None or k <= 0:
+                return []
+            counts = (
+                self._C.getrow(tag_id).toarray().ravel()
+                + self._delta.getrow(tag_id).toarray().ravel()
+            )
+            counts[tag_id] = 0
+            candidates = np.flatnonzero(counts > 0)
+            frequencies = self._frequencies()
+            scores = self._scores(
+                counts[candidates],
+                frequencies[tag_id],
+                frequencies[candidates],
+                measure,
+            )
+            if len(candidates) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                candidates, scores = candidates[top], scores[top]
+            related = [
+                (self._tag_names[tag_id_], score.item())
+                for tag_id_, score in zip(candidates, scores)
+            ]
+            return sorted(related, key=lambda item: (-item[1], item[0]))
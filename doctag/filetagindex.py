@@ -1,19 +1,147 @@
-import sys
+import hashlib
+import inspect
+import os
+import re
+import shutil
+import threading
+import time
+from collections import namedtuple
+from collections.abc import Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import IO, Dict, Iterable, List, Optional, Set, Tuple
 
-import ujson
 from doctag_cli.metamarkdown import MetaMarkdown
 
+from .persistence import atomic_write
 from .tagindex import TagIndex
+from .watch import Watcher
+from .writeback import WriteBack
+
+
+class ScanStats(namedtuple("ScanStats", ["files", "bytes", "seconds", "errors"])):
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+RefreshSummary = namedtuple(
+    "RefreshSummary", ["added", "changed", "removed", "unchanged", "errors", "timings"]
+)
+
+_FileTags = namedtuple("_FileTags", ["path", "tags", "stat", "digest", "error"])
+
+_FENCES = (b"---", b"...")
+_METADATA_LINE = re.compile(rb"^[A-Za-z0-9][\w -]*:")
+
+
+def _read_header(doc_: IO[bytes]) -> Optional[bytes]:
+    """Read just the metadata block at the top of a document.
+
+    That is a ``---`` fenced block up to its closing fence, or ``Key: value`` lines up
+    to the first blank line. The file is left positioned at the start of the body.
+    Returns None, with the position undefined, if the document doesn't open with a
+    metadata block.
+    """
+    first = doc_.readline()
+    if first.rstrip() == b"---":
+        lines = [first]
+        for line in doc_:
+            lines.append(line)
+            if line.rstrip() in _FENCES:
+                return b"".join(lines)
+        return None
+    elif _METADATA_LINE.match(first):
+        lines = [first]
+        for line in doc_:
+            lines.append(line)
+            if not line.strip():
+                break
+        return b"".join(lines)
+    return None
+
+
+def _read_tags(
+    path: str, hash_contents: bool = False, known_digest: Optional[str] = None
+) -> _FileTags:
+    # Module-level so it can be shipped to a process pool. `tags` is None when the
+    # digest of the bytes the tags come from matched `known_digest` and it was not
+    # worth parsing them again. Only the header is read when there is one.
+    try:
+        stat = os.stat(path)
+        with open(path, "rb") as doc_:
+            contents = _read_header(doc_)
+            if contents is None:
+                doc_.seek(0)
+                contents = doc_.read()
+        digest = hashlib.sha1(contents).hexdigest() if hash_contents else None
+        if digest is not None and digest == known_digest:
+            return _FileTags(path, None, [stat.st_mtime_ns, stat.st_size], digest, None)
+        mm = MetaMarkdown.loads(contents.decode("utf-8"))
+        try:
+            tags = [
+                tag[1:] if tag.startswith("#") else tag for tag in mm.metadata["Tags"]
+            ]
+        except (KeyError, TypeError):
+            tags = []
+    except Exception as e:
+        # Whatever the parser raises is this file's error, not the whole scan's.
+        return _FileTags(path, None, None, None, str(e) or type(e).__name__)
+    return _FileTags(path, tags, [stat.st_mtime_ns, stat.st_size], digest, None)
+
+
+def _locked(method):
+    # Hold the index's lock for the call, and while iterating what it returns, so the
+    # watcher's thread never changes the index in the middle of either.
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            result = method(self, *args, **kwargs)
+        if isinstance(result, Iterator):
+            return _locked_iter(self.lock, result)
+        return result
+
+    wrapper._locked = True  # type: ignore
+    return wrapper
+
+
+def _locked_iter(lock: "threading.RLock", iterator: Iterator):
+    with lock:
+        yield from iterator
+
+
+def _lock_api(cls):
+    # Every public method and property, and the hooks a CompiledQuery calls back into,
+    # including ones added to TagIndex or a subclass later.
+    for name in dir(cls):
+        if name.startswith("_") and name not in cls._locked_hooks:
+            continue
+        attr = inspect.getattr_static(cls, name)
+        if isinstance(attr, property) and not hasattr(attr.fget, "_locked"):
+            fset = attr.fset and _locked(attr.fset)
+            setattr(cls, name, property(_locked(attr.fget), fset, doc=attr.__doc__))
+        elif inspect.isfunction(attr) and not hasattr(attr, "_locked"):
+            setattr(cls, name, _locked(attr))
+    return cls
 
 
 class FileTagIndex(TagIndex):
+    write_back_workers = 4
+    write_back_queue_size = 1024
+    _locked_hooks = ("_execute", "_execute_iter", "_execute_count", "_plan_root")
+
     def __init__(
         self,
         root_dir,
         at: Optional[str] = None,
         file_types: Optional[Iterable[str]] = None,
+        wal: bool = False,
+        write_back: bool = False,
     ):
         if not Path(root_dir).expanduser().is_dir():
             raise NotADirectoryError
@@ -21,53 +149,39 @@ class FileTagIndex(TagIndex):
             self.root_dir = Path(root_dir).expanduser()
             self.file_types = file_types if file_types else []
             self.file_list: List[str] = []
-            super().__init__(at=at)
+            self.manifest: Dict[str, list] = {}
+            # The manifest as of the last load or save, to merge from in _rebase.
+            self._saved_manifest: Dict[str, list] = {}
+            self._write_back: Optional[WriteBack] = None
+            # Held by every call into the index, and by a Watcher applying changes.
+            self.lock = threading.RLock()
+            if write_back:
+                self._write_back = WriteBack(
+                    self._write_tags,
+                    workers=self.write_back_workers,
+                    queue_size=self.write_back_queue_size,
+                )
+            super().__init__(at=at, wal=wal)
 
     @classmethod
-    def from_json(cls, at: str) -> "FileTagIndex":
-        with open(at, "r") as from_file:
-            serial = ujson.load(from_file)
-            ti = FileTagIndex(
-                root_dir=serial["root_dir"], at=at, file_types=serial["file_types"]
-            )
-            if "doc_to_tags" in serial.keys():
-                ti.doc_to_tags.update(
-                    {str(doc): set(tags) for doc, tags in serial["doc_to_tags"].items()}
-                )
-                for doc, tags in ti.doc_to_tags.items():
-                    for tag in tags:
-                        ti.tag_to_docs[str(tag)].add(doc)
-            elif "tag_to_docs" in serial.keys():
-                ti.tag_to_docs.update(
-                    {str(tag): set(docs) for tag, docs in serial["tag_to_docs"].items()}
-                )
-                for tag, docs in ti.tag_to_docs.items():
-                    for doc in docs:
-                        ti.doc_to_tags[str(doc)].add(tag)
-            else:
-                raise ValueError(
-                    "File does not contain 'tag_to_docs' or 'doc_to_tags' index."
-                )
+    def _from_metadata(cls, at: Optional[str], metadata: dict, wal: bool = False):
+        ti = cls(
+            root_dir=metadata["root_dir"],
+            at=at,
+            file_types=metadata["file_types"],
+            wal=wal,
+        )
+        ti.manifest = metadata.get("manifest", {})
+        ti._saved_manifest = dict(ti.manifest)
         return ti
 
-    def to_json(self, at: Optional[str] = None):
-        if at is None and self.at is not None:
-            at = self.at
-        elif self.at is None and self.at is not None:
-            self.at = at
-        serial: dict = dict()
-        dtt_size = sys.getsizeof(self.doc_to_tags)
-        ttd_size = sys.getsizeof(self.tag_to_docs)
-        ttd_bigger = ttd_size >= dtt_size
-        if ttd_bigger:
-            serial["doc_to_tags"] = self.doc_to_tags
-        else:
-            serial["tag_to_docs"] = self.tag_to_docs
-        serial["root_dir"] = str(self.root_dir)
-        serial["file_types"] = self.file_types
-        serial["file_list"] = self.file_list
-        with open(str(at), "w") as to_file:
-            ujson.dump(serial, to_file)
+    def _metadata(self) -> dict:
+        return {
+            "root_dir": str(self.root_dir),
+            "file_types": self.file_types,
+            "file_list": [str(path) for path in self.file_list],
+            "manifest": self.manifest,
+        }
 
     def get_files(self, file_types=None):
         if file_types:
@@ -84,40 +198,289 @@ class FileTagIndex(TagIndex):
             file_list.extend(self.root_dir.rglob("*.*"))
         self.file_list.extend(file_list)
 
+    def _matches(self, filename: str, file_types: Optional[Iterable[str]] = None):
+        ft_filter = file_types or self.file_types
+        if ft_filter:
+            return os.path.splitext(filename)[1][1:] in ft_filter
+        return "." in os.path.basename(filename)
+
+    def _walk(self, file_types: Optional[Iterable[str]] = None) -> List[str]:
+        file_list = []
+        for dirpath, _, filenames in os.walk(str(self.root_dir)):
+            for filename in filenames:
+                if self._matches(filename, file_types=file_types):
+                    file_list.append(os.path.join(dirpath, filename))
+        return file_list
+
+    def _read_paths(self, paths: Iterable[str]) -> List[_FileTags]:
+        # Reparse just these files without touching the index, on the watcher's thread.
+        # A file which is gone comes back with no stat.
+        return [
+            (
+                _read_tags(path)
+                if os.path.isfile(path) and self._matches(path)
+                else _FileTags(path, [], None, None, None)
+            )
+            for path in paths
+        ]
+
+    def _apply_paths(self, results: Iterable[_FileTags]) -> Dict[str, str]:
+        # Apply what _read_paths found, dropping files which are gone.
+        errors: Dict[str, str] = {}
+        for result in results:
+            path = result.path
+            if result.error is not None:
+                errors[path] = result.error
+                continue
+            if result.stat is None:
+                if path in self.manifest:
+                    del self.manifest[path]
+                if path in self.file_list:
+                    self.file_list.remove(path)
+                self._set_doc_tags(doc=path, tags=[])
+                continue
+            if path not in self.manifest:
+                self.file_list.append(path)
+            self.manifest[path] = [*result.stat, result.digest]
+            self._set_doc_tags(doc=path, tags=result.tags)
+        return errors
+
+    def watch(self, **kwargs) -> Watcher:
+        """Start a Watcher keeping this index in sync with root_dir; see Watcher."""
+        watcher = Watcher(self, **kwargs)
+        watcher.start()
+        return watcher
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _lock_api(cls)
+
+    def _read_files(
+        self,
+        paths: List[str],
+        workers: Optional[int],
+        processes: bool,
+        hash_contents: bool = False,
+    ) -> Iterable[_FileTags]:
+        executor: Executor = (
+            ProcessPoolExecutor(max_workers=workers)
+            if processes
+            else ThreadPoolExecutor(max_workers=workers)
+        )
+        known_digests = [
+            self.manifest[path][2] if path in self.manifest else None for path in paths
+        ]
+        with executor:
+            yield from executor.map(
+                _read_tags,
+                paths,
+                [hash_contents] * len(paths),
+                known_digests,
+                chunksize=64,
+            )
+
+    def scan(
+        self,
+        file_types: Optional[Iterable[str]] = None,
+        workers: Optional[int] = None,
+        processes: bool = False,
+        hash_contents: bool = False,
+    ) -> ScanStats:
+        """Walk root_dir once and load every file's front-matter tags into the index.
+
+        Files are parsed in a thread pool, or a process pool with ``processes=True`` to
+        use every core. Each scanned doc's tags are replaced by the tags found in its
+        file, without rewriting the file.
+        """
+        start = time.perf_counter()
+        file_list = self._walk(file_types=file_types)
+        total_bytes = 0
+        errors: Dict[str, str] = {}
+        self.manifest = {}
+        for result in self._read_files(file_list, workers, processes, hash_contents):
+            if result.error is not None:
+                errors[result.path] = result.error
+                continue
+            total_bytes += result.stat[1]
+            self.manifest[result.path] = [*result.stat, result.digest]
+            self._set_doc_tags(doc=result.path, tags=result.tags)
+        self.file_list = file_list
+        return ScanStats(
+            files=len(file_list) - len(errors),
+            bytes=total_bytes,
+            seconds=time.perf_counter() - start,
+            errors=errors,
+        )
+
+    def refresh(
+        self,
+        workers: Optional[int] = None,
+        processes: bool = False,
+        hash_contents: bool = False,
+    ) -> RefreshSummary:
+        """Bring the index up to date with root_dir using the stored manifest.
+
+        Only files which are new or whose mtime or size changed are reparsed; with
+        ``hash_contents=True`` a changed file whose content hash still matches is not
+        reparsed either. Deleted files are dropped from the index.
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        file_list = self._walk()
+        timings["walk"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        added, stale = [], []
+        unchanged = 0
+        errors: Dict[str, str] = {}
+        for path in file_list:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                errors[path] = str(e)
+                continue
+            if path not in self.manifest:
+                added.append(path)
+            elif self.manifest[path][:2] != [stat.st_mtime_ns, stat.st_size]:
+                stale.append(path)
+            else:
+                unchanged += 1
+        removed = sorted(set(self.manifest) - set(file_list))
+        timings["stat"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = list(
+            self._read_files(added + stale, workers, processes, hash_contents)
+        )
+        timings["parse"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        changed = []
+        stale_ = set(stale)
+        for result in results:
+            if result.error is not None:
+                errors[result.path] = result.error
+                continue
+            self.manifest[result.path] = [*result.stat, result.digest]
+            if result.tags is None:
+                unchanged += 1
+                continue
+            if result.path in stale_:
+                changed.append(result.path)
+            self._set_doc_tags(doc=result.path, tags=result.tags)
+        for path in removed:
+            del self.manifest[path]
+            self._set_doc_tags(doc=path, tags=[])
+        self.file_list = file_list
+        timings["apply"] = time.perf_counter() - start
+        return RefreshSummary(
+            added=[path for path in added if path not in errors],
+            changed=changed,
+            removed=removed,
+            unchanged=unchanged,
+            errors=errors,
+            timings=timings,
+        )
+
     def _tag_callback(self, docs: Iterable[str], tags: Iterable[str]):
         for doc in docs:
-            with open(doc, "r+") as doc_:
-                mm = MetaMarkdown.loads(doc_.read())
-                try:
-                    mm.metadata["Tags"].extend(
-                        [
-                            "#" + tag
-                            for tag in tags
-                            if f"#{tag}" not in mm.metadata["Tags"]
-                        ]
-                    )
-                    doc_.seek(0)
-                    doc_.write(mm.dumps())
-                    doc_.truncate()
-                except (KeyError, TypeError):
-                    mm.metadata["Tags"] = ["#" + tag for tag in tags]
-                    doc_.seek(0)
-                    doc_.write(mm.dumps())
-                    doc_.truncate()
+            self._rewrite_tags(doc=doc, added=tags, removed=())
 
     def _untag_callback(self, docs: Iterable[str], tags: Iterable[str]):
-        tags_ = [f"#{tag}" for tag in tags]
-        print(tags_)
         for doc in docs:
-            with open(doc, "r+") as doc_:
-                mm = MetaMarkdown.loads(doc_.read())
-                try:
-                    mm.metadata["Tags"] = [
-                        tag for tag in mm.metadata["Tags"] if tag not in tags_
-                    ]
-                    print(mm.metadata)
-                    doc_.seek(0)
-                    doc_.write(mm.dumps())
-                    doc_.truncate()
-                except (KeyError, TypeError):
-                    pass
+            self._rewrite_tags(doc=doc, added=(), removed=tags)
+
+    def _delta_callback(self, doc: str, added: Set[str], removed: Set[str]):
+        self._rewrite_tags(doc=doc, added=added, removed=removed)
+
+    def flush(self) -> Dict[str, str]:
+        """Wait for queued file rewrites; return the ones which failed, by path."""
+        if self._write_back is None:
+            return {}
+        return self._write_back.flush()
+
+    def close(self) -> Dict[str, str]:
+        if self._write_back is None:
+            return {}
+        write_back, self._write_back = self._write_back, None
+        return write_back.close()
+
+    def to_json(self, at: Optional[str] = None):
+        # Let pending rewrites land first so the saved manifest matches the files.
+        if self._write_back is not None:
+            self._write_back.join()
+        super().to_json(at=at)
+        if at is None or at == self.at:
+            self._saved_manifest = dict(self.manifest)
+
+    def _rebase(
+        self, serial: dict, records: Iterable[Tuple[str, List[str], List[str]]] = ()
+    ):
+        # The manifest is merged like the tags: entries changed here since the last
+        # load or save are kept as here, and the rest are as the other writer saved.
+        manifest = dict(serial.get("manifest", {}))
+        for path in self._saved_manifest.keys() | self.manifest.keys():
+            entry = self.manifest.get(path)
+            if entry != self._saved_manifest.get(path):
+                if entry is None:
+                    manifest.pop(path, None)
+                else:
+                    manifest[path] = entry
+        super()._rebase(serial, records)
+        self.manifest = manifest
+
+    def _rewrite_tags(self, doc: str, added: Iterable[str], removed: Iterable[str]):
+        if self._write_back is not None:
+            self._write_back.submit(doc=doc, added=added, removed=removed)
+        else:
+            self._write_tags(doc=doc, added=added, removed=removed)
+
+    def _write_tags(self, doc: str, added: Iterable[str], removed: Iterable[str]):
+        added_ = [f"#{tag}" for tag in added]
+        removed_ = {f"#{tag}" for tag in removed}
+        with open(doc, "rb") as doc_:
+            header = _read_header(doc_)
+            mm = None
+            if header is not None:
+                mm = MetaMarkdown.loads(header.decode("utf-8"))
+                # Only splice a new header onto the untouched body if MetaMarkdown
+                # writes this header back byte for byte; otherwise redo the whole file.
+                if mm.dumps().encode("utf-8") != header:
+                    mm = None
+            if mm is None:
+                header = None
+                doc_.seek(0)
+                mm = MetaMarkdown.loads(doc_.read().decode("utf-8"))
+            try:
+                tags = [tag for tag in mm.metadata["Tags"] if tag not in removed_]
+            except (KeyError, TypeError):
+                if not added_:
+                    return
+                tags = []
+            tags.extend(tag for tag in dict.fromkeys(added_) if tag not in tags)
+            mm.metadata["Tags"] = tags
+            contents = mm.dumps().encode("utf-8")
+            if (
+                header is not None
+                and len(contents) == len(header)
+                and self._write_back is None
+            ):
+                # Same size: patch the header in place, one small write at offset 0.
+                # Unlike the rename below this isn't crash-atomic, so write-back,
+                # which promises atomic rewrites, always takes the rename.
+                doc_.close()
+                with open(doc, "r+b") as patch:
+                    patch.write(contents)
+                    patch.flush()
+                    os.fsync(patch.fileno())
+            else:
+                with atomic_write(doc, "wb") as to_file:
+                    to_file.write(contents)
+                    if header is not None:
+                        shutil.copyfileobj(doc_, to_file, 2**20)
+        if doc in self.manifest:
+            stat = os.stat(doc)
+            self.manifest[doc] = [stat.st_mtime_ns, stat.st_size, None]
+
+
+_lock_api(FileTagIndex)
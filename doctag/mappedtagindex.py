@@ -0,0 +1,180 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Mapping, Optional, Set
+
+from .snapshot import Snapshot
+from .tagindex import TagIndex, _prefix_end
+
+
+class _SnapshotView(Mapping):
+    """Read-only ``Dict[str, Set[str]]`` view over one direction of a snapshot."""
+
+    def __init__(self, index: "MappedTagIndex", by_tag: bool):
+        self._index = index
+        self._by_tag = by_tag
+
+    def __getitem__(self, key: str) -> Set[str]:
+        snapshot = self._index._current()
+        if self._by_tag:
+            tag_id = snapshot.find_tag(key)
+            if tag_id is None:
+                return set()
+            return {snapshot.doc_name(i) for i in snapshot.tag_postings(tag_id)}
+        doc_id = snapshot.find_doc(key)
+        if doc_id is None:
+            return set()
+        return {snapshot.tag_name(i) for i in snapshot.doc_postings(doc_id)}
+
+    def __contains__(self, key) -> bool:
+        snapshot = self._index._current()
+        if self._by_tag:
+            return snapshot.find_tag(key) is not None
+        return snapshot.find_doc(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        snapshot = self._index._current()
+        if self._by_tag:
+            return iter(snapshot.tag_names())
+        return iter(snapshot.doc_names())
+
+    def __len__(self) -> int:
+        snapshot = self._index._current()
+        return snapshot.tag_count if self._by_tag else snapshot.doc_count
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+class MappedTagIndex(TagIndex):
+    """A read-only TagIndex answering queries straight from a memory-mapped snapshot.
+
+    Postings are read lazily from the mapped file written by ``TagIndex.to_binary``,
+    so any number of processes opening the same snapshot share one page-cache copy.
+    """
+
+    def __init__(self, at: str, query_cache_size: int = 256):
+        self._snapshot = Snapshot(at)
+        self._local = threading.local()
+        super().__init__(at=at, query_cache_size=query_cache_size)
+
+    def _init_storage(self):
+        self.tag_to_docs = _SnapshotView(self, by_tag=True)  # type: ignore
+        self.doc_to_tags = _SnapshotView(self, by_tag=False)  # type: ignore
+        self._pairs = None
+
+    def reload(self):
+        # Swapping the reference is atomic; queries already running keep the snapshot
+        # they pinned, and the old mapping is released once nothing refers to it.
+        self._snapshot = Snapshot(str(self.at))
+        self._pairs = None
+        self._cooccurrence = None
+        if self._views:
+            self._views.invalidate()
+
+    def close(self):
+        self._snapshot.close()
+
+    def _current(self) -> Snapshot:
+        return getattr(self._local, "snapshot", None) or self._snapshot
+
+    @contextmanager
+    def _pinned(self):
+        # Pin one snapshot per thread for the whole query so a concurrent reload()
+        # can never mix ids from two different files.
+        if getattr(self._local, "snapshot", None) is not None:
+            yield
+            return
+        self._local.snapshot = self._snapshot
+        try:
+            yield
+        finally:
+            self._local.snapshot = None
+
+    @property
+    def tags(self):
+        return set(self._current().tag_names())
+
+    @property
+    def docs(self):
+        return set(self._current().doc_names())
+
+    def get_docs(self, tag: str):
+        return self.tag_to_docs[tag]
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} is read-only.")
+
+    tag = untag = _tag = _untag = compact = _read_only  # type: ignore
+
+    def to_json(self, at: Optional[str] = None):
+        if at is None or at == self.at:
+            self._read_only()
+        super().to_json(at=at)
+
+    @classmethod
+    def from_json(cls, at: str, wal: bool = False):
+        raise TypeError(
+            f"{cls.__name__} opens binary snapshots; convert '{at}' with json_to_binary."
+        )
+
+    @classmethod
+    def from_binary(cls, at: str) -> "MappedTagIndex":
+        return cls(at=at)
+
+    def __exit__(self, etype, evalue, traceback):
+        pass
+
+    def _execute(self, expression) -> set:
+        with self._pinned():
+            return super()._execute(expression)
+
+    def _execute_iter(self, expression) -> Iterator[str]:
+        with self._pinned():
+            return super()._execute_iter(expression)
+
+    def _execute_count(self, expression) -> int:
+        with self._pinned():
+            return super()._execute_count(expression)
+
+    def _plan_root(self, expression):
+        with self._pinned():
+            return super()._plan_root(expression)
+
+    def _postings(self, tag: str) -> Set[int]:
+        snapshot = self._current()
+        tag_id = snapshot.find_tag(tag)
+        return set() if tag_id is None else set(snapshot.tag_postings(tag_id))
+
+    def _complement(self, postings: Set[int]) -> Set[int]:
+        return set(range(self._current().doc_count)) - postings
+
+    def _tag_range(self, prefix: str) -> List[str]:
+        # Snapshot tag names are already sorted, so search them in place.
+        snapshot = self._current()
+        ids = snapshot.tag_range(prefix, _prefix_end(prefix) if prefix else None)
+        return [snapshot.tag_name(i) for i in ids]
+
+    def _count_pairs(self) -> int:
+        return self._current().pair_count
+
+    def _tag_size(self, tag: str) -> int:
+        snapshot = self._current()
+        tag_id = snapshot.find_tag(tag)
+        return 0 if tag_id is None else snapshot.tag_size(tag_id)
+
+    def _universe_size(self) -> int:
+        return self._current().doc_count
+
+    def _decode(self, postings: Set[int]) -> set:
+        snapshot = self._current()
+        return {snapshot.doc_name(i) for i in postings}
+
+    def _iter_postings(self, postings: Set[int]) -> Iterator[str]:
+        snapshot = self._current()
+        return (snapshot.doc_name(i) for i in postings)
+
+    def _iter_complement(self, postings: Set[int]) -> Iterator[str]:
+        snapshot = self._current()
+        return (
+            snapshot.doc_name(i) for i in range(snapshot.doc_count) if i not in postings
+        )
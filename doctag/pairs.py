@@ -0,0 +1,73 @@
+import csv
+import os
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+import ujson
+
+from .persistence import atomic_write
+
+Pair = Tuple[str, str]
+
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+
+def _format(at: str, format: Optional[str]) -> str:
+    if format is None:
+        format = FORMATS.get(os.path.splitext(at)[1].lower())
+    if format not in ("csv", "ndjson"):
+        raise ValueError(f"Unknown pair format for '{at}', expected 'csv' or 'ndjson'.")
+    return format
+
+
+def read_pairs(at: str, format: Optional[str] = None) -> Iterator[Pair]:
+    """Stream (doc, tag) pairs from a CSV or NDJSON file, one line at a time.
+
+    The format is taken from the extension (``.csv``, ``.ndjson`` or ``.jsonl``)
+    unless given. CSV rows are ``doc,tag``, with an optional ``doc,tag`` header. NDJSON
+    lines are ``{"doc": ..., "tag": ...}`` objects or ``[doc, tag]`` arrays.
+    """
+    if _format(at, format) == "csv":
+        with open(at, "r", newline="") as from_file:
+            rows = csv.reader(from_file)
+            for row in rows:
+                if row and row != ["doc", "tag"]:
+                    yield _pair(row, at, rows.line_num)
+                break
+            for row in rows:
+                if row:
+                    yield _pair(row, at, rows.line_num)
+    else:
+        with open(at, "r") as from_file:
+            for line_num, line in enumerate(from_file, 1):
+                if not line.strip():
+                    continue
+                record = ujson.loads(line)
+                if isinstance(record, dict):
+                    record = [record.get("doc"), record.get("tag")]
+                yield _pair(record, at, line_num)
+
+
+def _pair(record: Union[list, tuple], at: str, line_num: int) -> Pair:
+    if len(record) != 2 or not all(isinstance(name, str) for name in record):
+        raise ValueError(f"'{at}' line {line_num} is not a (doc, tag) pair.")
+    return record[0], record[1]
+
+
+def write_pairs(pairs: Iterable[Pair], at: str, format: Optional[str] = None) -> int:
+    """Stream (doc, tag) pairs to a CSV or NDJSON file; return how many were written.
+
+    The file is replaced atomically once every pair has been written.
+    """
+    count = 0
+    with atomic_write(at) as to_file:
+        if _format(at, format) == "csv":
+            writer = csv.writer(to_file, lineterminator="\n")
+            writer.writerow(["doc", "tag"])
+            for doc, tag in pairs:
+                writer.writerow([doc, tag])
+                count += 1
+        else:
+            for doc, tag in pairs:
+                to_file.write(ujson.dumps({"doc": doc, "tag": tag}) + "\n")
+                count += 1
+    return count
@@ -0,0 +1,217 @@
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator, List, Optional, Tuple
+
+import ujson
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+@contextmanager
+def atomic_write(at: str, mode: str = "w") -> Iterator[IO]:
+    # Write to a temp file in the same directory and rename it over `at`, so a crash
+    # mid-write leaves the previous file untouched.
+    directory = os.path.dirname(os.path.abspath(at))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(at)}.", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            yield tmp_file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        if os.path.exists(at):
+            # mkstemp creates the file private to us; keep the original's permissions.
+            shutil.copymode(at, tmp_path)
+        os.replace(tmp_path, at)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json_atomic(serial: dict, at: str):
+    with atomic_write(at) as to_file:
+        ujson.dump(serial, to_file)
+
+
+@contextmanager
+def file_lock(at: str) -> Iterator[None]:
+    """Hold an exclusive advisory lock for the file ``at`` until the block exits.
+
+    The lock is taken on ``<at>.lock`` rather than on ``at``, which is replaced by
+    each save. The lock file is left in place, as another process may be waiting on
+    it. Only processes which take the lock are kept out. Without ``fcntl`` (Windows)
+    this does nothing.
+    """
+    if fcntl is None:  # pragma: no cover
+        yield
+        return
+    with open(f"{at}.lock", "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def read_generation(at: str) -> Optional[int]:
+    """The generation of the index saved at ``at``, or None if there is no file.
+
+    to_json writes the generation as the first key, so only the start of the file is
+    read. Files saved before generations existed are generation 0.
+    """
+    try:
+        with open(at, "rb") as from_file:
+            head = from_file.read(64)
+    except FileNotFoundError:
+        return None
+    match = re.match(rb'\{\s*"generation"\s*:\s*(\d+)', head)
+    return int(match.group(1)) if match else 0
+
+
+class WriteAheadLog:
+    """An append-only log of tag/untag mutations stored next to a snapshot.
+
+    Records are NDJSON lines of ``[op, docs, tags]``. During compaction the live log is
+    rotated to ``<at>.log.old`` while the snapshot is rewritten, and the rotated log is
+    dropped once the new snapshot is in place.
+
+    A log takes one writer at a time: compaction rewrites the snapshot from the
+    writer's own memory. So the log is locked from a writer's first append until it
+    is closed, and a writer won't append to a log which changed since it last read,
+    opened or closed it; it has to be reloaded first.
+    """
+
+    def __init__(self, at: str):
+        self.path = f"{at}.log"
+        self.rotated_path = f"{at}.log.old"
+        self._file: Optional[IO[str]] = None
+        # The log as this writer last left it; see changed_elsewhere.
+        self._known = self._signature()
+
+    @property
+    def size(self) -> int:
+        return sum(
+            os.path.getsize(path)
+            for path in (self.path, self.rotated_path)
+            if os.path.exists(path)
+        )
+
+    def append(self, op: str, docs: List[str], tags: List[str]):
+        if self._file is None:
+            self._file = self._open()
+        self._file.write(ujson.dumps([op, docs, tags]) + "\n")
+        self._file.flush()
+
+    def _open(self) -> IO[str]:
+        log_ = open(self.path, "a")
+        try:
+            if fcntl is not None:
+                fcntl.flock(log_.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if self._signature() != self._known:
+                raise ValueError(
+                    f"'{self.path}' was changed by another writer since this index "
+                    "loaded or saved it; reload the index to write to it."
+                )
+        except BlockingIOError:
+            log_.close()
+            raise ValueError(
+                f"'{self.path}' is held by another writer; a write-ahead log takes "
+                "one writer at a time."
+            )
+        except BaseException:
+            log_.close()
+            raise
+        # Start on a fresh line if a previous process died halfway through a record,
+        # so the torn record is skipped on replay rather than swallowing this one.
+        if os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as log:
+                log.seek(-1, os.SEEK_END)
+                if log.read(1) != b"\n":
+                    log_.write("\n")
+        return log_
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        # An empty log holds no records, so it counts as no log at all.
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size) if stat.st_size else None
+
+    def changed_elsewhere(self) -> bool:
+        """Whether another writer appended to or removed the log since this one last
+        read, opened or closed it."""
+        return self._file is None and self._signature() != self._known
+
+    def in_use(self) -> bool:
+        """Whether a writer holds the log, with records it hasn't saved yet."""
+        if fcntl is None:  # pragma: no cover
+            return False
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "a") as log:
+            try:
+                fcntl.flock(log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(log.fileno(), fcntl.LOCK_UN)
+        return False
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._known = self._signature()
+            self._file.close()
+            self._file = None
+
+    def records(self) -> Iterator[Tuple[str, List[str], List[str]]]:
+        self._known = self._signature()
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as log:
+                for line in log:
+                    try:
+                        op, docs, tags = ujson.loads(line)
+                    except ValueError:
+                        continue
+                    yield op, docs, tags
+
+    def rotate(self):
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        if os.path.exists(self.rotated_path):
+            # An earlier compaction never finished; keep its records ahead of ours.
+            with open(self.rotated_path, "a") as rotated, open(self.path) as current:
+                shutil.copyfileobj(current, rotated)
+                rotated.flush()
+                os.fsync(rotated.fileno())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.rotated_path)
+        self._known = None
+
+    def drop_rotated(self):
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def reset(self):
+        self.close()
+        for path in (self.path, self.rotated_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._known = None
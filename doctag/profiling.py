@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, Optional
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .tagindex import CompiledQuery, PlanNode, TagIndex
+
+NodeTrace = namedtuple(
+    "NodeTrace", ["op", "tag", "estimate", "size", "seconds", "children"]
+)
+OpStats = namedtuple("OpStats", ["calls", "seconds", "bytes"])
+
+
+class QueryTrace(
+    namedtuple(
+        "QueryTrace",
+        [
+            "query",
+            "kind",
+            "cached",
+            "parse_seconds",
+            "simplify_seconds",
+            "plan_seconds",
+            "seconds",
+            "size",
+            "root",
+        ],
+    )
+):
+    def format(self) -> str:
+        compiled = (
+            "cached"
+            if self.cached
+            else f"parse {self.parse_seconds * 1e3:.3f} ms, "
+            f"simplify {self.simplify_seconds * 1e3:.3f} ms"
+        )
+        lines = [
+            f"{self.kind} {self.query!r}: {self.seconds * 1e3:.3f} ms, {self.size} docs "
+            f"({compiled}, plan {self.plan_seconds * 1e3:.3f} ms)"
+        ]
+        self._format(self.root, 1, lines)
+        return "\n".join(lines)
+
+    def _format(self, node: Optional[NodeTrace], depth: int, lines: List[str]):
+        if node is None:
+            return
+        label = f"TAG {node.tag!r}" if node.op == "TAG" else node.op
+        inputs = "" if not node.children else f" from {[c.size for c in node.children]}"
+        lines.append(
+            f"{'  ' * depth}{label} (est. {node.estimate}, actual {node.size}{inputs}) "
+            f"{node.seconds * 1e3:.3f} ms"
+        )
+        for child in node.children:
+            self._format(child, depth + 1, lines)
+
+
+class Profiler:
+    """Collects query traces and per-operation counters from the indexes it's attached to.
+
+    Attach it with ``index.profile()``, ``profiler.attach(index)``, or by setting
+    ``profiler`` on an index or on an index class (which also covers ``from_json``).
+    Each query run while attached is recorded as a QueryTrace: parse, simplify and
+    plan times, and a tree of the plan nodes which were run, with each one's time,
+    estimated and actual size, and input sizes. The last ``keep`` traces are kept in
+    ``queries``, and each one is passed to ``on_query`` if given. ``tag``, ``untag``,
+    ``bulk_load``, ``to_json`` and ``from_json`` calls are counted in ``counters``. An
+    index with no profiler only pays for checking that it has none.
+    """
+
+    def __init__(
+        self, on_query: Optional[Callable[[QueryTrace], Any]] = None, keep: int = 1000
+    ):
+        self.on_query = on_query
+        self.queries: Deque[QueryTrace] = deque(maxlen=keep)
+        self.counters: Dict[str, OpStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self):
+        with self._lock:
+            self.queries.clear()
+            self.counters = {}
+
+    @contextmanager
+    def attach(self, target):
+        # Restore whatever was set on the target itself, so attaching to one index
+        # doesn't hide a profiler attached to its class.
+        missing = object()
+        previous = target.__dict__.get("profiler", missing)
+        target.profiler = self
+        try:
+            yield self
+        finally:
+            if previous is missing:
+                delattr(target, "profiler")
+            else:
+                target.profiler = previous
+
+    def record(self, op: str, seconds: float, bytes_: int = 0):
+        with self._lock:
+            calls, total, total_bytes = self.counters.get(op, (0, 0.0, 0))
+            self.counters[op] = OpStats(
+                calls + 1, total + seconds, total_bytes + bytes_
+            )
+
+    def trace(self, compiled: "CompiledQuery", kind: str, execute: Callable[[], Any]):
+        index = compiled.index
+        timings, compiled.timings = compiled.timings, None
+        start = time.perf_counter()
+        index._plan_root(compiled.expression)
+        plan_seconds = time.perf_counter() - start
+        roots: List[NodeTrace] = []
+        stack = self._stack()
+        stack.append(roots)
+        try:
+            start = time.perf_counter()
+            result = execute()
+            seconds = time.perf_counter() - start
+        finally:
+            stack.pop()
+        if isinstance(result, int):
+            size: Optional[int] = result
+        elif kind == "iter":
+            size = None
+        else:
+            size = len(result)
+        trace = QueryTrace(
+            query=compiled.query,
+            kind=kind,
+            cached=timings is None,
+            parse_seconds=0.0 if timings is None else timings[0],
+            simplify_seconds=0.0 if timings is None else timings[1],
+            plan_seconds=plan_seconds,
+            seconds=seconds,
+            size=size,
+            root=roots[0] if roots else None,
+        )
+        self.queries.append(trace)
+        if self.on_query is not None:
+            self.on_query(trace)
+        return result
+
+    def tracing(self) -> bool:
+        return bool(self._stack())
+
+    def run_node(self, index: "TagIndex", node: "PlanNode"):
+        stack = self._stack()
+        children: List[NodeTrace] = []
+        stack.append(children)
+        try:
+            start = time.perf_counter()
+            result = index._evaluate(node)
+            seconds = time.perf_counter() - start
+        finally:
+            stack.pop()
+        stack[-1].append(
+            NodeTrace(
+                op=node.op,
+                tag=node.tag,
+                estimate=node.estimate,
+                size=index._size(result),
+                seconds=seconds,
+                children=tuple(children),
+            )
+        )
+        return result
+
+    def _stack(self) -> List[List[NodeTrace]]:
+        # Traces in progress on this thread, innermost last.
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+def profiled(op: str, counts_bytes: bool = False):
+    """Count calls of the decorated method in its index's profiler, if it has one.
+
+    With ``counts_bytes``, the size of the file at ``at`` afterwards is counted too.
+    """
+
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            seconds = time.perf_counter() - start
+            bytes_ = 0
+            if counts_bytes:
+                at = args[0] if args else kwargs.get("at")
+                if at is None:
+                    at = getattr(self, "at", None)
+                if at is not None and os.path.exists(at):
+                    bytes_ = os.path.getsize(at)
+            profiler.record(op, seconds, bytes_)
+            return result
+
+        return wrapper
+
+    return decorate
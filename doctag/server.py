@@ -0,0 +1,183 @@
+import asyncio
+import os
+import socket
+import stat
+import threading
+from typing import Any, Optional
+
+import ujson
+
+from .tagindex import TagIndex
+
+
+class TagServer:
+    """Serves one loaded index to any number of clients over a local socket.
+
+    The protocol is newline-delimited JSON. Each request is an object with an ``op``
+    (``query``, ``count``, ``get_docs``, ``tag``, ``untag``, ``checkpoint`` or
+    ``ping``) and its parameters, plus an optional ``id`` which is echoed back. A
+    client may pipeline any number of requests on one connection, and the replies
+    come back in the same order. Every request runs on the event loop, one at a
+    time, so clients never see a half-applied change.
+
+    If the index changed, it is saved with ``to_json`` every ``checkpoint_interval``
+    seconds and again on shutdown. A request line longer than ``line_limit`` bytes
+    is skipped and answered with an error.
+    """
+
+    line_limit = 64 * 2**20
+
+    def __init__(
+        self,
+        index: TagIndex,
+        path: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        checkpoint_interval: Optional[float] = 60.0,
+    ):
+        if (path is None) == (port is None):
+            raise ValueError("Serve on either a unix socket 'path' or a TCP 'port'.")
+        self.index = index
+        self.path = path
+        self.host = host
+        self.port = port
+        self.checkpoint_interval = checkpoint_interval
+        self.ready = threading.Event()
+        self._dirty = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    def run(self):
+        asyncio.run(self.serve_forever())
+
+    def stop(self):
+        # Safe to call from any thread.
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve_forever(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        if self.path is not None:
+            try:
+                mode = os.lstat(self.path).st_mode
+            except FileNotFoundError:
+                pass
+            else:
+                if not stat.S_ISSOCK(mode):
+                    raise FileExistsError(f"'{self.path}' exists and is not a socket.")
+                self._remove_stale_socket()
+            server = await asyncio.start_unix_server(
+                self._handle, path=self.path, limit=self.line_limit
+            )
+        else:
+            server = await asyncio.start_server(
+                self._handle, host=self.host, port=self.port, limit=self.line_limit
+            )
+            self.port = server.sockets[0].getsockname()[1]
+        checkpoints = asyncio.ensure_future(self._checkpoint_loop())
+        self.ready.set()
+        try:
+            async with server:
+                await self._stopping.wait()
+        finally:
+            checkpoints.cancel()
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+            self.checkpoint()
+            self.ready.clear()
+
+    def _remove_stale_socket(self):
+        # Only a socket which nobody is listening on, left behind by a server which
+        # died; taking over a live server's address would leave two servers saving
+        # the same index.
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:
+            os.remove(self.path)
+            return
+        finally:
+            probe.close()
+        raise FileExistsError(f"A server is already listening on '{self.path}'.")
+
+    async def _checkpoint_loop(self):
+        if not self.checkpoint_interval:
+            return
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self._dirty and self.index.at is not None:
+            self.index.to_json()
+            self._dirty = False
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    line = await self._read_line(reader)
+                except ValueError as e:
+                    writer.write(self._error(None, e))
+                    await writer.drain()
+                    continue
+                if not line:
+                    break
+                writer.write(self._respond(line))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_line(self, reader: asyncio.StreamReader) -> bytes:
+        # Empty once the client hung up. A line over the reader's limit is skipped, so
+        # the requests after it can still be answered, and raises ValueError.
+        try:
+            return await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+        while True:
+            await reader.readexactly(consumed)
+            try:
+                await reader.readuntil(b"\n")
+                break
+            except asyncio.LimitOverrunError as e:
+                consumed = e.consumed
+        raise ValueError(f"Request is longer than {self.line_limit} bytes.")
+
+    def _respond(self, line: bytes) -> bytes:
+        id_ = None
+        try:
+            request = ujson.loads(line)
+            id_ = request.pop("id", None)
+            response = {"id": id_, "result": self._dispatch(**request)}
+        except Exception as e:
+            return self._error(id_, e)
+        return (ujson.dumps(response) + "\n").encode("utf-8")
+
+    def _error(self, id_: Any, error: Exception) -> bytes:
+        response = {"id": id_, "error": type(error).__name__, "message": str(error)}
+        return (ujson.dumps(response) + "\n").encode("utf-8")
+
+    def _dispatch(self, op: str, **params) -> Any:
+        if op == "query":
+            result = self.index.query(**params)
+            return sorted(result) if isinstance(result, set) else result
+        elif op == "count":
+            return self.index.query_count(**params)
+        elif op == "get_docs":
+            return sorted(self.index.get_docs(**params))
+        elif op in ("tag", "untag"):
+            getattr(self.index, op)(**params)
+            self._dirty = True
+            return None
+        elif op == "checkpoint":
+            self.checkpoint()
+            return None
+        elif op == "ping":
+            return "pong"
+        raise ValueError(f"Unknown op '{op}'.")
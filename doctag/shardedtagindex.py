@@ -0,0 +1,241 @@
+import heapq
+import multiprocessing
+import os
+import zlib
+from collections import defaultdict
+from collections.abc import Set as AbstractSet
+from typing import Any, Dict, Iterable, List, Optional, Type, Union
+
+import ujson
+
+from .persistence import write_json_atomic
+from .tagindex import TagIndex, _listify
+
+MANIFEST = "shards.json"
+
+
+def _shard_path(at: str, shard: int) -> str:
+    return os.path.join(at, f"shard-{shard}.json")
+
+
+def _serve_shard(conn, engine: Type[TagIndex], at: Optional[str]):
+    # Runs in the shard's own process: loads (or creates) the shard, then applies
+    # each (method, args, kwargs) message and sends back (ok, result).
+    try:
+        if at is not None and os.path.exists(at):
+            index = engine.from_json(at)
+        else:
+            index = engine(at=at)
+    except Exception as e:
+        conn.send((False, e))
+        return
+    conn.send((True, None))
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        method, args, kwargs = message
+        try:
+            result = getattr(index, method)
+            if callable(result):
+                result = result(*args, **kwargs)
+            if isinstance(result, AbstractSet) and not isinstance(result, set):
+                result = set(result)
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, e))
+    conn.close()
+
+
+class ShardedTagIndex:
+    """A tag index split across ``shards`` worker processes by a stable hash of the doc.
+
+    Each shard is an ordinary ``engine`` index living in its own process. Tagging
+    goes only to the shards owning the docs. Queries run on every shard at once, and
+    because each doc lives in exactly one shard the results are just merged. With
+    ``at`` set, each shard saves to its own ``shard-<n>.json`` inside the ``at``
+    directory, in the usual ``to_json`` format, so any shard can also be loaded on
+    its own with ``engine.from_json``.
+    """
+
+    def __init__(
+        self,
+        shards: Optional[int] = None,
+        at: Optional[str] = None,
+        engine: Type[TagIndex] = TagIndex,
+    ):
+        self.shards = shards or os.cpu_count() or 1
+        self.at = at
+        self.engine = engine
+        if at is not None:
+            manifest = os.path.join(at, MANIFEST)
+            if os.path.exists(manifest):
+                with open(manifest, "r") as from_file:
+                    saved = ujson.load(from_file)["shards"]
+                if saved != self.shards:
+                    raise ValueError(
+                        f"'{at}' holds {saved} shards; docs can't be found with "
+                        f"{self.shards}."
+                    )
+            os.makedirs(at, exist_ok=True)
+        self._conns = []
+        self._processes = []
+        for shard in range(self.shards):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_serve_shard,
+                args=(child, engine, None if at is None else _shard_path(at, shard)),
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+        try:
+            self._receive(range(self.shards))
+        except BaseException:
+            self.close()
+            raise
+
+    def shard_of(self, doc: str) -> int:
+        # Not hash(): string hashes are salted per process, and the layout has to
+        # survive a restart.
+        return zlib.crc32(doc.encode("utf-8")) % self.shards
+
+    def _send(self, shard: int, method: str, *args, **kwargs):
+        self._conns[shard].send((method, args, kwargs))
+
+    def _receive(self, shards: Iterable[int]) -> List[Any]:
+        # Collect every reply before raising so the pipes stay in step.
+        replies = [self._conns[shard].recv() for shard in shards]
+        for ok, result in replies:
+            if not ok:
+                raise result
+        return [result for _, result in replies]
+
+    def _broadcast(self, method: str, *args, **kwargs) -> List[Any]:
+        for shard in range(self.shards):
+            self._send(shard, method, *args, **kwargs)
+        return self._receive(range(self.shards))
+
+    def _by_shard(self, docs: Iterable[str]) -> Dict[int, List[str]]:
+        by_shard: Dict[int, List[str]] = defaultdict(list)
+        for doc in docs:
+            by_shard[self.shard_of(doc)].append(doc)
+        return by_shard
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+        self._processes = []
+
+    def __enter__(self):
+        if not self.at:
+            raise FileNotFoundError(
+                f"{type(self).__name__} missing a read/write location 'at'"
+            )
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        try:
+            if not etype:
+                self.to_json()
+        finally:
+            self.close()
+
+    @property
+    def tags(self) -> set:
+        return set().union(*self._broadcast("tags"))
+
+    @property
+    def docs(self) -> set:
+        return set().union(*self._broadcast("docs"))
+
+    def get_docs(self, tag: str) -> set:
+        return set().union(*self._broadcast("get_docs", tag))
+
+    def tag(self, docs: Union[str, Iterable[str]], tags: Union[str, Iterable[str]]):
+        self._apply("tag", docs, tags)
+
+    def untag(self, docs: Union[str, Iterable[str]], tags: Union[str, Iterable[str]]):
+        self._apply("untag", docs, tags)
+
+    def _apply(self, method: str, docs, tags):
+        tags_ = _listify(tags)
+        by_shard = self._by_shard(_listify(docs))
+        for shard, docs_ in by_shard.items():
+            self._send(shard, method, docs=docs_, tags=tags_)
+        self._receive(by_shard)
+
+    def remove_tag(self, tag: str):
+        docs = self.get_docs(tag)
+        if not docs:
+            raise ValueError(f"Tag '{tag}' not found.")
+        self.untag(docs=docs, tags=tag)
+
+    def remove_doc(self, doc_name: str):
+        shard = self.shard_of(doc_name)
+        self._send(shard, "remove_doc", doc_name)
+        self._receive([shard])
+
+    def query(
+        self,
+        query: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        order: Optional[str] = None,
+    ) -> Union[set, List[str]]:
+        if limit is None and not offset and order is None:
+            return set().union(*self._broadcast("query", query))
+        if order not in (None, "asc", "desc"):
+            raise ValueError(f"Unknown order '{order}', expected 'asc' or 'desc'.")
+        # Each shard returns its own first offset + limit docs in order, and the
+        # global page is the same slice of their merge.
+        pages = self._broadcast(
+            "query",
+            query,
+            limit=None if limit is None else offset + limit,
+            order=order or "asc",
+        )
+        merged = heapq.merge(*pages, reverse=order == "desc")
+        page = list(merged)
+        return page[offset:] if limit is None else page[offset : offset + limit]
+
+    def query_count(self, query: str) -> int:
+        return sum(self._broadcast("query_count", query))
+
+    def to_json(self, at: Optional[str] = None):
+        if at is None and self.at is not None:
+            at = self.at
+        elif self.at is None:
+            self.at = at
+        if at is None:
+            raise FileNotFoundError(
+                f"{type(self).__name__} missing a read/write location 'at'"
+            )
+        os.makedirs(at, exist_ok=True)
+        for shard in range(self.shards):
+            self._send(shard, "to_json", at=_shard_path(at, shard))
+        self._receive(range(self.shards))
+        write_json_atomic(
+            {"shards": self.shards, "engine": self.engine.__name__},
+            os.path.join(at, MANIFEST),
+        )
+
+    @classmethod
+    def from_json(cls, at: str, engine: Type[TagIndex] = TagIndex) -> "ShardedTagIndex":
+        with open(os.path.join(at, MANIFEST), "r") as from_file:
+            manifest = ujson.load(from_file)
+        if manifest["engine"] != engine.__name__:
+            raise ValueError(
+                f"Shards were saved by {manifest['engine']}, not {engine.__name__}."
+            )
+        return cls(shards=manifest["shards"], at=at, engine=engine)
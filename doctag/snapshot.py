@@ -0,0 +1,272 @@
+import mmap
+import struct
+import sys
+from array import array
+from typing import Iterable, List, Mapping, Optional, Sequence
+
+import ujson
+
+from .persistence import atomic_write
+
+MAGIC = b"DTAGSNAP"
+VERSION = 1
+
+# magic, version, reserved, doc count, tag count, then (offset, length) for each of
+# the sections below. Every section starts on an 8-byte boundary so it can be cast
+# straight to a typed memoryview.
+_SECTIONS = (
+    "doc_offsets",
+    "doc_names",
+    "tag_offsets",
+    "tag_names",
+    "tag_indptr",
+    "tag_indices",
+    "doc_indptr",
+    "doc_indices",
+    "metadata",
+)
+_HEADER = struct.Struct("<8sIIQQ" + "QQ" * len(_SECTIONS))
+
+if array("I").itemsize != 4 or array("Q").itemsize != 8:  # pragma: no cover
+    raise ImportError("doctag snapshots need 4-byte 'I' and 8-byte 'Q' arrays.")
+
+
+def _string_table(names: Sequence[str]):
+    # Names are stored NUL-terminated so the whole table can be decoded with one
+    # split, with offsets alongside for random access by id.
+    offsets = array("Q", [0])
+    blob = bytearray()
+    for name in names:
+        blob += name.encode("utf-8")
+        blob += b"\0"
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+def _postings(
+    names: Sequence[str],
+    index: Mapping[str, Iterable[str]],
+    ids: Mapping[str, int],
+):
+    indptr = array("Q", [0])
+    indices = array("I")
+    for name in names:
+        indices.extend(sorted(ids[value] for value in index[name]))
+        indptr.append(len(indices))
+    return indptr, indices
+
+
+def write_snapshot(
+    at: str,
+    tag_to_docs: Mapping[str, Iterable[str]],
+    doc_to_tags: Mapping[str, Iterable[str]],
+    metadata: Optional[dict] = None,
+):
+    docs = sorted(doc_to_tags)
+    tags = sorted(tag_to_docs)
+    doc_ids = {doc: i for i, doc in enumerate(docs)}
+    tag_ids = {tag: i for i, tag in enumerate(tags)}
+    sections = [
+        *_string_table(docs),
+        *_string_table(tags),
+        *_postings(tags, tag_to_docs, doc_ids),
+        *_postings(docs, doc_to_tags, tag_ids),
+        ujson.dumps(metadata or {}).encode("utf-8"),
+    ]
+    blobs = []
+    for section in sections:
+        if isinstance(section, array):
+            if sys.byteorder == "big":
+                section = array(section.typecode, section)
+                section.byteswap()
+            section = section.tobytes()
+        blobs.append(bytes(section))
+    layout: List[int] = []
+    position = _HEADER.size
+    for blob in blobs:
+        position += -position % 8
+        layout.extend((position, len(blob)))
+        position += len(blob)
+    header = _HEADER.pack(MAGIC, VERSION, 0, len(docs), len(tags), *layout)
+    with atomic_write(at, "wb") as to_file:
+        to_file.write(header)
+        written = len(header)
+        for offset, blob in zip(layout[::2], blobs):
+            to_file.write(b"\0" * (offset - written))
+            to_file.write(blob)
+            written = offset + len(blob)
+
+
+class Snapshot:
+    """A read-only view of a binary snapshot, backed by ``mmap`` by default.
+
+    Names are sorted in the string tables, so lookups by name are binary searches and
+    nothing is decoded until it is asked for.
+    """
+
+    def __init__(self, at: str, use_mmap: bool = True):
+        self.at = at
+        self._mmap: Optional[mmap.mmap] = None
+        # The mapping keeps its own handle, so the file can be closed (or replaced on
+        # disk) straight away; the mapped pages live as long as any view of them.
+        with open(at, "rb") as from_file:
+            if use_mmap:
+                self._mmap = mmap.mmap(from_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._buffer = memoryview(self._mmap)
+            else:
+                self._buffer = memoryview(from_file.read())
+        if len(self._buffer) < _HEADER.size:
+            self.close()
+            raise ValueError(f"'{at}' is not a doctag snapshot.")
+        magic, version, _, self.doc_count, self.tag_count, *layout = _HEADER.unpack(
+            self._buffer[: _HEADER.size]
+        )
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"'{at}' is not a doctag snapshot.")
+        elif version != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported doctag snapshot version {version}.")
+        self._views: List[memoryview] = []
+        sections = {
+            name: self._buffer[offset : offset + length]
+            for name, offset, length in zip(_SECTIONS, layout[::2], layout[1::2])
+        }
+        self._views.extend(sections.values())
+        self._doc_offsets = self._cast(sections["doc_offsets"], "Q")
+        self._doc_names = sections["doc_names"]
+        self._tag_offsets = self._cast(sections["tag_offsets"], "Q")
+        self._tag_names = sections["tag_names"]
+        self._tag_indptr = self._cast(sections["tag_indptr"], "Q")
+        self._tag_indices = self._cast(sections["tag_indices"], "I")
+        self._doc_indptr = self._cast(sections["doc_indptr"], "Q")
+        self._doc_indices = self._cast(sections["doc_indices"], "I")
+        self.pair_count = len(self._tag_indices)
+        self.metadata: dict = ujson.loads(bytes(sections["metadata"]).decode("utf-8"))
+
+    def _cast(self, section: memoryview, typecode: str):
+        if sys.byteorder == "big":
+            swapped = array(typecode, section.tobytes())
+            swapped.byteswap()
+            return swapped
+        view = section.cast(typecode)  # type: ignore
+        self._views.append(view)
+        return view
+
+    def close(self):
+        for view in getattr(self, "_views", []):
+            view.release()
+        self._views = []
+        self._buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.close()
+
+    @staticmethod
+    def _names(blob: memoryview) -> List[str]:
+        return bytes(blob).decode("utf-8").split("\0")[:-1]
+
+    @staticmethod
+    def _name(blob: memoryview, offsets, i: int) -> str:
+        return bytes(blob[offsets[i] : offsets[i + 1] - 1]).decode("utf-8")
+
+    @classmethod
+    def _lower_bound(cls, blob: memoryview, offsets, count: int, name: str) -> int:
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if cls._name(blob, offsets, middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @classmethod
+    def _find(cls, blob: memoryview, offsets, count: int, name: str) -> Optional[int]:
+        low = cls._lower_bound(blob, offsets, count, name)
+        if low < count and cls._name(blob, offsets, low) == name:
+            return low
+        return None
+
+    def doc_names(self) -> List[str]:
+        return self._names(self._doc_names)
+
+    def tag_names(self) -> List[str]:
+        return self._names(self._tag_names)
+
+    def doc_name(self, doc_id: int) -> str:
+        return self._name(self._doc_names, self._doc_offsets, doc_id)
+
+    def tag_name(self, tag_id: int) -> str:
+        return self._name(self._tag_names, self._tag_offsets, tag_id)
+
+    def find_doc(self, doc: str) -> Optional[int]:
+        return self._find(self._doc_names, self._doc_offsets, self.doc_count, doc)
+
+    def find_tag(self, tag: str) -> Optional[int]:
+        return self._find(self._tag_names, self._tag_offsets, self.tag_count, tag)
+
+    def tag_range(self, start: str, stop: Optional[str] = None) -> range:
+        """Ids of the tags from ``start`` (inclusive) up to ``stop`` (exclusive)."""
+        bound = self._lower_bound
+        low = bound(self._tag_names, self._tag_offsets, self.tag_count, start)
+        if stop is None:
+            return range(low, self.tag_count)
+        return range(
+            low, bound(self._tag_names, self._tag_offsets, self.tag_count, stop)
+        )
+
+    def tag_postings(self, tag_id: int) -> Sequence[int]:
+        return self._tag_indices[
+            self._tag_indptr[tag_id] : self._tag_indptr[tag_id + 1]
+        ]
+
+    def tag_size(self, tag_id: int) -> int:
+        return self._tag_indptr[tag_id + 1] - self._tag_indptr[tag_id]
+
+    def doc_size(self, doc_id: int) -> int:
+        return self._doc_indptr[doc_id + 1] - self._doc_indptr[doc_id]
+
+    def doc_postings(self, doc_id: int) -> Sequence[int]:
+        return self._doc_indices[
+            self._doc_indptr[doc_id] : self._doc_indptr[doc_id + 1]
+        ]
+
+
+def json_to_binary(json_at: str, binary_at: str):
+    with open(json_at, "r") as from_file:
+        serial = ujson.load(from_file)
+    serial.pop("checksum", None)
+    if "doc_to_tags" in serial.keys():
+        doc_to_tags = serial.pop("doc_to_tags")
+        tag_to_docs: dict = {}
+        for doc, tags in doc_to_tags.items():
+            for tag in tags:
+                tag_to_docs.setdefault(tag, []).append(doc)
+    elif "tag_to_docs" in serial.keys():
+        tag_to_docs = serial.pop("tag_to_docs")
+        doc_to_tags = {}
+        for tag, docs in tag_to_docs.items():
+            for doc in docs:
+                doc_to_tags.setdefault(doc, []).append(tag)
+    else:
+        raise ValueError("File does not contain 'tag_to_docs' or 'doc_to_tags' index.")
+    write_snapshot(binary_at, tag_to_docs, doc_to_tags, serial)
+
+
+def binary_to_json(binary_at: str, json_at: str):
+    with Snapshot(binary_at) as snapshot:
+        serial = dict(snapshot.metadata)
+        tags = snapshot.tag_names()
+        serial["doc_to_tags"] = {
+            doc: [tags[tag_id] for tag_id in snapshot.doc_postings(doc_id)]
+            for doc_id, doc in enumerate(snapshot.doc_names())
+        }
+    with atomic_write(json_at) as to_file:
+        ujson.dump(serial, to_file)
@@ -1,32 +1,392 @@
+import heapq
 import os
-import sys
-from collections import defaultdict
-from itertools import product
+import threading
+import time
+import zlib
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from itertools import islice, product
 from pathlib import Path
-from typing import Any, DefaultDict, Dict, Iterable, List, Optional, Set, Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    DefaultDict,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import boolean
 import ujson
 from doctag_cli.metamarkdown import MetaMarkdown
 
+from .persistence import WriteAheadLog, file_lock, read_generation, write_json_atomic
+from .profiling import Profiler, profiled
+from .snapshot import Snapshot, write_snapshot
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .cooccurrence import CoOccurrence
+    from .views import View, Views
+
+
+def _listify(items: Union[str, Iterable[str]]) -> List[str]:
+    return list(items) if not isinstance(items, str) else [items]
+
+
+WILDCARDS = ("*", "?")
+
+
+def _literal_prefix(pattern: str) -> str:
+    end = min((pattern.find(char) for char in WILDCARDS if char in pattern), default=-1)
+    return pattern if end == -1 else pattern[:end]
+
+
+def _prefix_end(prefix: str) -> str:
+    # The smallest string greater than every string starting with `prefix`.
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def checksum(postings: Mapping[str, Iterable[str]]) -> dict:
+    """An order-independent checksum of one direction of an index, as saved by to_json."""
+    pairs = 0
+    digest = 0
+    for key, values in postings.items():
+        values_ = sorted(values)
+        pairs += len(values_)
+        digest += zlib.crc32("\0".join([key, *values_]).encode("utf-8"))
+    return {"pairs": pairs, "digest": digest % 2**64}
+
+
+def _verify_checksum(serial: dict, postings: Mapping[str, Iterable[str]]):
+    if "checksum" in serial and checksum(postings) != serial["checksum"]:
+        raise ValueError("Index doesn't match its checksum; the file is corrupt.")
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+PlanNode = namedtuple("PlanNode", ["op", "estimate", "children", "tag"])
+IndexStats = namedtuple("IndexStats", ["docs", "tags", "pairs"])
+
+
+class _LazyPostings:
+    """The result of a UNION, INTERSECT or DIFFERENCE over postings, never built.
+
+    Iterating yields each doc from the first child holding it, checked against the
+    other children by membership, and ``in`` asks the children in turn. So streaming
+    a query holds one doc at a time, whatever the size of its result.
+    """
+
+    def __init__(self, op: str, children: list):
+        self.op = op
+        self.children = children
+
+    def __contains__(self, doc) -> bool:
+        first, *rest = self.children
+        if self.op == "UNION":
+            return any(doc in child for child in self.children)
+        elif self.op == "INTERSECT":
+            return doc in first and all(doc in child for child in rest)
+        return doc in first and not any(doc in child for child in rest)
+
+    def __iter__(self) -> Iterator:
+        first, *rest = self.children
+        if self.op == "UNION":
+            for i, child in enumerate(self.children):
+                earlier = self.children[:i]
+                for doc in child:
+                    if not any(doc in other for other in earlier):
+                        yield doc
+        elif self.op == "INTERSECT":
+            for doc in first:
+                if all(doc in child for child in rest):
+                    yield doc
+        else:
+            for doc in first:
+                if not any(doc in child for child in rest):
+                    yield doc
+
+
+class CompiledQuery:
+    """A parsed and simplified query bound to the index it was compiled against.
+
+    Only the expression is kept, never its result, so calling the plan always reflects
+    the current state of the index.
+    """
+
+    def __init__(
+        self,
+        index: "TagIndex",
+        query: str,
+        expression: Any,
+        timings: Optional[Tuple[float, float]] = None,
+    ):
+        self.index = index
+        self.query = query
+        self.expression = expression
+        # (parse, simplify) seconds, when compiled under a profiler and not yet traced.
+        self.timings = timings
+
+    def __call__(self) -> set:
+        if self.index.profiler is not None:
+            return self.index.profiler.trace(
+                self, "query", lambda: self.index._execute(self.expression)
+            )
+        return self.index._execute(self.expression)
+
+    def iter(self) -> Iterator[str]:
+        if self.index.profiler is not None:
+            return self.index.profiler.trace(
+                self, "iter", lambda: self.index._execute_iter(self.expression)
+            )
+        return self.index._execute_iter(self.expression)
+
+    def count(self) -> int:
+        if self.index.profiler is not None:
+            return self.index.profiler.trace(
+                self, "count", lambda: self.index._execute_count(self.expression)
+            )
+        return self.index._execute_count(self.expression)
+
+    def explain(self) -> str:
+        lines: List[str] = []
+        self._explain(self.index._plan_root(self.expression), 0, lines)
+        return "\n".join(lines)
+
+    def _explain(self, node: "PlanNode", depth: int, lines: List[str]):
+        label = f"TAG {node.tag!r}" if node.op == "TAG" else node.op
+        lines.append(f"{'  ' * depth}{label} (est. {node.estimate})")
+        for child in node.children:
+            self._explain(child, depth + 1, lines)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.query!r})"
+
+
+class _Batch:
+    def __init__(self):
+        self.added: DefaultDict[str, Set[str]] = defaultdict(set)
+        self.removed: DefaultDict[str, Set[str]] = defaultdict(set)
+        self.validated: Dict[Tuple[str, ...], List[str]] = dict()
+
+    def tag(self, docs: Iterable[str], tags: Iterable[str]):
+        for doc in docs:
+            self.added[doc].update(tags)
+            self.removed[doc].difference_update(tags)
+
+    def untag(self, docs: Iterable[str], tags: Iterable[str]):
+        for doc in docs:
+            self.removed[doc].update(tags)
+            self.added[doc].difference_update(tags)
+
 
 class TagIndex:
-    def __init__(self, at: Optional[str] = None):
-        self.tag_to_docs: DefaultDict[str, Set[str]] = DefaultDict(set)
-        self.doc_to_tags: DefaultDict[str, Set[str]] = DefaultDict(set)
-        self.algebra = boolean.BooleanAlgebra()
+    """An in-memory index between documents and their tags, saved to JSON at ``at``.
+
+    Several indexes may save to one path: each save merges this index's changes since
+    it was loaded or saved into whatever another one saved meanwhile. With
+    ``wal=True`` changes go to a write-ahead log beside the snapshot instead, and the
+    snapshot is rewritten from memory when the log is compacted, so a path with a log
+    takes a single writer. Other writers are refused while that writer holds unsaved
+    records, and it refuses to write after any other writer has changed the path; a
+    log left by a writer which has saved is merged into the next save without one.
+    """
+
+    wal_compact_bytes = 64 * 2**20
+    wal_compact_ratio = 0.5
+    # Changes kept for merging into another writer's save before the journal is
+    # folded into just the set of docs changed.
+    journal_limit = 100000
+    # Save a checksum with to_json, which from_json then verifies.
+    json_checksum = False
+    profiler: Optional[Profiler] = None
+    # The direction ("tag_to_docs" or "doc_to_tags") which was not loaded from disk
+    # and is still to be built from the other one, on first use.
+    _unbuilt: Optional[str] = None
+
+    def __init__(
+        self, at: Optional[str] = None, query_cache_size: int = 256, wal: bool = False
+    ):
+        self._init_storage()
+        # Tags may be hierarchical (proj/alpha) and query terms may be globs (proj/*).
+        self.algebra = boolean.BooleanAlgebra(
+            allowed_in_token=(".", ":", "_", "/", *WILDCARDS)
+        )
+        self._sorted_tags: Optional[List[str]] = None
         self.at = at
+        self._wal: Optional[WriteAheadLog] = None
+        if wal:
+            if at is None:
+                raise ValueError("A write-ahead log needs a read/write location 'at'.")
+            self._wal = WriteAheadLog(at)
+        self._compaction: Optional[threading.Thread] = None
+        self._compaction_error: Optional[BaseException] = None
+        self._batch: Optional[_Batch] = None
+        self._cooccurrence: Optional["CoOccurrence"] = None
+        self._views: Optional["Views"] = None
+        # Whether views were registered or unregistered since the last full save, which
+        # the write-ahead log doesn't record.
+        self._views_changed = False
+        # The generation of the file at `at` which this index was loaded from or last
+        # saved to, and the changes made since, to redo on top of a newer save by
+        # another writer. There's nothing to merge into until then.
+        self._generation: Optional[int] = None
+        self._journal: Optional[List[Tuple[str, List[str], List[str]]]] = None
+        # Docs changed by journal entries folded away past journal_limit.
+        self._touched: Optional[Set[str]] = None
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, CompiledQuery]" = OrderedDict()
+        self._query_cache_hits = 0
+        self._query_cache_misses = 0
+
+    def _init_storage(self):
+        self._tag_to_docs: DefaultDict[str, Set[str]] = DefaultDict(set)
+        self._doc_to_tags: DefaultDict[str, Set[str]] = DefaultDict(set)
+        # Total doc/tag pairs; counted on first use, then kept up to date by _tag and
+        # _untag so stats() never has to walk the index.
+        self._pairs: Optional[int] = None
+
+    @property
+    def tag_to_docs(self) -> DefaultDict[str, Set[str]]:
+        if self._unbuilt == "tag_to_docs":
+            self._build_inverse()
+        return self._tag_to_docs
+
+    @tag_to_docs.setter
+    def tag_to_docs(self, value):
+        self._tag_to_docs = value
+
+    @property
+    def doc_to_tags(self) -> DefaultDict[str, Set[str]]:
+        if self._unbuilt == "doc_to_tags":
+            self._build_inverse()
+        return self._doc_to_tags
+
+    @doc_to_tags.setter
+    def doc_to_tags(self, value):
+        self._doc_to_tags = value
+
+    def _build_inverse(self):
+        # Reading only the loaded direction leaves this unbuilt, but _tag and _untag
+        # fetch both, so every change sees both in step.
+        unbuilt, self._unbuilt = self._unbuilt, None
+        if unbuilt == "doc_to_tags":
+            doc_to_tags = self._doc_to_tags
+            for tag, docs in self._tag_to_docs.items():
+                for doc in docs:
+                    doc_to_tags[doc].add(tag)
+        elif unbuilt == "tag_to_docs":
+            tag_to_docs = self._tag_to_docs
+            for doc, tags in self._doc_to_tags.items():
+                for tag in tags:
+                    tag_to_docs[tag].add(doc)
 
     @property
     def tags(self):
-        return set(self.tag_to_docs.keys())
+        return self.tag_to_docs.keys()
 
     @property
     def docs(self):
-        return set(self.doc_to_tags.keys())
+        return self.doc_to_tags.keys()
+
+    def tag_frequency(self, tag: str) -> int:
+        return self._tag_size(tag)
+
+    def doc_tag_count(self, doc: str) -> int:
+        return len(self.doc_to_tags[doc]) if doc in self.docs else 0
+
+    def top_tags(self, n: int = 10) -> List[Tuple[str, int]]:
+        sizes = ((tag, self._tag_size(tag)) for tag in self.tags)
+        return heapq.nsmallest(n, sizes, key=lambda item: (-item[1], item[0]))
+
+    def related_tags(
+        self, tag: str, k: int = 10, measure: str = "count"
+    ) -> List[Tuple[str, float]]:
+        """The ``k`` tags scoring highest against ``tag`` by ``measure``.
+
+        ``measure`` is ``"count"`` (docs tagged with both), ``"jaccard"`` or ``"pmi"``.
+        Needs numpy and scipy.
+        """
+        return self._co_occurrence().related(tag, k=k, measure=measure)
+
+    def co_occurrence(self, tag_a: str, tag_b: str) -> int:
+        return self._co_occurrence().count(tag_a, tag_b)
+
+    def similarity(self, tag_a: str, tag_b: str, measure: str = "jaccard") -> float:
+        return self._co_occurrence().similarity(tag_a, tag_b, measure=measure)
+
+    def _co_occurrence(self) -> "CoOccurrence":
+        # Built on first use, then kept current by touching every doc that changes.
+        # Imported here so numpy and scipy are only loaded by indexes which use them.
+        from .cooccurrence import CoOccurrence
+
+        if self._cooccurrence is None:
+            self._cooccurrence = CoOccurrence(self.doc_to_tags)
+        return self._cooccurrence
+
+    def register_view(self, name: str, query: str) -> FrozenSet[str]:
+        """Save ``query`` as the view ``name`` and return its result.
+
+        The result is computed once, then kept up to date by every change, which
+        re-checks just the docs it touched, so reading it with ``view(name)`` is a
+        lookup. Registering a name again replaces its view. Views are saved by to_json.
+        """
+        view = self._add_view(name, query)
+        self._views_changed = True
+        return self._freeze(view)
+
+    def unregister_view(self, name: str):
+        if not self._views or name not in self._views:
+            raise ValueError(f"View '{name}' not found.")
+        self._views.remove(name)
+        self._views_changed = True
+
+    @property
+    def views(self) -> Dict[str, str]:
+        return self._views.queries() if self._views else {}
+
+    def view(self, name: str) -> FrozenSet[str]:
+        if not self._views or name not in self._views:
+            raise ValueError(f"View '{name}' not found.")
+        view = self._views[name]
+        return view.frozen if view.frozen is not None else self._freeze(view)
+
+    def _add_view(self, name: str, query: str) -> "View":
+        from .views import View, Views
+
+        if self._views is None:
+            self._views = Views()
+        view = View(query, self.compile(query).expression)
+        self._views.add(name, view)
+        return view
+
+    def _freeze(self, view: "View") -> FrozenSet[str]:
+        # Views loaded from disk are materialized here, on first read.
+        if view.docs is None:
+            view.docs = set(self.compile(view.query)())
+        view.frozen = frozenset(view.docs)
+        return view.frozen
+
+    def stats(self) -> IndexStats:
+        if self._pairs is None:
+            self._pairs = self._count_pairs()
+        return IndexStats(
+            docs=len(self.doc_to_tags), tags=len(self.tag_to_docs), pairs=self._pairs
+        )
 
     @property
     def conflicts(self) -> Set[str]:
+        if self._unbuilt is not None:
+            # Nothing has changed since loading, and one direction is still to be
+            # derived from the other, so they can't disagree.
+            return set()
         conflicts = set()
         for tag, docs in self.tag_to_docs.items():
             for doc in docs:
@@ -44,52 +404,209 @@ class TagIndex:
 
     def get_docs(self, tag: str):
         if tag in self.tags:
-            docs = {doc for doc in self.tag_to_docs[tag]}
+            docs = set(self.tag_to_docs[tag])
         else:
             docs = set()
         return docs
 
     def tag(self, docs: Union[str, Iterable[str]], tags: Union[str, Iterable[str]]):
-        docs_ = (
-            docs if isinstance(docs, Iterable) and not isinstance(docs, str) else [docs]
-        )
-        tags_ = (
-            tags if isinstance(tags, Iterable) and not isinstance(tags, str) else [tags]
-        )
-        if {"false", "true", "0", "1"} & {tag.lower() for tag in tags_}:
+        # Timed inline rather than with @profiled, which costs more than a small tag.
+        start = time.perf_counter() if self.profiler is not None else None
+        docs_ = _listify(docs)
+        tags_ = self._validate(_listify(tags))
+        self._tag(docs=docs_, tags=tags_)
+        if self._cooccurrence is not None:
+            self._cooccurrence.touch(docs_)
+        if self._views:
+            self._views.changed(self.doc_to_tags, docs_, tags_)
+        if self._wal is not None:
+            self._wal.append("tag", docs_, tags_)
+        if self._journal is not None:
+            self._journal_append("tag", docs_, tags_)
+        if self._batch is not None:
+            self._batch.tag(docs=docs_, tags=tags_)
+        else:
+            self._tag_callback(docs=docs_, tags=tags_)
+        if start is not None and self.profiler is not None:
+            self.profiler.record("tag", time.perf_counter() - start)
+
+    def _validate(self, tags: List[str]) -> List[str]:
+        if self._batch is not None and tuple(tags) in self._batch.validated:
+            return self._batch.validated[tuple(tags)]
+        if {"false", "true", "0", "1"} & {tag.lower() for tag in tags}:
             raise ValueError(
                 "'true', 'false', '0', and '1' are reserved names and cannot be used as tags."
             )
-        tags_ = self._tag_validator(tags_)
-        self._tag(docs=docs_, tags=tags_)
-        self._tag_callback(docs=docs_, tags=tags_)
+        elif any(char in tag for tag in tags for char in WILDCARDS):
+            raise ValueError("'*' and '?' are wildcards and cannot be used in tags.")
+        validated = list(self._tag_validator(tags))
+        if self._batch is not None:
+            self._batch.validated[tuple(tags)] = validated
+        return validated
+
+    @profiled("bulk_load")
+    def bulk_load(
+        self, pairs: Iterable[Tuple[str, str]], chunk_size: int = 100000
+    ) -> int:
+        """Tag every (doc, tag) pair in ``pairs``; return how many pairs were read.
+
+        ``pairs`` may be any iterable, such as ``read_pairs(at)``, and is consumed
+        ``chunk_size`` pairs at a time, so memory stays bounded however long it is.
+        Each chunk's distinct tags are validated together, and each doc in it is tagged,
+        and its callback fired, once. ``_tag_validator`` has to map tags one for one.
+        """
+        pairs_ = iter(pairs)
+        loaded = 0
+        while True:
+            by_doc: DefaultDict[str, List[str]] = defaultdict(list)
+            for doc, tag in islice(pairs_, chunk_size):
+                by_doc[doc].append(tag)
+                loaded += 1
+            if not by_doc:
+                return loaded
+            self._bulk_tag(by_doc)
+
+    def _bulk_tag(self, by_doc: Dict[str, List[str]]):
+        names = list({tag for tags in by_doc.values() for tag in tags})
+        validated = self._validate(names)
+        if len(validated) != len(names):
+            raise ValueError("bulk_load needs a _tag_validator which maps tags 1:1.")
+        renamed = None if validated == names else dict(zip(names, validated))
+        if self._cooccurrence is not None:
+            self._cooccurrence.touch(by_doc)
+        # The chunk is already grouped by doc, so each doc's callback can fire at once
+        # with all of its tags, without the bookkeeping of a batch().
+        for doc, tags in by_doc.items():
+            tags_ = tags if renamed is None else [renamed[tag] for tag in tags]
+            self._tag(docs=[doc], tags=tags_)
+            if self._wal is not None:
+                self._wal.append("tag", [doc], tags_)
+            if self._journal is not None:
+                self._journal_append("tag", [doc], tags_)
+            if self._batch is not None:
+                self._batch.tag(docs=[doc], tags=tags_)
+            else:
+                self._tag_callback(docs=[doc], tags=tags_)
+        if self._views:
+            self._views.changed(self.doc_to_tags, by_doc, validated)
+
+    def export_pairs(self) -> Iterator[Tuple[str, str]]:
+        """Stream every (doc, tag) pair, e.g. into ``write_pairs``.
+
+        Walks whichever direction is already built. The index must not change until
+        the iterator is used up.
+        """
+        if self._unbuilt == "doc_to_tags":
+            for tag, docs in self.tag_to_docs.items():
+                for doc in docs:
+                    yield doc, tag
+        else:
+            for doc, tags in self.doc_to_tags.items():
+                for tag in tags:
+                    yield doc, tag
+
+    def _set_doc_tags(self, doc: str, tags: Iterable[str]):
+        # Make `doc`'s tags exactly `tags` without firing the callbacks, for tags which
+        # were read back from the document itself.
+        tags_ = set(tags)
+        current = self.doc_to_tags.get(doc, set())
+        removed = list(current - tags_)
+        added = list(tags_ - current)
+        if self._cooccurrence is not None and (added or removed):
+            self._cooccurrence.touch([doc])
+        if removed:
+            self._untag(docs=[doc], tags=removed)
+            if self._wal is not None:
+                self._wal.append("untag", [doc], removed)
+            if self._journal is not None:
+                self._journal_append("untag", [doc], removed)
+        if added:
+            self._tag(docs=[doc], tags=added)
+            if self._wal is not None:
+                self._wal.append("tag", [doc], added)
+            if self._journal is not None:
+                self._journal_append("tag", [doc], added)
+        if self._views and (added or removed):
+            self._views.changed(self.doc_to_tags, [doc], added + removed)
 
     def _tag(self, docs: Iterable[str], tags: Iterable[str]):
+        tag_to_docs, doc_to_tags = self.tag_to_docs, self.doc_to_tags
         for doc, tag in product(docs, tags):
-            self.doc_to_tags[doc].add(tag)
-            self.tag_to_docs[tag].add(doc)
+            doc_tags = doc_to_tags[doc]
+            if self._pairs is not None and tag not in doc_tags:
+                self._pairs += 1
+            doc_tags.add(tag)
+            if self._sorted_tags is not None and tag not in tag_to_docs:
+                insort(self._sorted_tags, tag)
+            tag_to_docs[tag].add(doc)
 
     def untag(self, docs: Union[str, Iterable[str]], tags: Union[str, Iterable[str]]):
-        docs_ = (
-            docs if isinstance(docs, Iterable) and not isinstance(docs, str) else [docs]
-        )
-        tags_ = (
-            tags if isinstance(tags, Iterable) and not isinstance(tags, str) else [tags]
-        )
-        for doc, tag in product(docs_, tags_):
+        start = time.perf_counter() if self.profiler is not None else None
+        docs_ = _listify(docs)
+        tags_ = _listify(tags)
+        self._untag(docs=docs_, tags=tags_)
+        if self._cooccurrence is not None:
+            self._cooccurrence.touch(docs_)
+        if self._views:
+            self._views.changed(self.doc_to_tags, docs_, tags_)
+        if self._wal is not None:
+            self._wal.append("untag", docs_, tags_)
+        if self._journal is not None:
+            self._journal_append("untag", docs_, tags_)
+        if self._batch is not None:
+            self._batch.untag(docs=docs_, tags=tags_)
+        else:
+            self._untag_callback(docs=docs_, tags=tags_)
+        if start is not None and self.profiler is not None:
+            self.profiler.record("untag", time.perf_counter() - start)
+
+    def _untag(self, docs: Iterable[str], tags: Iterable[str]):
+        tag_to_docs, doc_to_tags = self.tag_to_docs, self.doc_to_tags
+        for doc, tag in product(docs, tags):
             try:
-                self.doc_to_tags[doc].remove(tag)
+                doc_to_tags[doc].remove(tag)
+                if self._pairs is not None:
+                    self._pairs -= 1
             except KeyError:
                 pass
             try:
-                self.tag_to_docs[tag].remove(doc)
+                tag_to_docs[tag].remove(doc)
             except KeyError:
                 pass
-            if not self.tag_to_docs[tag]:
-                del self.tag_to_docs[tag]
-            if not self.doc_to_tags[doc]:
-                del self.doc_to_tags[doc]
-        self._untag_callback(docs=docs_, tags=tags_)
+            if not tag_to_docs[tag]:
+                del tag_to_docs[tag]
+                self._unindex_tag(tag)
+            if not doc_to_tags[doc]:
+                del doc_to_tags[doc]
+
+    def _unindex_tag(self, tag: str):
+        if self._sorted_tags is not None:
+            i = bisect_left(self._sorted_tags, tag)
+            if i < len(self._sorted_tags) and self._sorted_tags[i] == tag:
+                del self._sorted_tags[i]
+
+    def match_tags(self, pattern: str) -> List[str]:
+        """The tags matching a glob ``pattern``, in sorted order.
+
+        The literal prefix before the first wildcard is looked up by binary search in
+        a sorted tag dictionary, so ``proj/*`` only visits tags under ``proj/``.
+        """
+        prefix = _literal_prefix(pattern)
+        tags = self._tag_range(prefix)
+        if pattern == prefix + "*":
+            return tags
+        return [tag for tag in tags if fnmatchcase(tag, pattern)]
+
+    def _tag_range(self, prefix: str) -> List[str]:
+        if self._sorted_tags is None:
+            # Built on first use, then kept sorted by _tag and _untag.
+            self._sorted_tags = sorted(self.tags)
+        start = bisect_left(self._sorted_tags, prefix)
+        if not prefix:
+            return self._sorted_tags[start:]
+        return self._sorted_tags[
+            start : bisect_left(self._sorted_tags, _prefix_end(prefix))
+        ]
 
     def remove_tag(self, tag: str):
         if tag not in self.tags:
@@ -98,10 +615,10 @@ class TagIndex:
             self.untag(docs=self.tag_to_docs[tag], tags=tag)
 
     def merge_tags(self, old_tags: Union[str, Iterable[str]], new_tag: str):
-        old_tags_ = old_tags if isinstance(old_tags, list) else [old_tags]
-        for old_tag in old_tags_:
-            self.tag(docs=self.tag_to_docs[old_tag], tags=new_tag)
-            self.remove_tag(old_tag)
+        with self.batch():
+            for old_tag in _listify(old_tags):
+                self.tag(docs=self.tag_to_docs[old_tag], tags=new_tag)
+                self.remove_tag(old_tag)
 
     def rename_doc(self, old_doc_name: str, new_doc_name: str):
         if new_doc_name in self.docs:
@@ -109,8 +626,9 @@ class TagIndex:
         elif old_doc_name not in self.docs:
             raise ValueError(f"Document named '{old_doc_name}' not found.")
         else:
-            self.tag(docs=new_doc_name, tags=self.doc_to_tags[old_doc_name])
-            self.untag(docs=old_doc_name, tags=self.doc_to_tags[old_doc_name])
+            with self.batch():
+                self.tag(docs=new_doc_name, tags=self.doc_to_tags[old_doc_name])
+                self.untag(docs=old_doc_name, tags=self.doc_to_tags[old_doc_name])
 
     def remove_doc(self, doc_name: str):
         if doc_name not in self.docs:
@@ -118,101 +636,514 @@ class TagIndex:
         else:
             self.untag(docs=doc_name, tags=self.doc_to_tags[doc_name])
 
+    @profiled("to_json", counts_bytes=True)
     def to_json(self, at: Optional[str] = None):
         if at is None and self.at is not None:
             at = self.at
-        elif self.at is None and self.at is not None:
+        elif self.at is None:
             self.at = at
-        serial = dict()
-        dtt_size = sys.getsizeof(self.doc_to_tags)
-        ttd_size = sys.getsizeof(self.tag_to_docs)
-        ttd_bigger = ttd_size >= dtt_size
-        if ttd_bigger:
-            serial["doc_to_tags"] = self.doc_to_tags
+        if (
+            self._wal is not None
+            and at == self.at
+            and os.path.exists(str(at))
+            and not self._views_changed
+        ):
+            # The log already holds every mutation since the last snapshot, so saving
+            # only needs to make it durable; the snapshot is rewritten once the log
+            # has grown enough to be worth folding in. Closing it lets other writers
+            # at it until this index appends again.
+            self._wal.close()
+            log_size = self._wal.size
+            if log_size >= self.wal_compact_bytes or (
+                log_size >= self.wal_compact_ratio * os.path.getsize(str(at))
+            ):
+                self.compact(background=True)
+            return
+        self._wait_for_compaction()
+        with file_lock(str(at)):
+            saved = read_generation(str(at))
+            if self._wal is not None and at == self.at:
+                self._check_sole_writer(saved)
+                records: list = []
+            else:
+                log = WriteAheadLog(str(at))
+                if log.in_use():
+                    raise ValueError(
+                        f"'{at}' has a write-ahead log with unsaved records; save the "
+                        "index writing to it first."
+                    )
+                # A log left by a writer which has since saved is merged, not dropped.
+                records = list(log.records()) if at == self.at else []
+            if (
+                at == self.at
+                and self._journal is not None
+                and saved is not None
+                and (saved != self._generation or records)
+            ):
+                # Another writer saved since this index was loaded; merge into that.
+                with open(str(at), "r") as from_file:
+                    self._rebase(ujson.load(from_file), records)
+            serial = self._serialize()
+            serial["generation"] = max(saved or 0, self._generation or 0) + 1
+            write_json_atomic(serial, str(at))
+        if at == self.at:
+            (self._wal or WriteAheadLog(str(at))).reset()
+            self._views_changed = False
+            self._generation = serial["generation"]
+            self._journal = [] if self._wal is None else None
+            self._touched = None
+
+    def compact(self, background: bool = False):
+        if self._wal is None:
+            raise ValueError(
+                f"{type(self).__name__} has no write-ahead log to compact."
+            )
+        self._wait_for_compaction()
+        with file_lock(str(self.at)):
+            self._check_sole_writer(read_generation(str(self.at)))
+        self._generation = (self._generation or 0) + 1
+        serial = self._serialize()
+        self._views_changed = False
+        self._wal.rotate()
+        if background:
+            self._compaction = threading.Thread(
+                target=self._write_compaction, args=(serial, self._wal)
+            )
+            self._compaction.start()
         else:
-            serial["tag_to_docs"] = self.tag_to_docs
-        with open(str(at), "w") as to_file:
-            ujson.dump(serial, to_file)
+            self._write_compaction(serial, self._wal)
+            self._wait_for_compaction()
+
+    def _check_sole_writer(self, saved: Optional[int]):
+        # The snapshot is rewritten from memory in WAL mode, which would drop another
+        # writer's save, or records it logged, made since this index last read them.
+        assert self._wal is not None
+        if (
+            self._generation is not None
+            and saved is not None
+            and saved != self._generation
+        ) or self._wal.changed_elsewhere():
+            raise ValueError(
+                f"'{self.at}' was changed by another writer since this index loaded or "
+                "saved it; a write-ahead log takes a single writer."
+            )
+
+    def _write_compaction(self, serial: dict, wal: WriteAheadLog):
+        try:
+            with file_lock(str(self.at)):
+                write_json_atomic(serial, str(self.at))
+            wal.drop_rotated()
+        except BaseException as e:
+            self._compaction_error = e
+
+    def _wait_for_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+        if self._compaction_error is not None:
+            error, self._compaction_error = self._compaction_error, None
+            raise error
+
+    def _serialize(self) -> dict:
+        # The generation goes first, for read_generation.
+        serial = {"generation": self._generation or 0, **self._metadata()}
+        if self._stored_direction() == "doc_to_tags":
+            postings = {doc: list(tags) for doc, tags in self.doc_to_tags.items()}
+            serial["doc_to_tags"] = postings
+        else:
+            postings = {tag: list(docs) for tag, docs in self.tag_to_docs.items()}
+            serial["tag_to_docs"] = postings
+        if self.json_checksum:
+            serial["checksum"] = checksum(postings)
+        if self._views:
+            serial["views"] = self._views.queries()
+        return serial
+
+    def _stored_direction(self) -> str:
+        if self._unbuilt is not None:
+            return "tag_to_docs" if self._unbuilt == "doc_to_tags" else "doc_to_tags"
+        # Either direction holds every pair once, but a pair is saved as the name on
+        # the other side, so save the one whose keys are repeated less, by length.
+        doc_names = sum(len(doc) + 3 for doc in self.doc_to_tags)
+        tag_names = sum(len(tag) + 3 for tag in self.tag_to_docs)
+        by_doc = doc_names + sum(
+            (len(tag) + 3) * len(docs) for tag, docs in self.tag_to_docs.items()
+        )
+        by_tag = tag_names + sum(
+            (len(doc) + 3) * len(tags) for doc, tags in self.doc_to_tags.items()
+        )
+        return "doc_to_tags" if by_doc <= by_tag else "tag_to_docs"
+
+    def _metadata(self) -> dict:
+        return dict()
 
     @classmethod
-    def from_json(cls, at: str) -> "TagIndex":
+    def _from_metadata(cls, at: Optional[str], metadata: dict, wal: bool = False):
+        return cls(at=at, wal=wal)
+
+    @classmethod
+    @profiled("from_json", counts_bytes=True)
+    def from_json(cls, at: str, wal: bool = False) -> "TagIndex":
         with open(at, "r") as from_file:
             serial = ujson.load(from_file)
-            ti = TagIndex(at=at)
-            if "doc_to_tags" in serial.keys():
-                ti.doc_to_tags.update(
-                    {str(doc): set(tags) for doc, tags in serial["doc_to_tags"].items()}
-                )
-                for doc, tags in ti.doc_to_tags.items():
-                    for tag in tags:
-                        ti.tag_to_docs[str(tag)].add(doc)
-            elif "tag_to_docs" in serial.keys():
-                ti.tag_to_docs.update(
-                    {str(tag): set(docs) for tag, docs in serial["tag_to_docs"].items()}
-                )
-                for tag, docs in ti.tag_to_docs.items():
-                    for doc in docs:
-                        ti.doc_to_tags[str(doc)].add(tag)
-            else:
-                raise ValueError(
-                    "File does not contain 'tag_to_docs' or 'doc_to_tags' index."
-                )
+            ti = cls._from_metadata(at=at, metadata=serial, wal=wal)
+            ti._load_serial(serial)
+            # Views are materialized on first read, so loading doesn't run them all.
+            for name, query in serial.get("views", {}).items():
+                ti._add_view(name, query)
+            ti._generation = serial.get("generation", 0)
+        ti._replay_log()
+        if ti._wal is None:
+            ti._journal = []
         return ti
 
-    def query(self, query=str) -> set:
-        return self._parse_query(query)
+    def to_binary(self, at: str):
+        write_snapshot(at, self.tag_to_docs, self.doc_to_tags, self._metadata())
 
-    def _parse_query(self, query: str) -> set:
-        expression = self.algebra.parse(query).simplify()
-        try:
-            args = expression.args
-            operator = expression.operator
-        except AttributeError:
-            return self.get_docs(expression.obj)
-        return self._parse_expression(operator=operator, args=args)
-
-    def _parse_expression(self, operator: str, args: list) -> set:
-        if operator == "&":
-            result = self._parse_expression_and(args)
-        elif operator == "|":
-            result = self._parse_expression_or(args)
-        elif operator == "~":
-            result = self._parse_expression_not(args[0])
-        return result
+    @classmethod
+    def from_binary(cls, at: str) -> "TagIndex":
+        with Snapshot(at) as snapshot:
+            ti = cls._from_metadata(at=None, metadata=snapshot.metadata)
+            ti._load_snapshot(snapshot)
+        return ti
 
-    def _parse_expression_and(self, args: list) -> set:
-        sub_results = []
-        for arg in args:
-            if isinstance(arg, boolean.Symbol):
-                sub_result = self.get_docs(arg.obj)
-            else:
-                sub_result = self._parse_expression(
-                    operator=arg.operator, args=arg.args
-                )
-            if len(sub_result) == 0:
-                return set()
-            else:
-                sub_results.append(sub_result)
-        return set.intersection(*sub_results)
-
-    def _parse_expression_or(self, args: list) -> set:
-        sub_results = []
-        for arg in args:
-            if isinstance(arg, boolean.Symbol):
-                sub_result = self.get_docs(arg.obj)
-            else:
-                sub_result = self._parse_expression(
-                    operator=arg.operator, args=arg.args
-                )
-            sub_results.append(sub_result)
-        return set.union(*sub_results)
-
-    def _parse_expression_not(self, arg) -> set:
-        if isinstance(arg, boolean.Symbol):
-            docs_with_tag = self.get_docs(arg.obj)
+    def _load_snapshot(self, snapshot: Snapshot):
+        # map() over the packed id arrays keeps the per-posting work in C.
+        docs = snapshot.doc_names()
+        tags = snapshot.tag_names()
+        for tag_id, tag in enumerate(tags):
+            self.tag_to_docs[tag] = set(
+                map(docs.__getitem__, snapshot.tag_postings(tag_id))
+            )
+        for doc_id, doc in enumerate(docs):
+            self.doc_to_tags[doc] = set(
+                map(tags.__getitem__, snapshot.doc_postings(doc_id))
+            )
+        self._pairs = snapshot.pair_count
+
+    def _replay_log(self):
+        # Replaying a rotated log over a snapshot which already contains it is
+        # harmless: each record sets explicit doc/tag pairs, so applying a sequence a
+        # second time leaves the same state as applying it once.
+        self._apply((self._wal or WriteAheadLog(str(self.at))).records())
+
+    def _apply(self, records: Iterable[Tuple[str, List[str], List[str]]]):
+        for op, docs, tags in records:
+            if op == "tag":
+                self._tag(docs=docs, tags=tags)
+            elif op == "untag":
+                self._untag(docs=docs, tags=tags)
+
+    def _journal_append(self, op: str, docs: List[str], tags: List[str]):
+        journal = self._journal
+        if journal is None:
+            return
+        journal.append((op, docs, tags))
+        if len(journal) > self.journal_limit:
+            # Too many changes to keep one by one, as in a long bulk_load: keep only
+            # which docs changed, which grows with the docs rather than the changes.
+            if self._touched is None:
+                self._touched = set()
+            for _, docs_, _ in journal:
+                self._touched.update(docs_)
+            journal.clear()
+
+    def _rebase(
+        self, serial: dict, records: Iterable[Tuple[str, List[str], List[str]]] = ()
+    ):
+        # A three-way merge: this session's changes since the last load or save are
+        # redone, in order, on top of the newer saved state and any log records left
+        # over it. Every doc/tag pair which
+        # was changed here ends up as it was left here; every other pair is as the
+        # other writer saved it. Docs in _touched keep all of their tags as here.
+        journal = self._journal or []
+        touched = {
+            doc: set(self.doc_to_tags.get(doc, ())) for doc in self._touched or ()
+        }
+        self._reload(serial)
+        self._apply(records)
+        for doc, tags in touched.items():
+            saved = set(self.doc_to_tags.get(doc, ()))
+            if saved - tags:
+                self._untag(docs=[doc], tags=list(saved - tags))
+            if tags - saved:
+                self._tag(docs=[doc], tags=list(tags - saved))
+        self._apply(journal)
+        self._generation = serial.get("generation", 0)
+        self._cooccurrence = None
+        if not self._views_changed:
+            # No views were registered or unregistered here, so take the saved ones.
+            self._views = None
+            for name, query in serial.get("views", {}).items():
+                self._add_view(name, query)
+        elif self._views:
+            self._views.invalidate()
+
+    def _reload(self, serial: dict):
+        self._init_storage()
+        self._unbuilt = None
+        self._sorted_tags = None
+        self._load_serial(serial)
+
+    def _load_serial(self, serial: dict):
+        # Only the saved direction is loaded; the other is built on first use.
+        if "doc_to_tags" in serial.keys():
+            _verify_checksum(serial, serial["doc_to_tags"])
+            self._doc_to_tags.update(
+                {str(doc): set(tags) for doc, tags in serial["doc_to_tags"].items()}
+            )
+            self._unbuilt = "tag_to_docs"
+        elif "tag_to_docs" in serial.keys():
+            _verify_checksum(serial, serial["tag_to_docs"])
+            self._tag_to_docs.update(
+                {str(tag): set(docs) for tag, docs in serial["tag_to_docs"].items()}
+            )
+            self._unbuilt = "doc_to_tags"
         else:
-            docs_with_tag = self._parse_expression(operator=arg.operator, args=arg.args)
-        return self.docs - docs_with_tag
+            raise ValueError(
+                "File does not contain 'tag_to_docs' or 'doc_to_tags' index."
+            )
+
+    def query(
+        self,
+        query: str,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        order: Optional[str] = None,
+    ) -> Union[set, List[str]]:
+        if limit is None and not offset and order is None:
+            return self.compile(query)()
+        if order not in (None, "asc", "desc"):
+            raise ValueError(f"Unknown order '{order}', expected 'asc' or 'desc'.")
+        docs = self.query_iter(query)
+        if limit is None:
+            page = sorted(docs, reverse=order == "desc")
+            return page[offset:]
+        elif order == "desc":
+            page = heapq.nlargest(offset + limit, docs)
+        else:
+            page = heapq.nsmallest(offset + limit, docs)
+        return page[offset:]
+
+    def query_iter(self, query: str) -> Iterator[str]:
+        return self.compile(query).iter()
+
+    def query_count(self, query: str) -> int:
+        return self.compile(query).count()
+
+    def compile(self, query: str) -> CompiledQuery:
+        key = " ".join(query.split())
+        plan = self._query_cache.get(key)
+        if plan is not None:
+            self._query_cache.move_to_end(key)
+            self._query_cache_hits += 1
+            return plan
+        self._query_cache_misses += 1
+        if self.profiler is not None:
+            start = time.perf_counter()
+            parsed = self.algebra.parse(key)
+            parsed_at = time.perf_counter()
+            expression = parsed.simplify()
+            timings = (parsed_at - start, time.perf_counter() - parsed_at)
+            plan = CompiledQuery(self, key, expression, timings=timings)
+        else:
+            plan = CompiledQuery(self, key, self.algebra.parse(key).simplify())
+        if self.query_cache_size > 0:
+            self._query_cache[key] = plan
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return plan
+
+    def query_cache_info(self) -> CacheInfo:
+        return CacheInfo(
+            hits=self._query_cache_hits,
+            misses=self._query_cache_misses,
+            maxsize=self.query_cache_size,
+            currsize=len(self._query_cache),
+        )
+
+    def clear_query_cache(self):
+        self._query_cache.clear()
+        self._query_cache_hits = 0
+        self._query_cache_misses = 0
+
+    def explain(self, query: str) -> str:
+        return self.compile(query).explain()
+
+    @contextmanager
+    def profile(self, **kwargs):
+        """Profile this index for the duration of the block; see Profiler."""
+        with Profiler(**kwargs).attach(self) as profiler:
+            yield profiler
+
+    def _execute(self, expression) -> set:
+        node = self._plan_root(expression)
+        if node.op == "TAG":
+            return self.get_docs(node.tag)
+        return self._decode(self._run(node))
+
+    def _execute_iter(self, expression) -> Iterator[str]:
+        node = self._plan_root(expression)
+        if node.op == "COMPLEMENT":
+            return self._iter_complement(self._lazy(node.children[0]))
+        return self._iter_postings(self._lazy(node))
+
+    def _execute_count(self, expression) -> int:
+        node = self._plan_root(expression)
+        if node.op == "TAG":
+            return self._tag_size(node.tag)
+        elif node.op == "COMPLEMENT":
+            return self._universe_size() - self._size(self._run(node.children[0]))
+        return self._size(self._run(node))
+
+    def _plan_root(self, expression) -> PlanNode:
+        node, negated = self._plan(expression)
+        if negated:
+            node = PlanNode(
+                "COMPLEMENT",
+                max(self._universe_size() - node.estimate, 0),
+                (node,),
+                None,
+            )
+        return node
+
+    def _plan(self, expression) -> Tuple[PlanNode, bool]:
+        # Returns a node computing a set S and whether the expression's value is S
+        # itself or its complement. Carrying the complement lazily means NOTs are
+        # pushed down into set differences and the universe is only built when the
+        # whole query is negated.
+        if expression == self.algebra.TRUE:
+            return PlanNode("EMPTY", 0, (), None), True
+        elif expression == self.algebra.FALSE:
+            return PlanNode("EMPTY", 0, (), None), False
+        elif isinstance(expression, boolean.Symbol):
+            tag = expression.obj
+            if any(char in tag for char in WILDCARDS):
+                nodes = [
+                    PlanNode("TAG", self._tag_size(tag_), (), tag_)
+                    for tag_ in self.match_tags(tag)
+                ]
+                if not nodes:
+                    return PlanNode("EMPTY", 0, (), None), False
+                return self._plan_union(nodes), False
+            return PlanNode("TAG", self._tag_size(tag), (), tag), False
+        elif expression.operator == "~":
+            node, negated = self._plan(expression.args[0])
+            return node, not negated
+        children = [self._plan(arg) for arg in expression.args]
+        positive = sorted(
+            (node for node, negated in children if not negated),
+            key=lambda node: node.estimate,
+        )
+        negative = [node for node, negated in children if negated]
+        if expression.operator == "&":
+            # a & b & ~c & ~d == (a & b) - c - d == ~(c | d) if there is no a, b
+            if positive:
+                node = self._plan_difference(self._plan_intersect(positive), negative)
+                return node, False
+            return self._plan_union(negative), True
+        # a | b | ~c | ~d == ~((c & d) - a - b)
+        if negative:
+            negative.sort(key=lambda node: node.estimate)
+            return self._plan_difference(self._plan_intersect(negative), positive), True
+        return self._plan_union(positive), False
+
+    def _plan_intersect(self, nodes: List[PlanNode]) -> PlanNode:
+        if len(nodes) == 1:
+            return nodes[0]
+        return PlanNode("INTERSECT", nodes[0].estimate, tuple(nodes), None)
+
+    def _plan_union(self, nodes: List[PlanNode]) -> PlanNode:
+        if len(nodes) == 1:
+            return nodes[0]
+        # Not capped by the universe size, which on an index loaded as tag_to_docs
+        # would build doc_to_tags just to plan a query which doesn't need it.
+        estimate = sum(node.estimate for node in nodes)
+        return PlanNode("UNION", estimate, tuple(nodes), None)
+
+    def _plan_difference(self, node: PlanNode, nodes: List[PlanNode]) -> PlanNode:
+        if not nodes:
+            return node
+        return PlanNode("DIFFERENCE", node.estimate, (node, *nodes), None)
+
+    def _run(self, node: PlanNode):
+        profiler = self.profiler
+        if profiler is not None and profiler.tracing():
+            return profiler.run_node(self, node)
+        return self._evaluate(node)
+
+    def _lazy(self, node: PlanNode):
+        # Postings for streaming: each tag's are fetched now, but are combined only doc
+        # by doc as they're read, so memory stays bounded by what the caller keeps.
+        if node.op in ("TAG", "EMPTY"):
+            return self._run(node)
+        return _LazyPostings(node.op, [self._lazy(child) for child in node.children])
+
+    def _evaluate(self, node: PlanNode):
+        if node.op == "TAG":
+            return self._postings(node.tag)
+        elif node.op == "EMPTY":
+            return self._postings_empty()
+        elif node.op == "COMPLEMENT":
+            return self._complement(self._run(node.children[0]))
+        elif node.op == "UNION":
+            return self._union([self._run(child) for child in node.children])
+        result = self._run(node.children[0])
+        for child in node.children[1:]:
+            if not result:
+                return self._postings_empty()
+            elif node.op == "INTERSECT":
+                result = self._intersect(result, self._run(child))
+            else:
+                result = self._difference(result, self._run(child))
+        return result
+
+    # The query executor only touches postings through the hooks below, so a
+    # subclass can swap the storage engine without reimplementing the planner.
+
+    def _postings(self, tag: str):
+        return self.tag_to_docs.get(tag, set())
+
+    def _postings_empty(self):
+        return set()
+
+    def _union(self, postings: list):
+        return set().union(*postings)
+
+    def _intersect(self, postings, other):
+        return postings & other
+
+    def _complement(self, postings):
+        return self.docs - postings
+
+    def _difference(self, postings, other):
+        return postings - other
+
+    def _count_pairs(self) -> int:
+        return sum(len(tags) for tags in self.doc_to_tags.values())
+
+    def _tag_size(self, tag: str) -> int:
+        return len(self.tag_to_docs.get(tag, ()))
+
+    def _universe_size(self) -> int:
+        return len(self.doc_to_tags)
+
+    def _decode(self, postings) -> set:
+        return postings
+
+    def _size(self, postings) -> int:
+        return len(postings)
+
+    # Generators, so the index's sets are only read once iteration starts, and not
+    # when the iterator is made: a FileTagIndex only holds its lock while iterating.
+
+    def _iter_postings(self, postings) -> Iterator[str]:
+        yield from postings
+
+    def _iter_complement(self, postings) -> Iterator[str]:
+        for doc in self.doc_to_tags:
+            if doc not in postings:
+                yield doc
 
     def _tag_callback(self, docs, tags):
         pass
@@ -220,9 +1151,35 @@ class TagIndex:
     def _untag_callback(self, docs, tags):
         pass
 
+    def _delta_callback(self, doc: str, added: Set[str], removed: Set[str]):
+        if added:
+            self._tag_callback(docs=[doc], tags=list(added))
+        if removed:
+            self._untag_callback(docs=[doc], tags=list(removed))
+
     def _tag_validator(self, tags: Iterable[str]) -> Iterable[str]:
         return tags
 
+    @contextmanager
+    def batch(self):
+        # Index changes apply immediately so reads inside the batch see them; the
+        # callbacks (e.g. file rewrites) are coalesced into one net delta per doc and
+        # run when the outermost batch exits, even if it exits with an error, so the
+        # documents never fall behind the index.
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = _Batch()
+        try:
+            yield self
+        finally:
+            batch, self._batch = self._batch, None
+            for doc in set(batch.added) | set(batch.removed):
+                added = batch.added.get(doc, set())
+                removed = batch.removed.get(doc, set())
+                if added or removed:
+                    self._delta_callback(doc=doc, added=added, removed=removed)
+
     def __enter__(self):
         if not self.at:
             raise FileNotFoundError(
@@ -0,0 +1,133 @@
+from fnmatch import fnmatchcase
+from typing import AbstractSet, Any, Dict, FrozenSet, Iterable, Mapping, Optional, Set
+
+import boolean
+
+from .tagindex import WILDCARDS
+
+
+def _symbols(expression: Any) -> Set[str]:
+    if isinstance(expression, boolean.Symbol):
+        return {expression.obj}
+    return set().union(*(_symbols(arg) for arg in getattr(expression, "args", ())))
+
+
+def matches(expression: Any, tags: AbstractSet[str]) -> bool:
+    """Whether a doc tagged with exactly ``tags`` is in the result of ``expression``."""
+    if isinstance(expression, boolean.Symbol):
+        term = expression.obj
+        if any(char in term for char in WILDCARDS):
+            return any(fnmatchcase(tag, term) for tag in tags)
+        return term in tags
+    operator = getattr(expression, "operator", None)
+    if operator == "~":
+        return not matches(expression.args[0], tags)
+    elif operator == "&":
+        return all(matches(arg, tags) for arg in expression.args)
+    elif operator == "|":
+        return any(matches(arg, tags) for arg in expression.args)
+    # TRUE or FALSE.
+    return bool(expression)
+
+
+class View:
+    def __init__(self, query: str, expression: Any):
+        self.query = query
+        self.expression = expression
+        terms = _symbols(expression)
+        self.patterns = sorted(
+            term for term in terms if any(char in term for char in WILDCARDS)
+        )
+        self.tags = terms.difference(self.patterns)
+        # A doc with none of the view's tags is in it, as for `not done`, so any doc
+        # entering or leaving the index may change it.
+        self.matches_untagged = matches(expression, set())
+        # The result, kept current in place; None until materialized.
+        self.docs: Optional[Set[str]] = None
+        # A copy of docs to hand out, made on first read after a change.
+        self.frozen: Optional[FrozenSet[str]] = None
+
+    def affected_by(self, tags: Iterable[str]) -> bool:
+        return self.matches_untagged or any(
+            fnmatchcase(tag, pattern) for tag in tags for pattern in self.patterns
+        )
+
+    def update(self, doc_to_tags: Mapping[str, AbstractSet[str]], docs: Iterable[str]):
+        if self.docs is None:
+            return
+        for doc in docs:
+            tags = doc_to_tags.get(doc)
+            if tags is not None and matches(self.expression, tags):
+                if doc not in self.docs:
+                    self.docs.add(doc)
+                    self.frozen = None
+            elif doc in self.docs:
+                self.docs.remove(doc)
+                self.frozen = None
+
+
+class Views:
+    """Saved queries whose results are kept current as docs are tagged and untagged.
+
+    A change re-checks only the docs it touched, and only in the views which mention
+    one of its tags, or which have a wildcard or match untagged docs. Each doc is
+    checked against the view's expression and its own tags, without running a query.
+    """
+
+    def __init__(self):
+        self._views: Dict[str, View] = {}
+        self._by_tag: Dict[str, Set[str]] = {}
+        # Views which can't be found by tag alone.
+        self._scanned: Set[str] = set()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._views
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    def __getitem__(self, name: str) -> View:
+        return self._views[name]
+
+    def queries(self) -> Dict[str, str]:
+        return {name: view.query for name, view in self._views.items()}
+
+    def add(self, name: str, view: View):
+        if name in self._views:
+            self.remove(name)
+        self._views[name] = view
+        for tag in view.tags:
+            self._by_tag.setdefault(tag, set()).add(name)
+        if view.patterns or view.matches_untagged:
+            self._scanned.add(name)
+
+    def remove(self, name: str):
+        view = self._views.pop(name)
+        for tag in view.tags:
+            self._by_tag[tag].discard(name)
+            if not self._by_tag[tag]:
+                del self._by_tag[tag]
+        self._scanned.discard(name)
+
+    def invalidate(self):
+        # For when the index was replaced wholesale; each view is rerun on next read.
+        for view in self._views.values():
+            view.docs = view.frozen = None
+
+    def changed(
+        self,
+        doc_to_tags: Mapping[str, AbstractSet[str]],
+        docs: Iterable[str],
+        tags: Iterable[str],
+    ):
+        tags_ = set(tags)
+        names: Set[str] = set()
+        for tag in tags_:
+            names.update(self._by_tag.get(tag, ()))
+        names.update(
+            name for name in self._scanned if self._views[name].affected_by(tags_)
+        )
+        if names:
+            docs_ = list(docs)
+            for name in names:
+                self._views[name].update(doc_to_tags, docs_)
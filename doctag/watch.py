@@ -0,0 +1,223 @@
+import os
+import queue
+import sys
+import threading
+import time
+from collections import namedtuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # pragma: no cover
+    INotify = None
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .filetagindex import FileTagIndex
+
+WatchStats = namedtuple(
+    "WatchStats",
+    [
+        "backend",
+        "events",
+        "batches",
+        "files",
+        "errors",
+        "queue_depth",
+        "lag",
+        "max_lag",
+    ],
+)
+
+
+class Watcher:
+    """Keeps a FileTagIndex in sync with edits made to its root_dir by anyone.
+
+    Changed paths come from inotify when ``inotify_simple`` is installed on Linux, and
+    otherwise from polling stat() every ``poll_interval`` seconds. Bursts of events
+    are debounced: once ``debounce`` seconds pass without a new event, every path seen
+    is reparsed once, and the tags read are applied on the watcher's thread under
+    the index's ``lock``. Every call into the index holds that lock, and an iterator
+    from it holds the lock until it is used up or closed, so no call sees the index
+    change halfway through; hold ``index.lock`` to make several calls, or to read
+    ``tag_to_docs`` or ``doc_to_tags`` directly, against one state. ``stats()``
+    reports the queue depth and how far behind the filesystem the index is.
+    """
+
+    def __init__(
+        self,
+        index: "FileTagIndex",
+        debounce: float = 0.2,
+        poll_interval: float = 1.0,
+        backend: Optional[str] = None,
+    ):
+        if backend is None:
+            backend = (
+                "inotify" if INotify and sys.platform.startswith("linux") else "poll"
+            )
+        elif backend not in ("inotify", "poll"):
+            raise ValueError(
+                f"Unknown backend '{backend}', expected 'inotify' or 'poll'."
+            )
+        elif backend == "inotify" and INotify is None:
+            raise ImportError("The inotify backend needs the inotify_simple package.")
+        self.index = index
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.backend = backend
+        self.errors: Dict[str, str] = {}
+        self._queue: "queue.Queue[Tuple[str, float]]" = queue.Queue()
+        # Guards the counters below, and the oldest event not yet applied to the index.
+        self._pending = threading.Lock()
+        self._oldest: Optional[float] = None
+        self._in_flight = 0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._events = 0
+        self._batches = 0
+        self._files = 0
+        self._max_lag = 0.0
+
+    def start(self):
+        source = self._inotify if self.backend == "inotify" else self._poll
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=source, daemon=True),
+            threading.Thread(target=self._read, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        # The event source stops first; the reader then applies whatever it queued.
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self) -> "Watcher":
+        return self
+
+    def __exit__(self, etype, evalue, traceback):
+        self.stop()
+
+    def stats(self) -> WatchStats:
+        with self._pending:
+            lag = 0.0 if self._oldest is None else time.monotonic() - self._oldest
+            return WatchStats(
+                backend=self.backend,
+                events=self._events,
+                batches=self._batches,
+                files=self._files,
+                errors=len(self.errors),
+                queue_depth=self._queue.qsize() + self._in_flight,
+                lag=lag,
+                max_lag=max(self._max_lag, lag),
+            )
+
+    def _emit(self, path: str):
+        now = time.monotonic()
+        with self._pending:
+            self._events += 1
+            if self._oldest is None:
+                self._oldest = now
+            self._queue.put((path, now))
+
+    def _read(self):
+        while True:
+            try:
+                path, first_seen = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            paths = {path}
+            # Keep collecting until the burst has been quiet for `debounce` seconds, or
+            # just take what is queued once stopping.
+            while True:
+                with self._pending:
+                    self._in_flight = len(paths)
+                try:
+                    path, _ = self._queue.get(
+                        block=not self._stop.is_set(), timeout=self.debounce
+                    )
+                except queue.Empty:
+                    break
+                paths.add(path)
+            results = self.index._read_paths(sorted(paths))
+            with self.index.lock:
+                errors = self.index._apply_paths(results)
+            with self._pending:
+                self.errors.update(errors)
+                self._batches += 1
+                self._files += len(results)
+                self._in_flight = 0
+                self._max_lag = max(self._max_lag, time.monotonic() - first_seen)
+                # Anything queued meanwhile is unapplied, and the head of the queue is
+                # its oldest event.
+                with self._queue.mutex:
+                    queued = self._queue.queue
+                    self._oldest = queued[0][1] if queued else None
+
+    def _stat_tree(self) -> Dict[str, Tuple[int, int]]:
+        stats = {}
+        for path in self.index._walk():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def _poll(self):
+        known = self._stat_tree()
+        while not self._stop.wait(self.poll_interval):
+            current = self._stat_tree()
+            for path, stat in current.items():
+                if known.get(path) != stat:
+                    self._emit(path)
+            for path in known.keys() - current.keys():
+                self._emit(path)
+            known = current
+
+    def _inotify(self):
+        inotify = INotify()
+        mask = (
+            flags.CREATE
+            | flags.CLOSE_WRITE
+            | flags.DELETE
+            | flags.MOVED_FROM
+            | flags.MOVED_TO
+        )
+        directories: Dict[int, str] = {}
+
+        def add_tree(root: str, emit: bool):
+            for dirpath, _, filenames in os.walk(root):
+                try:
+                    directories[inotify.add_watch(dirpath, mask)] = dirpath
+                except OSError:
+                    continue
+                if emit:
+                    # Files created before the watch on a new directory was in place.
+                    for filename in filenames:
+                        if self.index._matches(filename):
+                            self._emit(os.path.join(dirpath, filename))
+
+        add_tree(str(self.index.root_dir), emit=False)
+        try:
+            while not self._stop.is_set():
+                for event in inotify.read(timeout=100):
+                    directory = directories.get(event.wd)
+                    if directory is None:
+                        continue
+                    path = os.path.join(directory, event.name)
+                    if event.mask & flags.ISDIR:
+                        if event.mask & (flags.CREATE | flags.MOVED_TO):
+                            add_tree(path, emit=True)
+                        else:
+                            for known in list(self.index.manifest):
+                                if known.startswith(path + os.sep):
+                                    self._emit(known)
+                    elif self.index._matches(path):
+                        self._emit(path)
+        finally:
+            inotify.close()
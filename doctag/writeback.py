@@ -0,0 +1,81 @@
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+_Job = Tuple[str, Tuple[str, ...], Tuple[str, ...]]
+
+
+class WriteBack:
+    """Applies document rewrites on background threads.
+
+    ``submit`` queues a ``rewrite(doc, added, removed)`` call and returns at once.
+    Each doc always goes to the same worker, so rewrites of one file run in the order
+    they were submitted. The queues are bounded, and ``submit`` blocks while a queue is
+    full, which keeps a large sweep from getting far ahead of the disk. A failed
+    rewrite is recorded in ``errors`` against its doc and the other rewrites carry on.
+    """
+
+    def __init__(
+        self,
+        rewrite: Callable[[str, Iterable[str], Iterable[str]], None],
+        workers: int = 4,
+        queue_size: int = 1024,
+    ):
+        if workers < 1:
+            raise ValueError("WriteBack needs at least one worker.")
+        self.rewrite = rewrite
+        self.errors: Dict[str, str] = {}
+        self._queues: "List[queue.Queue[Optional[_Job]]]" = [
+            queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)
+        ]
+        self._threads = [
+            threading.Thread(target=self._work, args=(jobs,), daemon=True)
+            for jobs in self._queues
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def pending(self) -> int:
+        return sum(jobs.unfinished_tasks for jobs in self._queues)
+
+    def submit(self, doc: str, added: Iterable[str], removed: Iterable[str]):
+        if not self._threads:
+            raise ValueError("WriteBack is closed.")
+        jobs = self._queues[hash(doc) % len(self._queues)]
+        jobs.put((doc, tuple(added), tuple(removed)))
+
+    def join(self):
+        for jobs in self._queues:
+            jobs.join()
+
+    def flush(self) -> Dict[str, str]:
+        """Block until every submitted rewrite is done; return and clear the errors."""
+        self.join()
+        errors, self.errors = self.errors, {}
+        return errors
+
+    def close(self) -> Dict[str, str]:
+        errors = self.flush()
+        for jobs in self._queues:
+            jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return errors
+
+    def _work(self, jobs: "queue.Queue[Optional[_Job]]"):
+        while True:
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
+                doc, added, removed = job
+                try:
+                    self.rewrite(doc, added, removed)
+                except Exception as e:
+                    # Whatever went wrong, the worker has to live on to drain its
+                    # queue, or join() would wait forever.
+                    self.errors[doc] = str(e) or type(e).__name__
+            finally:
+                jobs.task_done()
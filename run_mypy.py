@@ -3,7 +3,24 @@ import sys
 
 # inspired by https://github.com/Axelrod-Python/Axelrod/pull/878/files
 
-modules = ["doctag/tagindex.py", "doctag/filetagindex.py"]
+modules = [
+    "doctag/tagindex.py",
+    "doctag/filetagindex.py",
+    "doctag/bitmaptagindex.py",
+    "doctag/persistence.py",
+    "doctag/snapshot.py",
+    "doctag/mappedtagindex.py",
+    "doctag/watch.py",
+    "doctag/writeback.py",
+    "doctag/cooccurrence.py",
+    "doctag/shardedtagindex.py",
+    "doctag/server.py",
+    "doctag/concurrenttagindex.py",
+    "doctag/client.py",
+    "doctag/profiling.py",
+    "doctag/pairs.py",
+    "doctag/views.py",
+]
 
 exit_codes = []
 for module in modules:
@@ -11,12 +11,15 @@ setup(
         "doctag_cli @ git+https://github.com/daturkel/doctag_cli.git@v0.0.2",
     ],
     extras_require={
-        "test": ["pytest>=4.6", "pytest-cov>=2.7", "coveralls>=1.8.0", "mypy==0.701"]
+        "test": ["pytest>=4.6", "pytest-cov>=2.7", "coveralls>=1.8.0", "mypy==0.701"],
+        "watch": ["inotify_simple>=1.3"],
+        "related": ["numpy>=1.17", "scipy>=1.4"],
     },
     url="https://github.com/daturkel/doctag",
     author="Dan Turkel",
     author_email="daturkel@gmail.com",
     license="MIT",
     packages=["doctag"],
+    entry_points={"console_scripts": ["doctag = doctag.__main__:main"]},
     zip_safe=False,
 )
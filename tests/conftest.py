@@ -1,5 +1,5 @@
 import pytest
-from doctag import FileTagIndex, TagIndex
+from doctag import BitmapTagIndex, FileTagIndex, TagIndex
 
 
 @pytest.fixture
@@ -26,3 +26,12 @@ def simple_fti():
     ti.tag_to_docs["tag_c"] = {"doc_2"}
     ti.tag_to_docs["tag_d"] = {"doc_3"}
     return ti
+
+
+@pytest.fixture
+def simple_bti():
+    ti = BitmapTagIndex()
+    ti.tag(docs="doc_1", tags=["tag_a", "tag_b"])
+    ti.tag(docs="doc_2", tags=["tag_a", "tag_b", "tag_c"])
+    ti.tag(docs="doc_3", tags="tag_d")
+    return ti
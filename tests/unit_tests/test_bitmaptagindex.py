@@ -0,0 +1,145 @@
+from array import array
+
+import pytest
+from doctag import BitmapTagIndex, TagIndex
+from doctag.bitmaptagindex import _insert, _intersect, _remove
+
+
+@pytest.mark.parametrize("ids", [[7, 3, 3, 70000], list(range(0, 100, 3))])
+def test_postings_updates(ids):
+    postings = array("I", [3, 5, 64])
+    expected = sorted({3, 5, 64, *ids})
+    assert _insert(postings, ids) == len(expected) - 3
+    assert list(postings) == expected
+    assert _remove(postings, [*ids, 1000]) == len(set(ids))
+    assert list(postings) == sorted({3, 5, 64} - set(ids))
+
+
+def test_intersect():
+    small, large = array("I", [2, 50, 99]), array("I", range(0, 100, 2))
+    assert list(_intersect(small, large)) == [2, 50]
+    assert list(_intersect(large, array("I", range(0, 100, 3)))) == list(
+        range(0, 100, 6)
+    )
+    assert not _intersect(small, array("I"))
+
+
+def test_simple_bti(simple_bti: BitmapTagIndex):
+    assert simple_bti.tags == {"tag_a", "tag_b", "tag_c", "tag_d"}
+    assert simple_bti.docs == {"doc_1", "doc_2", "doc_3"}
+    assert simple_bti.tag_to_docs["tag_a"] == {"doc_1", "doc_2"}
+    assert simple_bti.doc_to_tags["doc_2"] == {"tag_a", "tag_b", "tag_c"}
+    assert not simple_bti.conflicts
+
+
+def test_get_docs(simple_bti: BitmapTagIndex):
+    assert simple_bti.get_docs(tag="tag_a") == {"doc_1", "doc_2"}
+    assert simple_bti.get_docs(tag="tag_e") == set()
+    assert "tag_e" not in simple_bti.tag_to_docs
+
+
+def test_untag(simple_bti: BitmapTagIndex):
+    simple_bti.untag(docs="doc_2", tags=["tag_a", "tag_b", "tag_c"])
+    assert "doc_2" not in simple_bti.docs
+    assert "tag_c" not in simple_bti.tags
+    assert simple_bti.get_docs(tag="tag_a") == {"doc_1"}
+    simple_bti.untag(docs="doc_99", tags="tag_a")
+    assert simple_bti.get_docs(tag="tag_a") == {"doc_1"}
+    assert not simple_bti.conflicts
+
+
+def test_postings_are_sparse():
+    bti = BitmapTagIndex()
+    bti.tag(docs=[f"doc_{i}" for i in range(1000)], tags="tag_all")
+    bti.tag(docs="doc_999", tags="tag_last")
+    # One id per pair, however high the ids go.
+    assert len(bti._postings("tag_last")) == 1
+    assert bti._tag_size("tag_all") == 1000
+    assert bti.query_count("tag_all and not tag_last") == 999
+
+
+def test_ids_are_reused(simple_bti: BitmapTagIndex):
+    simple_bti.remove_doc(doc_name="doc_3")
+    simple_bti.tag(docs="doc_4", tags="tag_e")
+    assert len(simple_bti._doc_names) == 3
+    assert len(simple_bti._tag_names) == 4
+    assert simple_bti.query("tag_e") == {"doc_4"}
+    assert simple_bti.query("not tag_a") == {"doc_4"}
+
+
+def test_merge_and_rename(simple_bti: BitmapTagIndex):
+    simple_bti.merge_tags(old_tags=["tag_a", "tag_c"], new_tag="tag_e")
+    assert simple_bti.get_docs(tag="tag_e") == {"doc_1", "doc_2"}
+    simple_bti.rename_doc(old_doc_name="doc_2", new_doc_name="doc_4")
+    assert simple_bti.doc_to_tags["doc_4"] == {"tag_b", "tag_e"}
+    assert "doc_2" not in simple_bti.docs
+    assert not simple_bti.conflicts
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "tag_a",
+        "tag_e",
+        "not tag_c",
+        "tag_c or tag_d",
+        "tag_a and not tag_c",
+        "not (tag_b or tag_c)",
+        "tag_c or not tag_a and tag_b",
+        "not (tag_a and tag_c) and (not tag_b)",
+        "tag_* and not tag_a",
+        "tag_? and not tag_a",
+        "not tag_e*",
+    ],
+)
+def test_query_matches_tagindex(
+    simple_ti: TagIndex, simple_bti: BitmapTagIndex, query: str
+):
+    assert simple_bti.query(query) == simple_ti.query(query)
+
+
+def test_json_roundtrip(simple_bti: BitmapTagIndex, tmp_path):
+    at = str(tmp_path / "index.json")
+    simple_bti.to_json(at=at)
+    loaded = BitmapTagIndex.from_json(at=at)
+    assert isinstance(loaded, BitmapTagIndex)
+    assert dict(loaded.doc_to_tags) == dict(simple_bti.doc_to_tags)
+    assert loaded.query("tag_a and not tag_c") == {"doc_1"}
+
+
+def test_explain(simple_bti: BitmapTagIndex):
+    assert simple_bti.explain("tag_a and not tag_c").splitlines() == [
+        "DIFFERENCE (est. 2)",
+        "  TAG 'tag_a' (est. 2)",
+        "  TAG 'tag_c' (est. 1)",
+    ]
+
+
+def test_query_iter_and_count(simple_bti: BitmapTagIndex):
+    assert sorted(simple_bti.query_iter("not tag_c")) == ["doc_1", "doc_3"]
+    assert simple_bti.query_count("not tag_c") == 2
+    assert simple_bti.query_count("tag_a or tag_d") == 3
+    assert simple_bti.query("not tag_e", limit=2, offset=1) == ["doc_2", "doc_3"]
+
+
+def test_stats(simple_bti: BitmapTagIndex, tmp_path):
+    assert simple_bti.stats() == (3, 4, 6)
+    simple_bti.tag(docs=["doc_1", "doc_4"], tags=["tag_a", "tag_e"])
+    simple_bti.merge_tags(old_tags=["tag_a", "tag_b"], new_tag="tag_f")
+    simple_bti.remove_doc("doc_3")
+    assert simple_bti.stats() == (3, 3, 6)
+    assert simple_bti.top_tags(2) == [("tag_f", 3), ("tag_e", 2)]
+    assert simple_bti.doc_tag_count("doc_1") == 2
+    at = str(tmp_path / "index.bin")
+    simple_bti.to_binary(at)
+    assert BitmapTagIndex.from_binary(at).stats() == (3, 3, 6)
+
+
+@pytest.mark.parametrize("cls", [TagIndex, BitmapTagIndex])
+def test_tag_nothing(cls):
+    ti = cls()
+    ti.tag(docs=[], tags="tag_x")
+    ti.tag(docs="doc_x", tags=[])
+    assert not ti.tags and not ti.docs
+    assert ti.match_tags("tag_*") == []
+    assert ti.stats() == (0, 0, 0)
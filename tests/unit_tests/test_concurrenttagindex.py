@@ -0,0 +1,205 @@
+import threading
+import time
+
+import pytest
+from doctag import ConcurrentTagIndex, TagIndex
+from doctag.concurrenttagindex import _Shared
+
+
+@pytest.fixture
+def simple_cti(simple_ti: TagIndex):
+    cti = ConcurrentTagIndex()
+    for doc, tags in simple_ti.doc_to_tags.items():
+        cti.tag(docs=doc, tags=tags)
+    return cti
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "tag_a",
+        "tag_e",
+        "not tag_c",
+        "tag_c or tag_d",
+        "tag_a and not tag_c",
+        "tag_c or not tag_a and tag_b",
+        "tag_*",
+    ],
+)
+def test_query(simple_cti: ConcurrentTagIndex, simple_ti: TagIndex, query: str):
+    assert simple_cti.query(query) == simple_ti.query(query)
+    assert set(simple_cti.query_iter(query)) == simple_ti.query(query)
+    assert simple_cti.query_count(query) == len(simple_ti.query(query))
+
+
+def test_mutations(simple_cti: ConcurrentTagIndex, simple_ti: TagIndex, tmp_path):
+    for ti in (simple_cti, simple_ti):
+        ti.register_view("view", "tag_f and not tag_c")
+        ti.merge_tags(old_tags=["tag_a", "tag_b"], new_tag="tag_f")
+        ti.rename_doc("doc_2", "doc_5")
+        ti.remove_doc("doc_3")
+        ti.untag(docs="doc_5", tags="tag_c")
+    assert dict(simple_cti.doc_to_tags) == dict(simple_ti.doc_to_tags)
+    assert dict(simple_cti.tag_to_docs) == dict(simple_ti.tag_to_docs)
+    assert simple_cti.stats() == simple_ti.stats()
+    assert not simple_cti.conflicts
+    assert simple_cti.view("view") == simple_ti.query("tag_f and not tag_c") != set()
+    at = str(tmp_path / "index.json")
+    simple_cti.to_json(at=at)
+    loaded = ConcurrentTagIndex.from_json(at)
+    assert dict(loaded.doc_to_tags) == dict(simple_ti.doc_to_tags)
+    loaded.tag(docs="doc_1", tags="tag_g")
+    assert loaded.query("tag_f and tag_g") == {"doc_1"}
+    bulk = ConcurrentTagIndex()
+    bulk.bulk_load(simple_cti.export_pairs(), chunk_size=2)
+    assert dict(bulk.doc_to_tags) == dict(simple_ti.doc_to_tags)
+
+
+def test_tag_nothing():
+    cti = ConcurrentTagIndex()
+    cti.tag(docs=[], tags="tag_x")
+    cti.tag(docs="doc_x", tags=[])
+    assert not cti.tags and not cti.docs
+    assert cti.stats() == (0, 0, 0)
+
+
+def test_shared_copies_share_buckets():
+    published = _Shared({f"doc_{i}": {i} for i in range(1000)})
+    working = published.copy()
+    working["doc_1"] = {-1}
+    del working["doc_2"]
+    for i in range(1000, 5000):
+        working[f"doc_{i}"] = {i}
+    assert published["doc_1"] == {1} and "doc_2" in published
+    assert len(published) == 1000 and len(dict(published.items())) == 1000
+    assert working["doc_1"] == {-1} and "doc_2" not in working
+    assert len(working) == 4999 == len(list(working.values()))
+    # Of a small write, only the changed key's bucket is copied.
+    copy = published.copy()
+    copy["doc_3"] = {-3}
+    shared = sum(a is b for a, b in zip(copy._buckets, published._buckets))
+    assert shared == len(published._buckets) - 1
+
+
+def test_readers_see_whole_writes():
+    # Every doc always has exactly one of tag_a and tag_b. The writer moves docs
+    # between them in batches, so a torn read would break the invariant.
+    docs = [f"doc_{i}" for i in range(200)]
+    cti = ConcurrentTagIndex()
+    cti.tag(docs=docs, tags="tag_a")
+    stop = threading.Event()
+    failures = []
+    reads = [0]
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            moving = docs[i % 200 : i % 200 + 50]
+            source, target = ("tag_a", "tag_b") if i % 2 else ("tag_b", "tag_a")
+            with cti.batch():
+                cti.untag(docs=moving, tags=source)
+                cti.tag(docs=moving, tags=target)
+            i += 7
+
+    def read():
+        while not stop.is_set():
+            both = cti.query("tag_a and tag_b")
+            count = cti.query_count("tag_a or tag_b")
+            if both or count != 200:
+                failures.append((both, count))
+            if cti.query_count("not tag_a and not tag_b"):
+                failures.append("untagged")
+            # Methods which read the index more than once must see one version too.
+            try:
+                doc = docs[reads[0] % 200]
+                if cti.doc_tag_count(doc) != 1:
+                    failures.append(("doc_tag_count", doc))
+                stats = cti.stats()
+                if stats.docs != 200 or stats.pairs != 200:
+                    failures.append(stats)
+                cti.get_docs("tag_a")
+                cti.tag_frequency("tag_b")
+                if not set(cti.tags) <= {"tag_a", "tag_b"} or len(cti.docs) != 200:
+                    failures.append("tags or docs")
+                if reads[0] % 50 == 0 and cti.conflicts:
+                    failures.append("conflicts")
+            except Exception as e:
+                failures.append(e)
+            reads[0] += 1
+
+    threads = [threading.Thread(target=write)] + [
+        threading.Thread(target=read) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not failures
+    assert reads[0] > 0
+    assert not cti.conflicts
+    assert len(cti.docs) == 200
+
+
+def test_co_occurrence_follows_writes():
+    pytest.importorskip("scipy")
+    cti = ConcurrentTagIndex()
+    cti.tag(docs=["doc_1", "doc_2"], tags=["tag_a", "tag_b"])
+    assert cti.co_occurrence("tag_a", "tag_b") == 2
+    cti.tag(docs="doc_3", tags=["tag_a", "tag_c"])
+    cti.untag(docs="doc_1", tags="tag_b")
+    assert cti.co_occurrence("tag_a", "tag_b") == 1
+    assert cti.related_tags("tag_a") == [("tag_b", 1.0), ("tag_c", 1.0)]
+
+
+def test_readers_see_co_occurrence_of_whole_writes():
+    pytest.importorskip("scipy")
+    # Writes move docs between the tag_a/tag_b and tag_c/tag_d pairs, so a reader
+    # must never see a doc with one tag of a pair, and must see the last write.
+    docs = [f"doc_{i}" for i in range(100)]
+    cti = ConcurrentTagIndex()
+    cti.tag(docs=docs, tags=["tag_a", "tag_b"])
+    stop = threading.Event()
+    failures = []
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            moving = docs[i % 100 : i % 100 + 10]
+            with cti.batch():
+                cti.untag(docs=moving, tags=["tag_a", "tag_b"])
+                cti.tag(docs=moving, tags=["tag_c", "tag_d"])
+            with cti.batch():
+                cti.untag(docs=moving, tags=["tag_c", "tag_d"])
+                cti.tag(docs=moving, tags=["tag_a", "tag_b"])
+            i += 3
+
+    def read():
+        while not stop.is_set():
+            try:
+                if not 90 <= cti.co_occurrence("tag_a", "tag_b") <= 100:
+                    failures.append("count")
+                # Within one lookup, the tags of each pair always go together.
+                if cti.similarity("tag_a", "tag_b") != 1.0:
+                    failures.append("tag_a, tag_b")
+                if cti.similarity("tag_c", "tag_d") not in (0.0, 1.0):
+                    failures.append("tag_c, tag_d")
+                if [tag for tag, _ in cti.related_tags("tag_a")] != ["tag_b"]:
+                    failures.append("related")
+            except Exception as e:
+                failures.append(e)
+
+    threads = [threading.Thread(target=write)] + [
+        threading.Thread(target=read) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not failures
+    assert cti.co_occurrence("tag_a", "tag_b") == 100
+    assert cti.co_occurrence("tag_c", "tag_d") == 0
+    assert cti.co_occurrence("tag_a", "tag_c") == 0
@@ -0,0 +1,51 @@
+import math
+
+import pytest
+from doctag import BitmapTagIndex, TagIndex
+
+pytest.importorskip("scipy")
+
+
+@pytest.mark.parametrize("cls", [TagIndex, BitmapTagIndex])
+def test_related_tags(cls):
+    ti = cls()
+    ti.tag(docs=["doc_1", "doc_2", "doc_3"], tags=["tag_a", "tag_b"])
+    ti.tag(docs=["doc_3", "doc_4"], tags="tag_c")
+    ti.tag(docs="doc_5", tags="tag_d")
+    assert ti.related_tags("tag_a") == [("tag_b", 3), ("tag_c", 1)]
+    assert ti.related_tags("tag_a", k=1) == [("tag_b", 3)]
+    assert ti.related_tags("tag_z") == []
+    assert ti.co_occurrence("tag_a", "tag_c") == 1
+    assert ti.similarity("tag_a", "tag_b") == 1.0
+    assert ti.similarity("tag_a", "tag_c") == 1 / 4
+    assert ti.similarity("tag_a", "tag_c", measure="pmi") == pytest.approx(
+        math.log(1 * 5 / (3 * 2))
+    )
+    assert ti.similarity("tag_a", "tag_d", measure="pmi") == -math.inf
+    with pytest.raises(ValueError):
+        ti.related_tags("tag_a", measure="cosine")
+
+    # Later changes are picked up without a rebuild.
+    ti.untag(docs=["doc_1", "doc_2"], tags="tag_b")
+    ti.tag(docs=["doc_1", "doc_2", "doc_6"], tags=["tag_c", "tag_e"])
+    ti.merge_tags(old_tags="tag_e", new_tag="tag_f")
+    ti.rename_doc("doc_3", "doc_7")
+    assert ti.related_tags("tag_a", measure="jaccard") == [
+        ("tag_c", 3 / 5),
+        ("tag_f", 2 / 4),
+        ("tag_b", 1 / 3),
+    ]
+    assert ti.related_tags("tag_f") == [("tag_c", 3), ("tag_a", 2)]
+    assert ti.co_occurrence("tag_a", "tag_e") == 0
+
+
+def test_related_tags_after_merge():
+    ti = TagIndex()
+    ti.tag(docs=["doc_1", "doc_2"], tags=["tag_a", "tag_b"])
+    ti.related_tags("tag_a")
+    for i in range(50):
+        ti.tag(docs=f"doc_{i}", tags=["tag_a", f"tag_{i % 3}"])
+    ti.remove_tag("tag_b")
+    assert dict(ti.related_tags("tag_a")) == {"tag_0": 17, "tag_1": 17, "tag_2": 16}
+    # Enough docs changed for the delta to be folded back into the base matrices.
+    assert ti._cooccurrence is not None and not ti._cooccurrence._rows
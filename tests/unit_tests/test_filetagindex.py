@@ -1,5 +1,12 @@
+import io
+import os
+from unittest.mock import ANY
+
+import doctag.filetagindex
 import pytest
 from doctag import FileTagIndex
+from doctag.filetagindex import _read_header
+from doctag_cli.metamarkdown import MetaMarkdown
 
 
 def test_init():
@@ -54,3 +61,216 @@ def test_get_files_d():
         "tests/test_data/file2.md",
         "tests/test_data/more/file4.md",
     }
+
+
+def test_batch_rewrites_each_file_once(tmp_path, monkeypatch):
+    docs = [str(tmp_path / f"file{i}.md") for i in range(2)]
+    for doc in docs:
+        open(doc, "w").close()
+    fti = FileTagIndex(root_dir=str(tmp_path))
+    rewrites = []
+    rewrite = fti._rewrite_tags
+    monkeypatch.setattr(
+        fti,
+        "_rewrite_tags",
+        lambda doc, added, removed: rewrites.append(doc)
+        or rewrite(doc, added, removed),
+    )
+    with fti.batch():
+        fti.tag(docs=docs, tags=["a", "b"])
+        fti.untag(docs=docs[0], tags="b")
+        fti.tag(docs=docs[0], tags="c")
+    assert sorted(rewrites) == docs
+    for doc, tags in zip(docs, [{"#a", "#c"}, {"#a", "#b"}]):
+        assert set(MetaMarkdown.loads(open(doc).read()).metadata["Tags"]) == tags
+    assert fti.doc_to_tags[docs[0]] == {"a", "c"}
+
+
+def test_scan_a():
+    fti = FileTagIndex(root_dir="./tests/test_data")
+    stats = fti.scan()
+    assert stats.files == 4
+    assert not stats.errors
+    # Paths are under root_dir as a Path normalizes it, as with get_files.
+    assert set(fti.file_list) == {
+        "tests/test_data/file1.txt",
+        "tests/test_data/file2.md",
+        "tests/test_data/more/file3.txt",
+        "tests/test_data/more/file4.md",
+    }
+    assert not fti.docs
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_scan_b(tmp_path, processes):
+    docs = [str(tmp_path / name) for name in ["file1.md", "file2.md", "file3.txt"]]
+    writer = FileTagIndex(root_dir=str(tmp_path))
+    for doc in docs:
+        open(doc, "w").close()
+    writer.tag(docs=docs[:2], tags="a")
+    writer.tag(docs=docs[1:], tags="b")
+    fti = FileTagIndex(root_dir=str(tmp_path), file_types=["md"])
+    fti.tag_to_docs["stale"].add(docs[0])
+    fti.doc_to_tags[docs[0]].add("stale")
+    stats = fti.scan(workers=2, processes=processes)
+    assert stats.files == 2
+    assert stats.bytes > 0
+    assert stats.files_per_second > 0
+    assert fti.doc_to_tags == {docs[0]: {"a"}, docs[1]: {"a", "b"}}
+    assert fti.query("a and not b") == {docs[0]}
+    assert not fti.conflicts
+
+
+def test_scan_parser_errors(tmp_path, monkeypatch):
+    docs = [str(tmp_path / f"file{i}.md") for i in range(3)]
+    for doc in docs:
+        open(doc, "w").close()
+    FileTagIndex(root_dir=str(tmp_path)).tag(docs=docs, tags="a")
+    loads = MetaMarkdown.loads
+
+    def flaky_loads(text):
+        if "broken" in text:
+            raise RuntimeError("parser bug")
+        return loads(text)
+
+    monkeypatch.setattr(MetaMarkdown, "loads", flaky_loads)
+    with open(docs[1], "w") as doc_:
+        doc_.write("---\nTags: [broken]\n---\n")
+    fti = FileTagIndex(root_dir=str(tmp_path))
+    stats = fti.scan(workers=2)
+    assert stats.errors == {docs[1]: "parser bug"}
+    assert fti.query("a") == {docs[0], docs[2]}
+
+
+def test_refresh(tmp_path):
+    docs = [str(tmp_path / f"file{i}.md") for i in range(3)]
+    for doc in docs:
+        open(doc, "w").close()
+    writer = FileTagIndex(root_dir=str(tmp_path))
+    writer.tag(docs=docs, tags="a")
+    at = str(tmp_path / "index.json")
+    fti = FileTagIndex(root_dir=str(tmp_path), file_types=["md"], at=at)
+    fti.scan(hash_contents=True)
+    fti.to_json()
+    fti = FileTagIndex.from_json(at)
+    assert set(fti.manifest) == set(docs)
+
+    summary = fti.refresh()
+    assert (summary.added, summary.changed, summary.removed) == ([], [], [])
+    assert summary.unchanged == 3
+    assert set(summary.timings) == {"walk", "stat", "parse", "apply"}
+
+    writer.untag(docs=docs[0], tags="a")
+    writer.tag(docs=docs[0], tags="b")
+    os.remove(docs[1])
+    open(str(tmp_path / "file3.md"), "w").close()
+    os.utime(docs[2], ns=(0, 0))
+    summary = fti.refresh(hash_contents=True)
+    assert summary.added == [str(tmp_path / "file3.md")]
+    assert summary.changed == [docs[0]]
+    assert summary.removed == [docs[1]]
+    assert summary.unchanged == 1
+    assert fti.doc_to_tags == {docs[0]: {"b"}, docs[2]: {"a"}}
+    assert not fti.conflicts
+
+
+def test_concurrent_sessions_merge_manifest(tmp_path):
+    docs = [str(tmp_path / f"file{i}.md") for i in range(3)]
+    for doc in docs[:2]:
+        open(doc, "w").close()
+    at = str(tmp_path / "index.json")
+    fti = FileTagIndex(root_dir=str(tmp_path), file_types=["md"], at=at)
+    fti.scan()
+    fti.to_json()
+    first, second = FileTagIndex.from_json(at), FileTagIndex.from_json(at)
+    FileTagIndex(root_dir=str(tmp_path)).tag(docs=docs[0], tags="a")
+    first.refresh()
+    first.to_json()
+    # second never saw docs[0] change, so its entry for it is stale.
+    os.remove(docs[1])
+    open(docs[2], "w").close()
+    second._apply_paths(second._read_paths(docs[1:]))
+    second.to_json()
+    loaded = FileTagIndex.from_json(at)
+    assert loaded.manifest == {docs[0]: first.manifest[docs[0]], docs[2]: ANY}
+    assert loaded.doc_to_tags == {docs[0]: {"a"}}
+    assert loaded.refresh().unchanged == 2
+
+
+def test_write_back(tmp_path):
+    docs = [str(tmp_path / f"file{i}.md") for i in range(20)]
+    for doc in docs:
+        open(doc, "w").close()
+    os.chmod(docs[0], 0o644)
+    fti = FileTagIndex(root_dir=str(tmp_path), write_back=True)
+    fti.tag(docs=docs + [str(tmp_path / "missing.md")], tags="a")
+    fti.untag(docs=docs[0], tags="a")
+    fti.tag(docs=docs[0], tags="b")
+    assert fti.query("a") == set(docs[1:]) | {str(tmp_path / "missing.md")}
+    errors = fti.flush()
+    assert set(errors) == {str(tmp_path / "missing.md")}
+    assert MetaMarkdown.loads(open(docs[0]).read()).metadata["Tags"] == ["#b"]
+    for doc in docs[1:]:
+        assert MetaMarkdown.loads(open(doc).read()).metadata["Tags"] == ["#a"]
+    assert os.stat(docs[0]).st_mode & 0o777 == 0o644
+    assert fti.close() == {}
+
+
+@pytest.mark.parametrize(
+    "contents, header",
+    [
+        (b"---\nTags: [a]\n---\nbody\n", b"---\nTags: [a]\n---\n"),
+        (b"Tags: a\nTitle: b\n\nbody\n", b"Tags: a\nTitle: b\n\n"),
+        (b"Tags: a\n", b"Tags: a\n"),
+        (b"# heading\n\nbody\n", None),
+        (b"---\nTags: [a]\nbody\n", None),
+        (b"", None),
+    ],
+)
+def test_read_header(contents, header):
+    doc_ = io.BytesIO(contents)
+    assert _read_header(doc_) == header
+    if header is not None:
+        assert doc_.read() == contents[len(header) :]
+
+
+def test_rewrite_keeps_body(tmp_path):
+    doc = str(tmp_path / "file1.md")
+    open(doc, "w").close()
+    fti = FileTagIndex(root_dir=str(tmp_path))
+    fti.tag(docs=doc, tags="a")
+    body = "\n" + "body line\n" * 100000
+    with open(doc, "a") as doc_:
+        doc_.write(body)
+    fti.tag(docs=doc, tags="bb")
+    fti.untag(docs=doc, tags="a")
+    fti.tag(docs=doc, tags="c")
+    contents = open(doc).read()
+    assert contents.endswith(body)
+    assert MetaMarkdown.loads(contents).metadata["Tags"] == ["#bb", "#c"]
+    assert FileTagIndex(root_dir=str(tmp_path)).scan().errors == {}
+
+
+@pytest.mark.parametrize("write_back", [False, True])
+def test_same_size_rewrite(tmp_path, monkeypatch, write_back):
+    doc = str(tmp_path / "file1.md")
+    open(doc, "w").close()
+    fti = FileTagIndex(root_dir=str(tmp_path), write_back=write_back)
+    fti.tag(docs=doc, tags="a")
+    fti.flush()
+    renamed = []
+    atomic_write = doctag.filetagindex.atomic_write
+
+    def record(path, *args, **kwargs):
+        renamed.append(path)
+        return atomic_write(path, *args, **kwargs)
+
+    monkeypatch.setattr(doctag.filetagindex, "atomic_write", record)
+    with fti.batch():
+        fti.untag(docs=doc, tags="a")
+        fti.tag(docs=doc, tags="b")
+    assert fti.flush() == {}
+    # Only write-back promises crash-atomic rewrites, so only it skips the patch.
+    assert renamed == ([doc] if write_back else [])
+    assert MetaMarkdown.loads(open(doc).read()).metadata["Tags"] == ["#b"]
+    fti.close()
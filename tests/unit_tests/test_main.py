@@ -0,0 +1,31 @@
+import threading
+
+from doctag import TagIndex
+from doctag.__main__ import main
+from doctag.server import TagServer
+
+
+def test_serve_and_query(simple_ti: TagIndex, tmp_path, monkeypatch, capsys):
+    at = str(tmp_path / "index.json")
+    simple_ti.to_json(at=at)
+    path = str(tmp_path / "doctag.sock")
+    servers = []
+    run = TagServer.run
+
+    def record(self):
+        servers.append(self)
+        run(self)
+
+    monkeypatch.setattr(TagServer, "run", record)
+    thread = threading.Thread(target=main, args=(["serve", at, "--socket", path],))
+    thread.start()
+    try:
+        while not servers and thread.is_alive():
+            thread.join(timeout=0.01)
+        assert servers[0].ready.wait(timeout=5)
+        main(["query", "tag_a and not tag_c", "--socket", path])
+        main(["query", "tag_b", "--count", "--socket", path])
+    finally:
+        servers[0].stop()
+        thread.join()
+    assert capsys.readouterr().out == "doc_1\n2\n"
@@ -0,0 +1,70 @@
+import pytest
+from doctag import MappedTagIndex, TagIndex
+
+
+@pytest.fixture
+def simple_mti(simple_ti: TagIndex, tmp_path):
+    at = str(tmp_path / "index.dtag")
+    simple_ti.to_binary(at)
+    return MappedTagIndex(at)
+
+
+def test_views(simple_mti: MappedTagIndex, simple_ti: TagIndex):
+    assert simple_mti.tags == simple_ti.tags
+    assert simple_mti.docs == simple_ti.docs
+    assert dict(simple_mti.tag_to_docs) == dict(simple_ti.tag_to_docs)
+    assert dict(simple_mti.doc_to_tags) == dict(simple_ti.doc_to_tags)
+    assert simple_mti.get_docs("tag_a") == {"doc_1", "doc_2"}
+    assert simple_mti.get_docs("tag_e") == set()
+    assert "tag_e" not in simple_mti.tag_to_docs
+    assert not simple_mti.conflicts
+    assert simple_mti.stats() == simple_ti.stats()
+    assert simple_mti.top_tags(2) == simple_ti.top_tags(2)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "tag_a",
+        "tag_e",
+        "not tag_c",
+        "tag_c or tag_d",
+        "tag_a and not tag_c",
+        "tag_c or not tag_a and tag_b",
+        "not (tag_a and tag_c) and (not tag_b)",
+        "tag_* and not tag_a",
+        "tag_? and not tag_a",
+        "not tag_e*",
+    ],
+)
+def test_query(simple_mti: MappedTagIndex, simple_ti: TagIndex, query: str):
+    assert simple_mti.query(query) == simple_ti.query(query)
+    assert set(simple_mti.query_iter(query)) == simple_ti.query(query)
+    assert simple_mti.query_count(query) == len(simple_ti.query(query))
+
+
+def test_read_only(simple_mti: MappedTagIndex, tmp_path):
+    with pytest.raises(TypeError):
+        simple_mti.tag(docs="doc_1", tags="tag_e")
+    with pytest.raises(TypeError):
+        simple_mti.untag(docs="doc_1", tags="tag_a")
+    with pytest.raises(TypeError):
+        simple_mti.remove_tag("tag_a")
+    with pytest.raises(TypeError):
+        simple_mti.to_json()
+    with pytest.raises(TypeError):
+        MappedTagIndex.from_json(str(tmp_path / "index.json"))
+    simple_mti.to_json(str(tmp_path / "index.json"))
+    assert TagIndex.from_json(str(tmp_path / "index.json")).get_docs("tag_d") == {
+        "doc_3"
+    }
+
+
+def test_reload(simple_mti: MappedTagIndex, simple_ti: TagIndex):
+    iterator = simple_mti.query_iter("not tag_c")
+    simple_ti.tag(docs="doc_4", tags="tag_e")
+    simple_ti.to_binary(str(simple_mti.at))
+    assert simple_mti.query("tag_e") == set()
+    simple_mti.reload()
+    assert simple_mti.query("tag_e") == {"doc_4"}
+    assert set(iterator) == {"doc_1", "doc_3"}
@@ -0,0 +1,28 @@
+import pytest
+from doctag import TagIndex, read_pairs, write_pairs
+
+
+@pytest.mark.parametrize("name", ["pairs.csv", "pairs.ndjson", "pairs.jsonl"])
+def test_round_trip(simple_ti: TagIndex, tmp_path, name: str):
+    at = str(tmp_path / name)
+    assert write_pairs(simple_ti.export_pairs(), at) == 6
+    loaded = TagIndex()
+    assert loaded.bulk_load(read_pairs(at)) == 6
+    assert dict(loaded.doc_to_tags) == dict(simple_ti.doc_to_tags)
+
+
+def test_read_pairs(tmp_path):
+    csv_at = tmp_path / "pairs.csv"
+    csv_at.write_text('doc_1,tag_a\n\n"doc, 2",tag_b\n')
+    assert list(read_pairs(str(csv_at))) == [("doc_1", "tag_a"), ("doc, 2", "tag_b")]
+    json_at = tmp_path / "pairs.txt"
+    json_at.write_text('{"doc": "doc_1", "tag": "tag_a"}\n\n["doc_2", "tag_b"]\n')
+    assert list(read_pairs(str(json_at), format="ndjson")) == [
+        ("doc_1", "tag_a"),
+        ("doc_2", "tag_b"),
+    ]
+    with pytest.raises(ValueError):
+        list(read_pairs(str(json_at)))
+    json_at.write_text('["doc_1", "tag_a"]\n{"doc": "doc_2"}\n')
+    with pytest.raises(ValueError, match="line 2"):
+        list(read_pairs(str(json_at), format="ndjson"))
@@ -0,0 +1,315 @@
+import os
+import threading
+
+import pytest
+import ujson
+from doctag import BitmapTagIndex, ConcurrentTagIndex, TagIndex
+from doctag.persistence import WriteAheadLog, read_generation, write_json_atomic
+
+
+@pytest.fixture
+def wal_ti(tmp_path):
+    at = str(tmp_path / "index.json")
+    ti = TagIndex(at=at, wal=True)
+    ti.tag(docs=["doc_1", "doc_2"], tags="tag_a")
+    ti.to_json()
+    return ti
+
+
+def test_wal_requires_at():
+    with pytest.raises(ValueError):
+        TagIndex(wal=True)
+
+
+def test_write_json_atomic(tmp_path):
+    at = str(tmp_path / "index.json")
+    write_json_atomic({"doc_to_tags": {"doc_1": ["tag_a"]}}, at)
+    assert TagIndex.from_json(at).get_docs("tag_a") == {"doc_1"}
+    assert os.listdir(str(tmp_path)) == ["index.json"]
+
+
+def test_wal_appends_instead_of_rewriting(wal_ti: TagIndex):
+    snapshot = open(wal_ti.at).read()
+    wal_ti.wal_compact_ratio = 1000
+    wal_ti.tag(docs="doc_3", tags="tag_b")
+    wal_ti.untag(docs="doc_1", tags="tag_a")
+    wal_ti.to_json()
+    assert open(wal_ti.at).read() == snapshot
+    assert os.path.exists(wal_ti.at + ".log")
+    loaded = TagIndex.from_json(wal_ti.at)
+    assert loaded.get_docs("tag_a") == {"doc_2"}
+    assert loaded.get_docs("tag_b") == {"doc_3"}
+
+
+def test_wal_compaction(wal_ti: TagIndex):
+    wal_ti.wal_compact_bytes = 1
+    wal_ti.tag(docs="doc_3", tags="tag_b")
+    wal_ti.to_json()
+    wal_ti._wait_for_compaction()
+    assert not os.path.exists(wal_ti.at + ".log.old")
+    wal_ti.tag(docs="doc_4", tags="tag_b")
+    wal_ti.compact()
+    assert not os.path.exists(wal_ti.at + ".log")
+    assert TagIndex.from_json(wal_ti.at).get_docs("tag_b") == {"doc_3", "doc_4"}
+
+
+def test_wal_interrupted_compaction(wal_ti: TagIndex):
+    wal_ti.tag(docs="doc_3", tags="tag_b")
+    wal_ti._wal.rotate()
+    wal_ti.untag(docs="doc_3", tags="tag_b")
+    wal_ti.tag(docs="doc_3", tags="tag_c")
+    loaded = TagIndex.from_json(wal_ti.at)
+    assert loaded.get_docs("tag_b") == set()
+    assert loaded.get_docs("tag_c") == {"doc_3"}
+
+
+def test_wal_torn_record(wal_ti: TagIndex):
+    wal_ti.tag(docs="doc_3", tags="tag_b")
+    wal_ti._wal.close()
+    with open(wal_ti.at + ".log", "a") as log:
+        log.write('["tag", ["doc_4"], ["ta')
+    # The writer died halfway through a record, and is reloaded.
+    reloaded = TagIndex.from_json(wal_ti.at, wal=True)
+    reloaded.tag(docs="doc_5", tags="tag_b")
+    loaded = TagIndex.from_json(wal_ti.at)
+    assert loaded.get_docs("tag_b") == {"doc_3", "doc_5"}
+
+
+def test_full_save_clears_log(wal_ti: TagIndex):
+    wal_ti.tag(docs="doc_3", tags="tag_b")
+    wal_ti.to_json()
+    plain = TagIndex.from_json(wal_ti.at)
+    plain.to_json()
+    assert not os.path.exists(wal_ti.at + ".log")
+    assert TagIndex.from_json(wal_ti.at).get_docs("tag_b") == {"doc_3"}
+
+
+def test_full_save_merges_log(wal_ti: TagIndex):
+    plain = TagIndex.from_json(wal_ti.at)
+    wal_ti.tag(docs="doc_3", tags="tag_b")
+    wal_ti.to_json()
+    plain.tag(docs="doc_4", tags="tag_c")
+    plain.to_json()
+    loaded = TagIndex.from_json(wal_ti.at)
+    assert loaded.get_docs("tag_b") == {"doc_3"}
+    assert loaded.get_docs("tag_c") == {"doc_4"}
+    assert not os.path.exists(wal_ti.at + ".log")
+
+
+def test_wal_takes_one_writer(wal_ti: TagIndex):
+    plain = TagIndex.from_json(wal_ti.at)
+    other = TagIndex.from_json(wal_ti.at, wal=True)
+    wal_ti.tag(docs="doc_3", tags="tag_b")
+    # Unsaved records hold the log.
+    with pytest.raises(ValueError, match="unsaved records"):
+        plain.to_json()
+    with pytest.raises(ValueError, match="held by another writer"):
+        other.tag(docs="doc_4", tags="tag_c")
+    wal_ti.to_json()
+    # The other WAL writer never saw doc_3, so it may not write until reloaded.
+    with pytest.raises(ValueError, match="changed by another writer"):
+        other.tag(docs="doc_4", tags="tag_c")
+    plain.to_json()
+    with pytest.raises(ValueError, match="changed by another writer"):
+        wal_ti.compact()
+    with pytest.raises(ValueError, match="changed by another writer"):
+        wal_ti.tag(docs="doc_4", tags="tag_c")
+    assert TagIndex.from_json(wal_ti.at).get_docs("tag_b") == {"doc_3"}
+
+
+def test_records(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "index.json"))
+    wal.append("tag", ["doc_1"], ["tag_a"])
+    wal.append("untag", ["doc_1"], ["tag_a"])
+    assert list(wal.records()) == [
+        ("tag", ["doc_1"], ["tag_a"]),
+        ("untag", ["doc_1"], ["tag_a"]),
+    ]
+    wal.reset()
+    assert wal.size == 0
+
+
+def test_atomic_write_keeps_mode(tmp_path):
+    at = str(tmp_path / "index.json")
+    write_json_atomic({"doc_to_tags": {}}, at)
+    os.chmod(at, 0o640)
+    write_json_atomic({"doc_to_tags": {"doc_1": ["tag_a"]}}, at)
+    assert os.stat(at).st_mode & 0o777 == 0o640
+
+
+def test_load_builds_inverse_lazily(simple_ti: TagIndex, tmp_path):
+    at = str(tmp_path / "index.json")
+    simple_ti.to_json(at=at)
+    assert list(ujson.load(open(at))) == ["generation", "doc_to_tags"]
+    loaded = TagIndex.from_json(at)
+    assert loaded._unbuilt == "tag_to_docs"
+    assert loaded.doc_tag_count("doc_2") == 3
+    assert not loaded.conflicts
+    assert loaded._unbuilt == "tag_to_docs"
+    assert loaded.query("tag_a and not tag_c") == {"doc_1"}
+    assert loaded._unbuilt is None
+    assert dict(loaded.tag_to_docs) == dict(simple_ti.tag_to_docs)
+    assert dict(loaded.doc_to_tags) == dict(simple_ti.doc_to_tags)
+
+
+def test_union_keeps_inverse_unbuilt(tmp_path):
+    at = str(tmp_path / "index.json")
+    write_json_atomic(
+        {"tag_to_docs": {"tag_a": ["doc_1", "doc_2"], "tag_b": ["doc_2", "doc_3"]}}, at
+    )
+    loaded = TagIndex.from_json(at)
+    assert loaded.query("tag_a or tag_b") == {"doc_1", "doc_2", "doc_3"}
+    assert loaded.query("tag_*") == {"doc_1", "doc_2", "doc_3"}
+    assert loaded.query_count("tag_a or tag_b") == 3
+    assert "UNION (est. 4)" in loaded.explain("tag_a or tag_b")
+    assert loaded._unbuilt == "doc_to_tags"
+    assert loaded.query("not tag_a") == {"doc_3"}
+    assert loaded._unbuilt is None
+
+
+@pytest.mark.parametrize(
+    "doc, tag, stored",
+    [("a_long_document_name", "t", "doc_to_tags"), ("d", "a_long_tag", "tag_to_docs")],
+)
+def test_stored_direction(tmp_path, doc: str, tag: str, stored: str):
+    # The names repeated once per pair are the ones on the shorter side.
+    ti = TagIndex()
+    for i in range(10):
+        ti.tag(docs=f"{doc}_{i}", tags=[f"{tag}_{j}" for j in range(10)])
+    at = str(tmp_path / "index.json")
+    ti.to_json(at=at)
+    assert stored in ujson.load(open(at))
+    loaded = TagIndex.from_json(at)
+    loaded.tag(docs=f"{doc}_0", tags="new")
+    assert loaded.get_docs(f"{tag}_3") == ti.get_docs(f"{tag}_3")
+    assert loaded.doc_tag_count(f"{doc}_0") == 11
+
+
+@pytest.mark.parametrize("engine", [TagIndex, BitmapTagIndex])
+def test_checksum(simple_ti: TagIndex, tmp_path, engine):
+    at = str(tmp_path / "index.json")
+    simple_ti.json_checksum = True
+    simple_ti.to_json(at=at)
+    serial = ujson.load(open(at))
+    assert serial["checksum"]["pairs"] == 6
+    loaded = engine.from_json(at)
+    assert loaded.query("tag_a") == {"doc_1", "doc_2"}
+    serial["doc_to_tags"]["doc_2"].remove("tag_c")
+    write_json_atomic(serial, at)
+    with pytest.raises(ValueError):
+        engine.from_json(at)
+    del serial["checksum"]
+    write_json_atomic(serial, at)
+    assert engine.from_json(at).get_docs("tag_c") == set()
+
+
+@pytest.mark.parametrize("engine", [TagIndex, BitmapTagIndex])
+def test_views_saved(simple_ti: TagIndex, tmp_path, engine):
+    at = str(tmp_path / "index.json")
+    simple_ti.register_view("todo", "tag_a and not tag_c")
+    simple_ti.to_json(at=at)
+    assert ujson.load(open(at))["views"] == {"todo": "tag_a and not tag_c"}
+    loaded = engine.from_json(at)
+    loaded.untag(docs="doc_1", tags="tag_a")
+    assert loaded.view("todo") == set()
+    loaded.tag(docs="doc_3", tags="tag_a")
+    assert loaded.view("todo") == {"doc_3"}
+
+
+def test_views_saved_with_wal(wal_ti: TagIndex):
+    # Registering isn't logged, so the next save writes a full snapshot.
+    wal_ti.register_view("a", "tag_a")
+    wal_ti.to_json()
+    wal_ti.tag(docs="doc_3", tags="tag_a")
+    wal_ti.to_json()
+    loaded = TagIndex.from_json(str(wal_ti.at), wal=True)
+    assert loaded.views == {"a": "tag_a"}
+    assert loaded.view("a") == {"doc_1", "doc_2", "doc_3"}
+    loaded.unregister_view("a")
+    loaded.to_json()
+    assert TagIndex.from_json(str(wal_ti.at)).views == {}
+
+
+@pytest.mark.parametrize("engine", [TagIndex, BitmapTagIndex, ConcurrentTagIndex])
+def test_concurrent_sessions_merge(simple_ti: TagIndex, tmp_path, engine):
+    at = str(tmp_path / "index.json")
+    simple_ti.to_json(at=at)
+    assert read_generation(at) == 1
+    first, second = engine.from_json(at), engine.from_json(at)
+    with second:
+        with first:
+            first.tag(docs="doc_1", tags="tag_e")
+            first.untag(docs="doc_2", tags="tag_c")
+            first.register_view("e", "tag_e")
+            second.tag(docs="doc_4", tags="tag_e")
+            second.untag(docs="doc_1", tags="tag_a")
+            # Both change doc_2/tag_c; the session which saves last wins.
+            second.tag(docs="doc_2", tags="tag_c")
+        assert read_generation(at) == 2
+    # second is saved on exit, on top of first's save.
+    assert read_generation(at) == 3
+    assert first.view("e") == {"doc_1"}
+    loaded = engine.from_json(at)
+    assert loaded.view("e") == second.view("e") == {"doc_1", "doc_4"}
+    assert dict(loaded.doc_to_tags) == {
+        "doc_1": {"tag_b", "tag_e"},
+        "doc_2": {"tag_a", "tag_b", "tag_c"},
+        "doc_3": {"tag_d"},
+        "doc_4": {"tag_e"},
+    }
+    assert not loaded.conflicts
+
+
+@pytest.mark.parametrize("engine", [TagIndex, BitmapTagIndex, ConcurrentTagIndex])
+def test_long_sessions_merge(simple_ti: TagIndex, tmp_path, engine, monkeypatch):
+    monkeypatch.setattr(engine, "journal_limit", 5)
+    at = str(tmp_path / "index.json")
+    simple_ti.to_json(at=at)
+    first, second = engine.from_json(at), engine.from_json(at)
+    first.bulk_load((f"doc_{i}", "tag_e") for i in range(5, 25))
+    first.untag(docs="doc_1", tags="tag_a")
+    first.tag(docs="doc_1", tags="tag_f")
+    # The journal is capped, keeping just which docs changed.
+    assert len(first._journal) <= 5 and len(first._touched) >= 10
+    second.tag(docs="doc_3", tags="tag_e")
+    second.untag(docs="doc_2", tags="tag_a")
+    second.to_json()
+    first.to_json()
+    assert first._journal == [] and first._touched is None
+    loaded = engine.from_json(at)
+    assert loaded.get_docs("tag_e") == {"doc_3", *(f"doc_{i}" for i in range(5, 25))}
+    assert loaded.get_docs("tag_a") == set()
+    assert dict(loaded.doc_to_tags)["doc_1"] == {"tag_b", "tag_f"}
+    assert not loaded.conflicts
+
+
+def test_fresh_index_overwrites(simple_ti: TagIndex, tmp_path):
+    # An index which wasn't loaded from the file has nothing to merge, and replaces it.
+    at = str(tmp_path / "index.json")
+    simple_ti.to_json(at=at)
+    simple_ti.to_json(at=at)
+    ti = TagIndex(at=at)
+    ti.tag(docs="doc_5", tags="tag_f")
+    ti.to_json()
+    assert read_generation(at) == 3
+    assert dict(TagIndex.from_json(at).doc_to_tags) == {"doc_5": {"tag_f"}}
+
+
+def test_many_writers(tmp_path):
+    at = str(tmp_path / "index.json")
+    TagIndex().to_json(at=at)
+
+    def write(writer: int):
+        for i in range(10):
+            ti = TagIndex.from_json(at)
+            ti.tag(docs=f"doc_{writer}_{i}", tags=f"tag_{writer}")
+            ti.to_json()
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    loaded = TagIndex.from_json(at)
+    assert len(loaded.docs) == 40
+    assert read_generation(at) == 41
@@ -0,0 +1,67 @@
+import pytest
+from doctag import BitmapTagIndex, Profiler, TagIndex
+
+
+@pytest.mark.parametrize("engine", [TagIndex, BitmapTagIndex])
+def test_query_trace(simple_ti: TagIndex, engine):
+    ti = engine()
+    for doc, tags in simple_ti.doc_to_tags.items():
+        ti.tag(docs=doc, tags=tags)
+    with ti.profile() as profiler:
+        assert ti.query("(tag_a or tag_d) and not tag_c") == {"doc_1", "doc_3"}
+        assert ti.query_count("(tag_a or tag_d) and not tag_c") == 2
+        assert set(ti.query_iter("tag_*")) == {"doc_1", "doc_2", "doc_3"}
+    assert ti.profiler is None
+    first, second, third = profiler.queries
+    assert (first.kind, first.cached, first.size) == ("query", False, 2)
+    assert first.parse_seconds > 0 and first.simplify_seconds > 0
+    assert (second.kind, second.cached, second.size) == ("count", True, 2)
+    assert (third.kind, third.size) == ("iter", None)
+    root = first.root
+    assert (root.op, root.size) == ("DIFFERENCE", 2)
+    union, tag_c = root.children
+    assert (union.op, union.size, union.estimate) == ("UNION", 3, 3)
+    assert sorted((child.tag, child.size) for child in union.children) == [
+        ("tag_a", 2),
+        ("tag_d", 1),
+    ]
+    assert (tag_c.tag, tag_c.size) == ("tag_c", 1)
+    assert root.seconds >= union.seconds
+    assert "UNION (est. 3, actual 3 from [" in first.format()
+    ti.query("tag_a")
+    assert len(profiler.queries) == 3
+
+
+def test_counters(simple_ti: TagIndex, tmp_path):
+    at = str(tmp_path / "index.json")
+    traces = []
+    profiler = Profiler(on_query=traces.append)
+    with profiler.attach(TagIndex):
+        simple_ti.tag(docs="doc_1", tags="tag_e")
+        simple_ti.tag(docs=["doc_2", "doc_3"], tags="tag_e")
+        simple_ti.untag(docs="doc_1", tags="tag_e")
+        simple_ti.to_json(at=at)
+        loaded = TagIndex.from_json(at)
+        loaded.query("tag_e")
+    assert TagIndex.profiler is None
+    assert profiler.counters["tag"].calls == 2
+    assert profiler.counters["untag"].calls == 1
+    size = (tmp_path / "index.json").stat().st_size
+    for op in ("to_json", "from_json"):
+        calls, seconds, bytes_ = profiler.counters[op]
+        assert (calls, bytes_) == (1, size)
+        assert seconds > 0
+    assert [trace.query for trace in traces] == ["tag_e"]
+    profiler.reset()
+    assert not profiler.counters and not profiler.queries
+
+
+def test_instance_profiler_does_not_hide_class_profiler(simple_ti: TagIndex):
+    outer, inner = Profiler(), Profiler()
+    with outer.attach(TagIndex):
+        with inner.attach(simple_ti):
+            simple_ti.tag(docs="doc_1", tags="tag_e")
+        simple_ti.tag(docs="doc_2", tags="tag_e")
+    assert inner.counters["tag"].calls == 1
+    assert outer.counters["tag"].calls == 1
+    assert simple_ti.profiler is None
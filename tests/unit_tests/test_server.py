@@ -0,0 +1,148 @@
+import socket
+import threading
+
+import pytest
+from doctag import TagIndex
+from doctag.client import Client
+from doctag.server import TagServer
+
+
+@pytest.fixture(params=["unix", "tcp"])
+def server(request, simple_ti: TagIndex, tmp_path):
+    simple_ti.at = str(tmp_path / "index.json")
+    if request.param == "unix":
+        server = TagServer(simple_ti, path=str(tmp_path / "doctag.sock"))
+    else:
+        server = TagServer(simple_ti, port=0)
+    thread = threading.Thread(target=server.run)
+    thread.start()
+    assert server.ready.wait(timeout=5)
+    yield server
+    server.stop()
+    thread.join()
+
+
+def connect(server: TagServer) -> Client:
+    if server.path is not None:
+        return Client(path=server.path, timeout=5)
+    return Client(port=server.port, timeout=5)
+
+
+def test_server(server: TagServer):
+    with connect(server) as client:
+        assert client.request("ping") == "pong"
+        assert client.query("tag_a and not tag_c") == ["doc_1"]
+        assert client.query("tag_a or tag_d", limit=2, order="desc") == [
+            "doc_3",
+            "doc_2",
+        ]
+        assert client.count("not tag_d") == 2
+        client.tag(docs="doc_4", tags=["tag_a", "tag_e"])
+        assert client.get_docs("tag_e") == ["doc_4"]
+        client.untag(docs="doc_4", tags="tag_e")
+        assert client.get_docs("tag_e") == []
+        with pytest.raises(ValueError):
+            client.tag(docs="doc_4", tags="true")
+        with pytest.raises(ValueError):
+            client.request("drop_everything")
+        client.checkpoint()
+    assert TagIndex.from_json(server.index.at).get_docs("tag_a") == {
+        "doc_1",
+        "doc_2",
+        "doc_4",
+    }
+
+
+def test_pipelined_and_concurrent_clients(server: TagServer):
+    clients = [connect(server) for _ in range(4)]
+    errors = []
+
+    def work(client: Client, i: int):
+        try:
+            results = client.pipeline(
+                [
+                    ("tag", {"docs": f"doc_{i}_{j}", "tags": f"tag_{i}"})
+                    for j in range(50)
+                ]
+                + [("count", {"query": f"tag_{i}"})]
+            )
+            assert results[-1] == 50
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=work, args=(client, i))
+        for i, client in enumerate(clients, start=10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for client in clients:
+        client.close()
+    assert not errors
+    assert server.index.query_count("tag_10 or tag_11 or tag_12 or tag_13") == 200
+
+
+def test_server_requires_one_address(simple_ti: TagIndex):
+    with pytest.raises(ValueError):
+        TagServer(simple_ti)
+
+
+def test_large_requests(server: TagServer):
+    # Well past asyncio's default 64 KiB line limit.
+    tags = [f"tag_{i:06}" for i in range(20000)]
+    with connect(server) as client:
+        client.tag(docs="doc_4", tags=tags)
+        assert client.get_docs("tag_019999") == ["doc_4"]
+
+
+def test_request_over_line_limit(simple_ti: TagIndex, tmp_path):
+    server = TagServer(simple_ti, path=str(tmp_path / "doctag.sock"))
+    server.line_limit = 1024
+    thread = threading.Thread(target=server.run)
+    thread.start()
+    assert server.ready.wait(timeout=5)
+    try:
+        with connect(server) as client:
+            with pytest.raises(ValueError, match="longer than 1024 bytes"):
+                client.pipeline([("get_docs", {"tag": "x" * 5000}), ("ping", {})])
+            # The oversized line was skipped, and the connection still works.
+            assert client.pipeline([("ping", {}), ("get_docs", {"tag": "tag_a"})]) == [
+                "pong",
+                ["doc_1", "doc_2"],
+            ]
+    finally:
+        server.stop()
+        thread.join()
+
+
+def test_server_keeps_other_files(simple_ti: TagIndex, tmp_path):
+    path = tmp_path / "notes.md"
+    path.write_text("keep me")
+    with pytest.raises(FileExistsError):
+        TagServer(simple_ti, path=str(path)).run()
+    assert path.read_text() == "keep me"
+
+
+def test_server_replaces_only_stale_sockets(
+    server: TagServer, simple_ti: TagIndex, tmp_path
+):
+    if server.path is not None:
+        # A live server keeps its address.
+        with pytest.raises(FileExistsError, match="already listening"):
+            TagServer(simple_ti, path=server.path).run()
+        with connect(server) as client:
+            assert client.request("ping") == "pong"
+    path = str(tmp_path / "stale.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    restarted = TagServer(simple_ti, path=path)
+    thread = threading.Thread(target=restarted.run)
+    thread.start()
+    assert restarted.ready.wait(timeout=5)
+    with connect(restarted) as client:
+        assert client.request("ping") == "pong"
+    restarted.stop()
+    thread.join()
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+from boolean.boolean import ParseError
+from doctag import BitmapTagIndex, ShardedTagIndex, TagIndex
+
+
+@pytest.fixture
+def simple_sti(simple_ti: TagIndex):
+    sti = ShardedTagIndex(shards=3)
+    for doc, tags in simple_ti.doc_to_tags.items():
+        sti.tag(docs=doc, tags=tags)
+    yield sti
+    sti.close()
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "tag_a",
+        "tag_e",
+        "not tag_c",
+        "tag_c or tag_d",
+        "tag_a and not tag_c",
+        "tag_c or not tag_a and tag_b",
+        "tag_*",
+    ],
+)
+def test_query(simple_sti: ShardedTagIndex, simple_ti: TagIndex, query: str):
+    assert simple_sti.query(query) == simple_ti.query(query)
+    assert simple_sti.query_count(query) == len(simple_ti.query(query))
+
+
+def test_sharded(simple_sti: ShardedTagIndex):
+    assert simple_sti.tags == {"tag_a", "tag_b", "tag_c", "tag_d"}
+    assert simple_sti.docs == {"doc_1", "doc_2", "doc_3"}
+    assert simple_sti.get_docs("tag_b") == {"doc_1", "doc_2"}
+    simple_sti.tag(docs=[f"doc_{i}" for i in range(4, 20)], tags="tag_e")
+    assert simple_sti.query("tag_e", limit=3, offset=2) == [
+        "doc_12",
+        "doc_13",
+        "doc_14",
+    ]
+    assert simple_sti.query("tag_e or tag_d", limit=2, order="desc") == [
+        "doc_9",
+        "doc_8",
+    ]
+    simple_sti.remove_tag("tag_e")
+    simple_sti.remove_doc("doc_1")
+    assert simple_sti.docs == {"doc_2", "doc_3"}
+    with pytest.raises(ValueError):
+        simple_sti.tag(docs="doc_1", tags="true")
+    with pytest.raises(ParseError):
+        simple_sti.query("tag_a and (")
+    assert simple_sti.query("tag_a") == {"doc_2"}
+
+
+def test_json_roundtrip(tmp_path):
+    at = str(tmp_path / "index")
+    with ShardedTagIndex(shards=2, at=at, engine=BitmapTagIndex) as sti:
+        sti.tag(docs=[f"doc_{i}" for i in range(10)], tags="tag_a")
+        sti.tag(docs=["doc_1", "doc_2"], tags="tag_b")
+    shards = [
+        BitmapTagIndex.from_json(os.path.join(at, f"shard-{i}.json")) for i in range(2)
+    ]
+    assert set().union(*(shard.docs for shard in shards)) == {
+        f"doc_{i}" for i in range(10)
+    }
+    with pytest.raises(ValueError):
+        ShardedTagIndex.from_json(at)
+    with pytest.raises(ValueError):
+        ShardedTagIndex(shards=3, at=at)
+    sti = ShardedTagIndex.from_json(at, engine=BitmapTagIndex)
+    assert sti.query("tag_a and not tag_b") == {f"doc_{i}" for i in range(10)} - {
+        "doc_1",
+        "doc_2",
+    }
+    sti.close()
@@ -0,0 +1,68 @@
+import pytest
+from doctag import BitmapTagIndex, TagIndex
+from doctag.snapshot import Snapshot, binary_to_json, json_to_binary, write_snapshot
+
+
+def test_snapshot_roundtrip(simple_ti: TagIndex, tmp_path):
+    at = str(tmp_path / "index.dtag")
+    simple_ti.to_binary(at)
+    loaded = TagIndex.from_binary(at)
+    assert dict(loaded.tag_to_docs) == dict(simple_ti.tag_to_docs)
+    assert dict(loaded.doc_to_tags) == dict(simple_ti.doc_to_tags)
+    assert not loaded.conflicts
+
+
+def test_snapshot_bitmap(simple_ti: TagIndex, tmp_path):
+    at = str(tmp_path / "index.dtag")
+    simple_ti.to_binary(at)
+    loaded = BitmapTagIndex.from_binary(at)
+    assert loaded.query("tag_a and not tag_c") == {"doc_1"}
+    assert loaded.query("not tag_a") == {"doc_3"}
+    loaded.tag(docs="doc_4", tags="tag_d")
+    assert loaded.get_docs("tag_d") == {"doc_3", "doc_4"}
+
+
+def test_snapshot_reader(simple_ti: TagIndex, tmp_path):
+    at = str(tmp_path / "index.dtag")
+    simple_ti.to_binary(at)
+    for use_mmap in [True, False]:
+        with Snapshot(at, use_mmap=use_mmap) as snapshot:
+            assert snapshot.doc_names() == ["doc_1", "doc_2", "doc_3"]
+            assert snapshot.tag_names() == ["tag_a", "tag_b", "tag_c", "tag_d"]
+            assert snapshot.find_tag("tag_c") == 2
+            assert snapshot.find_tag("tag_e") is None
+            assert snapshot.find_doc("doc_3") == 2
+            assert snapshot.tag_name(3) == "tag_d"
+            assert list(snapshot.tag_postings(0)) == [0, 1]
+            assert list(snapshot.doc_postings(1)) == [0, 1, 2]
+
+
+def test_snapshot_unicode_and_metadata(tmp_path):
+    at = str(tmp_path / "index.dtag")
+    write_snapshot(at, {"étiquette": ["doc_ü"]}, {"doc_ü": ["étiquette"]}, {"a": 1})
+    with Snapshot(at) as snapshot:
+        assert snapshot.tag_names() == ["étiquette"]
+        assert snapshot.doc_name(0) == "doc_ü"
+        assert snapshot.metadata == {"a": 1}
+
+
+def test_snapshot_invalid(tmp_path):
+    at = tmp_path / "index.json"
+    at.write_text('{"doc_to_tags": {}}' + " " * 200)
+    with pytest.raises(ValueError):
+        Snapshot(str(at))
+
+
+def test_converters(simple_ti: TagIndex, tmp_path):
+    json_at = str(tmp_path / "index.json")
+    binary_at = str(tmp_path / "index.dtag")
+    simple_ti.to_json(json_at)
+    json_to_binary(json_at, binary_at)
+    assert dict(TagIndex.from_binary(binary_at).doc_to_tags) == dict(
+        simple_ti.doc_to_tags
+    )
+    json_again = str(tmp_path / "again.json")
+    binary_to_json(binary_at, json_again)
+    assert dict(TagIndex.from_json(json_again).tag_to_docs) == dict(
+        simple_ti.tag_to_docs
+    )
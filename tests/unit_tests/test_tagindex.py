@@ -1,6 +1,6 @@
 import pytest
 from boolean.boolean import ParseError
-from doctag import TagIndex
+from doctag import BitmapTagIndex, TagIndex
 
 ## test utilities
 
@@ -235,3 +235,302 @@ def test_conflicts_a(simple_ti: TagIndex):
         "'tag_1' in doc_to_tags['doc_z'] but 'doc_z' not in tag_to_docs['tag_1']",
     }
     yes_conflicts(ti=simple_ti)
+
+
+def test_compile(simple_ti: TagIndex):
+    plan = simple_ti.compile("tag_a and not tag_c")
+    assert plan() == {"doc_1"}
+    simple_ti.tag(docs="doc_4", tags="tag_a")
+    assert plan() == {"doc_1", "doc_4"}
+    simple_ti.untag(docs="doc_1", tags="tag_a")
+    assert plan() == {"doc_4"}
+    no_conflicts(ti=simple_ti)
+
+
+def test_query_cache(simple_ti: TagIndex):
+    simple_ti.query_cache_size = 2
+    assert simple_ti.query("tag_a and tag_c") == {"doc_2"}
+    assert simple_ti.query("tag_a   and tag_c") == {"doc_2"}
+    info = simple_ti.query_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+    simple_ti.untag(docs="doc_2", tags="tag_c")
+    assert simple_ti.query("tag_a and tag_c") == set()
+    simple_ti.query("tag_a")
+    simple_ti.query("tag_b")
+    info = simple_ti.query_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 3, 2)
+    simple_ti.clear_query_cache()
+    assert simple_ti.query_cache_info().currsize == 0
+
+
+def test_query_true_false(simple_ti: TagIndex):
+    assert simple_ti.query("tag_a or not tag_a") == {"doc_1", "doc_2", "doc_3"}
+    assert simple_ti.query("tag_a and not tag_a") == set()
+    no_conflicts(ti=simple_ti)
+
+
+def test_query_does_not_alias(simple_ti: TagIndex):
+    result = simple_ti.query("tag_a")
+    result.add("doc_99")
+    assert simple_ti.tag_to_docs["tag_a"] == {"doc_1", "doc_2"}
+
+
+def test_explain(simple_ti: TagIndex):
+    assert simple_ti.explain("tag_a and tag_c and not tag_d") == "\n".join(
+        [
+            "DIFFERENCE (est. 1)",
+            "  INTERSECT (est. 1)",
+            "    TAG 'tag_c' (est. 1)",
+            "    TAG 'tag_a' (est. 2)",
+            "  TAG 'tag_d' (est. 1)",
+        ]
+    )
+    assert simple_ti.explain("not (tag_b or tag_c)") == "\n".join(
+        [
+            "COMPLEMENT (est. 0)",
+            "  UNION (est. 3)",
+            "    TAG 'tag_c' (est. 1)",
+            "    TAG 'tag_b' (est. 2)",
+        ]
+    )
+    assert simple_ti.explain("tag_c or not tag_a") == "\n".join(
+        [
+            "COMPLEMENT (est. 1)",
+            "  DIFFERENCE (est. 2)",
+            "    TAG 'tag_a' (est. 2)",
+            "    TAG 'tag_c' (est. 1)",
+        ]
+    )
+
+
+def test_query_iter(simple_ti: TagIndex):
+    assert set(simple_ti.query_iter("tag_a and not tag_c")) == {"doc_1"}
+    assert set(simple_ti.query_iter("not tag_c")) == {"doc_1", "doc_3"}
+    assert set(simple_ti.query_iter("tag_e")) == set()
+    no_conflicts(ti=simple_ti)
+
+
+def test_query_count(simple_ti: TagIndex):
+    assert simple_ti.query_count("tag_a") == 2
+    assert simple_ti.query_count("tag_e") == 0
+    assert simple_ti.query_count("not tag_c") == 2
+    assert simple_ti.query_count("tag_c or not tag_a") == 2
+    assert simple_ti.query_count("tag_a and tag_b and not tag_c") == 1
+    no_conflicts(ti=simple_ti)
+
+
+def test_query_pagination(simple_ti: TagIndex):
+    assert simple_ti.query("not tag_c", limit=1) == ["doc_1"]
+    assert simple_ti.query("not tag_c", limit=1, offset=1) == ["doc_3"]
+    assert simple_ti.query("not tag_e", limit=2, order="desc") == ["doc_3", "doc_2"]
+    assert simple_ti.query("not tag_e", offset=1) == ["doc_2", "doc_3"]
+    assert simple_ti.query("tag_a", order="asc") == ["doc_1", "doc_2"]
+    with pytest.raises(ValueError):
+        simple_ti.query("tag_a", order="random")
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "tag_a or tag_d",
+        "tag_a and tag_b",
+        "tag_a and not tag_c",
+        "(tag_a or tag_d) and not (tag_b and tag_c)",
+        "not (tag_a and tag_b)",
+        "tag_*",
+    ],
+)
+def test_query_iter_streams(simple_ti: TagIndex, monkeypatch, query):
+    expected = simple_ti.query(query)
+    evaluate = TagIndex._evaluate
+
+    def only_tags(self, node):
+        # Combining postings would build a set as large as the result.
+        assert node.op in ("TAG", "EMPTY")
+        return evaluate(self, node)
+
+    monkeypatch.setattr(TagIndex, "_evaluate", only_tags)
+    iterated = list(simple_ti.query_iter(query))
+    assert sorted(iterated) == sorted(expected)
+    assert simple_ti.query(query, limit=2) == sorted(expected)[:2]
+    assert (
+        simple_ti.query(query, limit=1, offset=1, order="desc")
+        == sorted(expected, reverse=True)[1:2]
+    )
+
+
+def test_batch(simple_ti: TagIndex, monkeypatch):
+    deltas = []
+    validated = []
+    monkeypatch.setattr(
+        simple_ti,
+        "_delta_callback",
+        lambda doc, added, removed: deltas.append((doc, added, removed)),
+    )
+    monkeypatch.setattr(
+        simple_ti, "_tag_validator", lambda tags: validated.append(tags) or tags
+    )
+    with simple_ti.batch():
+        simple_ti.tag(docs=["doc_1", "doc_3"], tags="tag_x")
+        simple_ti.untag(docs="doc_3", tags=["tag_x", "tag_d"])
+        simple_ti.tag(docs="doc_3", tags="tag_x")
+        assert simple_ti.query("tag_x") == {"doc_1", "doc_3"}
+        assert not deltas
+    assert sorted(deltas) == [
+        ("doc_1", {"tag_x"}, set()),
+        ("doc_3", {"tag_x"}, {"tag_d"}),
+    ]
+    assert validated == [["tag_x"]]
+    no_conflicts(ti=simple_ti)
+
+
+def test_batch_merge_tags(simple_ti: TagIndex, monkeypatch):
+    deltas = []
+    monkeypatch.setattr(
+        simple_ti,
+        "_delta_callback",
+        lambda doc, added, removed: deltas.append((doc, added, removed)),
+    )
+    simple_ti.merge_tags(old_tags=["tag_a", "tag_c"], new_tag="tag_e")
+    assert sorted(deltas) == [
+        ("doc_1", {"tag_e"}, {"tag_a"}),
+        ("doc_2", {"tag_e"}, {"tag_a", "tag_c"}),
+    ]
+
+
+def test_stats(simple_ti: TagIndex):
+    assert simple_ti.stats() == (3, 4, 6)
+    assert simple_ti.tag_frequency("tag_a") == 2
+    assert simple_ti.tag_frequency("tag_z") == 0
+    assert simple_ti.doc_tag_count("doc_2") == 3
+    assert simple_ti.doc_tag_count("doc_z") == 0
+    assert simple_ti.top_tags(3) == [("tag_a", 2), ("tag_b", 2), ("tag_c", 1)]
+    simple_ti.tag(docs=["doc_1", "doc_4"], tags=["tag_a", "tag_e"])
+    assert simple_ti.stats() == (4, 5, 9)
+    simple_ti.merge_tags(old_tags=["tag_a", "tag_b"], new_tag="tag_f")
+    assert simple_ti.stats() == (4, 4, 7)
+    simple_ti.rename_doc("doc_2", "doc_5")
+    simple_ti.remove_doc("doc_3")
+    assert simple_ti.stats() == (3, 3, 6)
+    assert simple_ti.top_tags(1) == [("tag_f", 3)]
+    assert simple_ti.stats().pairs == sum(
+        len(tags) for tags in simple_ti.doc_to_tags.values()
+    )
+
+
+@pytest.mark.parametrize("cls", [TagIndex, BitmapTagIndex])
+def test_query_wildcards(cls):
+    ti = cls()
+    ti.tag(docs="doc_1", tags=["proj/alpha/design", "proj/alpha/code"])
+    ti.tag(docs="doc_2", tags=["proj/beta/design", "design"])
+    ti.tag(docs="doc_3", tags=["projection", "designer"])
+    assert ti.match_tags("proj/*") == [
+        "proj/alpha/code",
+        "proj/alpha/design",
+        "proj/beta/design",
+    ]
+    assert ti.match_tags("proj/*/design") == ["proj/alpha/design", "proj/beta/design"]
+    assert ti.match_tags("design?r") == ["designer"]
+    assert ti.query("proj/*") == {"doc_1", "doc_2"}
+    assert ti.query("design*") == {"doc_2", "doc_3"}
+    assert ti.query("proj* and not proj/alpha/*") == {"doc_2", "doc_3"}
+    assert ti.query("nothing/*") == set()
+    assert ti.query_count("not proj/*") == 1
+    assert ti.explain("proj/beta/*") == ti.explain("proj/beta/design")
+
+    # The tag dictionary follows later changes.
+    ti.tag(docs="doc_3", tags="proj/gamma")
+    ti.remove_tag("proj/alpha/code")
+    ti.remove_tag("proj/alpha/design")
+    assert ti.query("proj/*") == {"doc_2", "doc_3"}
+    assert ti.match_tags("*") == sorted(ti.tags)
+    with pytest.raises(ValueError):
+        ti.tag(docs="doc_1", tags="proj/*")
+
+
+@pytest.mark.parametrize("cls", [TagIndex, BitmapTagIndex])
+def test_bulk_load(simple_ti: TagIndex, cls, monkeypatch):
+    ti = cls()
+    callbacks = []
+    validated = []
+    monkeypatch.setattr(
+        ti, "_tag_callback", lambda docs, tags: callbacks.append((docs, sorted(tags)))
+    )
+    monkeypatch.setattr(
+        ti, "_tag_validator", lambda tags: validated.append(tags) or tags
+    )
+    pairs = sorted(simple_ti.export_pairs())
+    assert len(pairs) == 6
+    assert ti.bulk_load(iter(pairs), chunk_size=4) == 6
+    assert dict(ti.doc_to_tags) == dict(simple_ti.doc_to_tags)
+    assert ti.stats() == simple_ti.stats()
+    assert [sorted(tags) for tags in validated] == [
+        ["tag_a", "tag_b"],
+        ["tag_c", "tag_d"],
+    ]
+    # doc_2's pairs straddle the two chunks, so it gets one callback per chunk.
+    assert sorted(callbacks) == [
+        (["doc_1"], ["tag_a", "tag_b"]),
+        (["doc_2"], ["tag_a", "tag_b"]),
+        (["doc_2"], ["tag_c"]),
+        (["doc_3"], ["tag_d"]),
+    ]
+    assert sorted(ti.export_pairs()) == pairs
+
+    callbacks.clear()
+    with ti.batch():
+        ti.bulk_load([("doc_1", "tag_e"), ("doc_1", "tag_f"), ("doc_3", "tag_e")])
+        assert not callbacks
+    assert sorted(callbacks) == [
+        (["doc_1"], ["tag_e", "tag_f"]),
+        (["doc_3"], ["tag_e"]),
+    ]
+    with pytest.raises(ValueError):
+        ti.bulk_load([("doc_4", "true")])
+
+
+@pytest.mark.parametrize("cls", [TagIndex, BitmapTagIndex])
+def test_views(simple_ti: TagIndex, cls):
+    ti = cls()
+    ti.bulk_load(simple_ti.export_pairs())
+    queries = {
+        "and_not": "tag_a and not tag_c",
+        "or": "tag_c or tag_d",
+        "not": "not tag_b",
+        "wildcard": "tag_* and not tag_a",
+        "all": "true",
+    }
+    for name, query in queries.items():
+        assert ti.register_view(name, query) == ti.query(query)
+    assert ti.views == queries
+
+    def check():
+        for name, query in queries.items():
+            assert ti.view(name) == ti.query(query), name
+
+    ti.tag(docs=["doc_3", "doc_4"], tags="tag_a")
+    check()
+    ti.untag(docs="doc_2", tags=["tag_b", "tag_c"])
+    check()
+    ti.tag(docs="doc_5", tags="tag_e")
+    check()
+    ti.remove_doc("doc_1")
+    check()
+    ti.bulk_load([("doc_6", "tag_c"), ("doc_4", "tag_b")])
+    check()
+    ti.rename_doc("doc_4", "doc_7")
+    check()
+    ti.remove_tag("tag_a")
+    check()
+
+    ti.register_view("or", "tag_b")
+    queries["or"] = "tag_b"
+    check()
+    ti.unregister_view("not")
+    del queries["not"]
+    ti.tag(docs="doc_8", tags="tag_f")
+    check()
+    with pytest.raises(ValueError):
+        ti.view("not")
+    with pytest.raises(ValueError):
+        ti.unregister_view("not")
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+import pytest
+from doctag import FileTagIndex
+from doctag.watch import INotify, Watcher
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        "poll",
+        pytest.param(
+            "inotify",
+            marks=pytest.mark.skipif(INotify is None, reason="needs inotify_simple"),
+        ),
+    ],
+)
+def test_watch(tmp_path, backend):
+    doc = str(tmp_path / "file1.md")
+    open(doc, "w").close()
+    fti = FileTagIndex(root_dir=str(tmp_path), file_types=["md"])
+    writer = FileTagIndex(root_dir=str(tmp_path))
+    with fti.watch(debounce=0.05, poll_interval=0.05, backend=backend) as watcher:
+        time.sleep(0.1)
+        writer.tag(docs=doc, tags="a")
+        assert wait_for(lambda: fti.query("a") == {doc})
+        os.makedirs(str(tmp_path / "more"))
+        new_doc = str(tmp_path / "more" / "file2.md")
+        open(new_doc, "w").close()
+        writer.tag(docs=new_doc, tags="b")
+        assert wait_for(lambda: fti.query("b") == {new_doc})
+        os.remove(doc)
+        assert wait_for(lambda: fti.query("a") == set())
+        stats = watcher.stats()
+    assert stats.backend == backend
+    assert stats.events >= 3
+    assert stats.batches >= 3
+    assert stats.queue_depth == 0
+    assert stats.max_lag >= stats.lag >= 0
+    assert not fti.conflicts
+
+
+def test_watch_invalid_backend(tmp_path):
+    fti = FileTagIndex(root_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        Watcher(fti, backend="kqueue")
+
+
+def test_watch_applies_under_lock(tmp_path):
+    paths = [str(tmp_path / f"file{i}.md") for i in range(20)]
+    for path in paths:
+        open(path, "w").close()
+    fti = FileTagIndex(root_dir=str(tmp_path), file_types=["md"])
+    fti.scan()
+    fti.to_json(at=str(tmp_path / "index.json"))
+    writer = FileTagIndex(root_dir=str(tmp_path))
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            writer.tag(docs=paths[i % len(paths)], tags=f"t{i % 7}")
+            writer.untag(docs=paths[(i + 3) % len(paths)], tags=f"t{(i + 3) % 7}")
+            i += 1
+
+    thread = threading.Thread(target=write)
+    with fti.watch(debounce=0.01, poll_interval=0.01, backend="poll") as watcher:
+        thread.start()
+        try:
+            deadline = time.monotonic() + 1.0
+            while time.monotonic() < deadline:
+                # None of these may see the index change halfway through.
+                fti.to_json()
+                list(fti.query_iter("not t0"))
+                list(fti.export_pairs())
+                fti.stats()
+                assert not fti.conflicts
+                with fti.lock:
+                    before = {doc: set(tags) for doc, tags in fti.doc_to_tags.items()}
+                    time.sleep(0.05)
+                    assert {
+                        doc: set(tags) for doc, tags in fti.doc_to_tags.items()
+                    } == before
+        finally:
+            stop.set()
+            thread.join()
+    assert watcher.stats().batches > 0
+
+
+def test_watch_applies_without_the_owner(tmp_path):
+    doc = str(tmp_path / "file1.md")
+    open(doc, "w").close()
+    fti = FileTagIndex(root_dir=str(tmp_path), file_types=["md"])
+    with fti.watch(debounce=0.3, poll_interval=0.02, backend="poll") as watcher:
+        time.sleep(0.1)
+        FileTagIndex(root_dir=str(tmp_path)).tag(docs=doc, tags="a")
+        assert wait_for(lambda: watcher.stats().queue_depth == 1)
+        time.sleep(0.1)
+        # Lag runs from the oldest event which is not applied yet.
+        assert watcher.stats().lag >= 0.1
+        # Nothing calls into fti here, yet its maps and other threads see the change.
+        assert wait_for(lambda: fti.doc_to_tags.get(doc) == {"a"})
+        seen = []
+        reader = threading.Thread(target=lambda: seen.append(fti.query("a")))
+        reader.start()
+        reader.join()
+        assert seen == [{doc}]
+        stats = watcher.stats()
+    assert stats.batches == 1
+    assert stats.files == 1
+    assert stats.lag == 0.0
+    assert stats.max_lag >= 0.3
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+from doctag.writeback import WriteBack
+
+
+def test_write_back_order_and_errors():
+    applied = []
+
+    def rewrite(doc, added, removed):
+        if doc == "bad":
+            raise OSError("no such file")
+        applied.append((doc, added, removed))
+
+    write_back = WriteBack(rewrite, workers=2, queue_size=4)
+    for i in range(20):
+        write_back.submit(doc="doc_1", added=[str(i)], removed=[])
+    write_back.submit(doc="bad", added=["a"], removed=[])
+    write_back.submit(doc="doc_2", added=[], removed=["b"])
+    assert write_back.flush() == {"bad": "no such file"}
+    assert write_back.pending == 0
+    assert [added for doc, added, _ in applied if doc == "doc_1"] == [
+        (str(i),) for i in range(20)
+    ]
+    assert ("doc_2", (), ("b",)) in applied
+    assert write_back.close() == {}
+    with pytest.raises(ValueError):
+        write_back.submit(doc="doc_1", added=["a"], removed=[])
+
+
+def test_write_back_survives_any_error():
+    applied = []
+
+    def rewrite(doc, added, removed):
+        if doc == "bad":
+            raise KeyError(doc)
+        applied.append(doc)
+
+    write_back = WriteBack(rewrite, workers=1)
+    write_back.submit(doc="bad", added=["a"], removed=[])
+    write_back.submit(doc="doc_1", added=["a"], removed=[])
+    assert write_back.close() == {"bad": "'bad'"}
+    assert applied == ["doc_1"]
+
+
+def test_write_back_backpressure():
+    release = threading.Event()
+    write_back = WriteBack(lambda *args: release.wait(), workers=1, queue_size=2)
+    submitter = threading.Thread(
+        target=lambda: [
+            write_back.submit(doc="doc_1", added=["a"], removed=[]) for _ in range(5)
+        ]
+    )
+    submitter.start()
+    submitter.join(timeout=0.2)
+    assert submitter.is_alive()
+    release.set()
+    submitter.join()
+    write_back.close()